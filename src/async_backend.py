@@ -5,100 +5,183 @@
 
 
 import time
+import os
 import uuid
 import queue
 import psutil
+import platform
+import asyncio
 import logging
 import objgraph
-import threading
-import tracemalloc
+import functools
 import collections
-import timeout_decorator
-from typing import Any, Dict
-from llm_sandbox import SandboxSession
-from logging.handlers import RotatingFileHandler
-from flask import Flask, request, jsonify, redirect
+import contextlib
+import contextvars
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, Optional, Set, Tuple
+from llm_sandbox import SandboxSession, ContainerPool, LibraryImageCache, ArtifactCache, BuildCache, ResultStore, ResultCache, InputStore, CoreLeaseManager, Metrics
+from llm_sandbox.image import prepare_images
+from llm_sandbox.client import registry as docker_clients
+from llm_sandbox.image_registry import get_image_registry
+from llm_sandbox.repeat import run_repeated, parse_repeat
+from llm_sandbox.input_store import parse_digest
+from llm_sandbox.scheduler import FairShareScheduler, DEFAULT_CLIENT
+from llm_sandbox.structured_log import setup_logging, correlation_id
+from quart import Quart, Response, request, jsonify, redirect
+from quart.wrappers import Request
 
 # Start Memory Tracing
 tracemalloc.start()
 
-# Set up logging
-log_handler = RotatingFileHandler(
-    filename='monolith.log',
-    maxBytes=100 * 1024 * 1024,  # 50MB
-    backupCount=5
-)
-log_handler.setLevel(logging.INFO)
-log_formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s', '%Y-%m-%d %H:%M:%S')
-log_handler.setFormatter(log_formatter)
-
-logger = logging.getLogger()
-logger.handlers.clear()
-logger.setLevel(logging.INFO)
-logger.addHandler(log_handler)
+def judge_case(task_result: Dict, expected_output: str) -> str:
+    output_dict = task_result['output_dict'] or {}
+    if task_result['status'] != 'done':
+        return task_result['status']
+    if output_dict.get('compiled') is False:
+        return 'compile_error'
+    if expected_output is None:
+        return 'done'
+    # Compared inside the sandbox, see session.run(expected_output=...)
+    return 'accepted' if output_dict.get('output_matched') else 'wrong_answer'
+
 
 class MonolithManager:
-    def __init__(self, number_of_worker, queue_size, result_cache_size, mem_limit):
-        self.task_queue = queue.Queue(maxsize=queue_size)
-        self.task_results = collections.OrderedDict()
-        self.task_results_lock = threading.RLock()
-        self.result_cache_size = result_cache_size
+    def __init__(self, number_of_worker, queue_size, result_memory_budget, result_ttl, mem_limit, housekeeping_cores=1, smt_exclusive=True, max_queued_per_client=None, max_running_per_client=None, client_weights=None, pool_size=1, pool_max_reuse=64, pool_idle_timeout=600, library_cache_budget=20 * 1024 ** 3, artifact_cache_budget=5 * 1024 ** 3, build_cache_budget=10 * 1024 ** 3, result_cache_entries=10000, result_cache_budget=64 * 1024 ** 2, result_cache_ttl=3600, input_store_budget=20 * 1024 ** 3, max_input_bytes=1024 ** 3):
+        # One worker per leasable physical core (SMT siblings idle, housekeeping cores reserved), at most number_of_worker.
+        self.cores = CoreLeaseManager(housekeeping_cores=housekeeping_cores, smt_exclusive=smt_exclusive, max_slots=number_of_worker)
+        number_of_worker = len(self.cores)
+        # One Docker connection per executor thread, plus the pool refill, library cache and build cache threads.
+        docker_clients.configure(max_pool_size=number_of_worker + 4)
+        if platform.system().lower() == "linux":
+            # The backend itself (event loop, Docker calls, pool threads) stays on the housekeeping cores.
+            os.sched_setaffinity(0, set(self.cores.housekeeping))
+
+        # Tasks wait in per-client queues and are dispatched by weighted fair share, one task per free core.
+        # A dispatched task is a coroutine on the event loop, only its blocking Docker calls run on the executor threads.
+        self.queue_size = queue_size
+        self.scheduler = FairShareScheduler(
+            max_queued=queue_size,
+            max_queued_per_client=max_queued_per_client,
+            max_running_per_client=max_running_per_client,
+            client_weights=client_weights,
+        )
+        self.free_workers = number_of_worker
+        self.running_tasks: Set[asyncio.Task] = set()
+        # Cases of batches larger than the queue limit of their client, queued as earlier cases leave the queue.
+        self.batch_backlogs: Dict[str, Tuple[str, Optional[str], Deque[Tuple[str, Dict]]]] = dict()
+        self.executor = ThreadPoolExecutor(max_workers=number_of_worker, thread_name_prefix='monolith-worker')
+        # In-flight results are never evicted, finished ones expire after result_ttl or spill to disk over the memory budget.
+        self.task_results = ResultStore(memory_budget=result_memory_budget, ttl=result_ttl)
+        # Serializing results and the SQLite spill run on a thread of their own, off the event loop and not behind the
+        # Docker calls of the workers. A single thread also applies the updates of a task in order.
+        self.store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='monolith-results')
+        self.task_events: Dict[str, asyncio.Event] = dict()
+        # Identical submissions share one execution while it runs, and finished ones are served from the cache.
+        self.result_cache = ResultCache(max_entries=result_cache_entries, memory_budget=result_cache_budget, ttl=result_cache_ttl)
+        self.task_fingerprints: Dict[str, str] = dict()
         self.number_of_worker = number_of_worker
         self.worker_status = [False] * number_of_worker
         self.mem_limit = mem_limit
         self.mem_swappiness = 0
         self.memswap_limit = mem_limit
         self.oom_kill_disable = False
-        
-        # Worker Initialization
-        for worker_index in range(self.number_of_worker):
-            app.logger.info(f'[+] Creating Worker-{worker_index}...')
-            threading.Thread(target=self.task_assign, args=(worker_index,)).start()
+        self.build_cache = BuildCache(max_bytes=build_cache_budget)
+        self.build_cache.start_pruner()
+        # Large inputs are uploaded once to /inputs and mounted read-only into every container.
+        self.input_store = InputStore(max_bytes=input_store_budget, max_input_bytes=max_input_bytes)
+        self.container_pool = ContainerPool(pool_size=pool_size, max_reuse=pool_max_reuse, idle_timeout=pool_idle_timeout, build_cache=self.build_cache, input_store=self.input_store)
+        self.library_cache = LibraryImageCache(disk_budget=library_cache_budget)
+        self.artifact_cache = ArtifactCache(max_bytes=artifact_cache_budget)
+        self.metrics = Metrics()
+
+    async def start(self) -> None:
+        # Worker Initialization (on the event loop of the server)
+        for worker_index, (cpu, idle_siblings) in enumerate(self.cores.slots):
+            app.logger.info(f'[+] Creating Worker-{worker_index} on CPU-{cpu} (idle siblings: {idle_siblings})...')
+            self.worker_status[worker_index] = True
+        app.logger.info(f'[+] Housekeeping CPUs: {self.cores.housekeeping}')
         app.logger.info(f'[+] Monolith (number of works = {self.number_of_worker}) is ready to accept tasks.')
-            
+
+    async def stop(self) -> None:
+        # Cancelled tasks still release their containers, the pool then discards every container it holds.
+        self.batch_backlogs.clear()
+        for task in list(self.running_tasks):
+            task.cancel()
+        await asyncio.gather(*self.running_tasks, return_exceptions=True)
+        app.logger.info(f'[-] Cancelled the running tasks, {len(self.scheduler)} queued tasks are dropped.')
+        self.build_cache.stop_pruner()
+        await self.blocking(self.container_pool.shutdown)
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.store_executor.shutdown(wait=True)
+
+    async def blocking(self, function, *args):
+        # run_in_executor does not carry context variables, the copy keeps the correlation id of the task in the thread.
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(contextvars.copy_context().run, function, *args))
+
+    async def store(self, function, *args):
+        # Calls of the result store (put, get, pop), in submission order on the result store thread.
+        return await asyncio.get_running_loop().run_in_executor(self.store_executor, functools.partial(function, *args))
+
     def get_status(self) -> Dict[str, Any]:
         mem = psutil.virtual_memory()
         total_gb = mem.total / (1024 ** 3)
         available_gb = mem.available / (1024 ** 3)
         used_gb = mem.used / (1024 ** 3)
             
-        with self.task_results_lock:
-            return {
-                'max_queue_size': self.task_queue.maxsize,
-                'current_queue_size': self.task_queue.qsize(),
-                'max_result_cache_size': self.result_cache_size,
-                'current_result_cache_size': len(self.task_results),
-                'number_of_worker': self.number_of_worker,
-                'worker_status': self.worker_status,
-                'memory_usage': {
-                    'total': total_gb,
-                    'used_gb': used_gb,
-                    'available': available_gb,
-                    'percent': mem.percent
-                },
-            }
+        return {
+            'max_queue_size': self.queue_size,
+            'current_queue_size': len(self.scheduler),
+            'scheduler': self.scheduler.get_status(),
+            'batch_backlog': sum(len(cases) for _, _, cases in self.batch_backlogs.values()),
+            'result_store': self.task_results.get_status(),
+            'result_cache': self.result_cache.get_status(),
+            'number_of_worker': self.number_of_worker,
+            'worker_status': self.worker_status,
+            'cores': self.cores.get_status(),
+            'container_pool': self.container_pool.get_status(),
+            'library_cache': self.library_cache.get_status(),
+            'artifact_cache': self.artifact_cache.get_status(),
+            'build_cache': self.build_cache.get_status(),
+            'input_store': self.input_store.get_status(),
+            'docker_client': docker_clients.get_status(),
+            'image_registry': get_image_registry().get_status(),
+            'memory_usage': {
+                'total': total_gb,
+                'used_gb': used_gb,
+                'available': available_gb,
+                'percent': mem.percent
+            },
+        }
     
-    def task_clean(self, result_cache_limit) -> None:
-        # TODO(mingzhe): call this function smarter
-        with self.task_results_lock:
-            app.logger.debug(f'[-] Cleaning task results: {len(self.task_results)}')
-            while len(self.task_results) >= result_cache_limit:
-                self.task_results.popitem(last=False)
-
-    def task_assign(self, worker_id) -> None:
-        app.logger.debug(f'[-] Worker-{worker_id} is ready to work.')
-        while True:
-            # Set the worker status to True (idle)
-            with self.task_results_lock:
-                self.worker_status[worker_id] = True
-            
-            # Wait for a task
-            task_id, input_dict = self.task_queue.get()
-            
-            # Set the worker status to False (Occupied)
-            with self.task_results_lock:
-                self.worker_status[worker_id] = False
-                
+    async def task_register(self, task_id: str, record: Dict) -> None:
+        # Registered on submission, so that clients can wait on queued tasks as well.
+        self.task_events[task_id] = asyncio.Event()
+        await self.store(self.task_results.put, task_id, record)
+
+    def task_finish(self, task_id: str) -> None:
+        # Wake up the clients long-polling this task, later requests see the finished result directly.
+        event = self.task_events.pop(task_id, None)
+        if event:
+            event.set()
+
+    async def task_wait(self, task_id: str, timeout: float) -> None:
+        event = self.task_events.get(task_id)
+        if event and timeout > 0:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(event.wait(), timeout)
+
+    async def task_assign(self, client: str, task_id: str, input_dict: Dict, queued_at: float) -> None:
+        # Each dispatched task is its own asyncio task, so the correlation id stays with it.
+        correlation_id.set(task_id)
+        # Dispatched tasks always find a free core
+        lease = self.cores.acquire(owner=task_id, blocking=False)
+        queue_wait = time.time() - queued_at
+        worker_id = lease.index
+
+        # Set the worker status to False (Occupied)
+        self.worker_status[worker_id] = False
+        try:
             task_result = {
                 'task_id': task_id,
                 'input_dict': input_dict,
@@ -106,67 +189,203 @@ class MonolithManager:
                 'timestamp': time.time(),
                 'process_time': float('inf'),
                 'status': 'processing',
-                'output_dict': None
+                'output_dict': None,
+                'phase_times': {'queue_wait': queue_wait},
             }
             app.logger.info(f'[-] Worker-{worker_id} is processing task-{task_id}...')
 
             try:
                 # Register the task
-                with self.task_results_lock:
-                    self.task_results[task_id] = task_result
+                await self.task_update(task_id, input_dict, task_result)
                     
                 # Process the task
-                processed_result = self.task_process(worker_id, input_dict, task_result)
+                processed_result = await self.task_process(worker_id, lease.cpu, input_dict, task_result)
 
                 # Update the task
-                with self.task_results_lock:
-                    self.task_results[task_id] = processed_result
+                await self.task_update(task_id, input_dict, processed_result)
             except Exception as e:
                 error_result = {
                     'status': 'error',
                     'output_dict': {'error': f"Error: {str(e)}"}
                 }
                 task_result.update(error_result)
-                with self.task_results_lock:
-                    self.task_results[task_id] = task_result
+                await self.task_update(task_id, input_dict, task_result)
                 app.logger.error(f'[!] Worker-{worker_id} encountered an error on processing task-{task_id}: {e}')
-            finally:
-                self.task_clean(result_cache_limit=self.result_cache_size)
-                self.task_queue.task_done()
+            output_dict = task_result['output_dict'] or {}
+            # Tasks cancelled on shutdown come back still processing and are not counted.
+            if task_result['status'] != 'processing':
+                self.metrics.record_task(
+                    input_dict.get('language'),
+                    task_result['status'],
+                    phase_times=task_result['phase_times'],
+                    timeout_phase=output_dict.get('timeout_phase') or ('setup' if task_result['status'] == 'timeout' else None),
+                    oom_killed=bool(output_dict.get('oom_killed')),
+                )
+            await self.task_complete(task_id, task_result)
+        finally:
+            # Set the worker status to True (idle) and hand the core to the next task
+            self.worker_status[worker_id] = True
+            self.cores.release(lease)
+            self.scheduler.finish(client)
+            self.free_workers += 1
+            self.dispatch()
 
-    def task_process(self, worker_id: int, input_dict: Dict, task_result: Dict) -> Dict:
+    async def task_update(self, task_id: str, input_dict: Dict, task_result: Dict) -> None:
+        if 'batch_id' not in input_dict:
+            await self.store(self.task_results.put, task_id, task_result)
+            if task_result['status'] != 'processing':
+                self.task_finish(task_id)
+        elif task_result['status'] != 'processing':
+            await self.batch_update(input_dict['batch_id'], input_dict['case_index'], input_dict.get('expected_output'), task_result)
+
+    async def task_complete(self, task_id: str, task_result: Dict) -> None:
+        # Followers of a coalesced task get a copy of its result, and a finished result is cached for later submissions.
+        fingerprint = self.task_fingerprints.pop(task_id, None)
+        if fingerprint is None:
+            return
+        followers = self.result_cache.complete(fingerprint, task_result if task_result['status'] == 'done' else None)
+        if task_result['status'] == 'processing':
+            # Cancelled on shutdown
+            return
+        for follower in followers:
+            await self.store(self.task_results.put, follower, {**task_result, 'task_id': follower, 'coalesced_with': task_id})
+            self.task_finish(follower)
+
+    async def batch_update(self, batch_id: str, case_index: int, expected_output: str, task_result: Dict) -> None:
+        batch = await self.store(self.task_results.get, batch_id)
+        if batch is None:
+            app.logger.warning(f'[!] Batch [{batch_id}] is gone, dropping the result of case {case_index}.')
+            return
+
+        output_dict = task_result['output_dict'] or {}
+        batch['output_dict']['cases'][case_index] = {
+            'case_index': case_index,
+            'verdict': judge_case(task_result, expected_output),
+            'worker_id': task_result.get('worker_id'),
+            'process_time': task_result.get('process_time'),
+            **output_dict,
+        }
+        batch['output_dict']['finished'] += 1
+        if batch['output_dict']['finished'] == len(batch['output_dict']['cases']):
+            verdicts = [case['verdict'] for case in batch['output_dict']['cases']]
+            batch['output_dict']['passed'] = verdicts.count('accepted')
+            batch['process_time'] = time.time() - batch['timestamp']
+            batch['status'] = 'done'
+        # Every case goes through put(), so that the store accounts for the size of the batch as it grows.
+        await self.store(self.task_results.put, batch_id, batch)
+        if batch['status'] == 'done':
+            self.task_finish(batch_id)
+
+    async def task_process(self, worker_id: int, cpu: int, input_dict: Dict, task_result: Dict) -> Dict:
         start_time = time.time()
+        phase_times = task_result['phase_times']
+
+        async def timed(phase, function, *args):
+            phase_start = time.perf_counter()
+            try:
+                return await self.blocking(function, *args)
+            finally:
+                phase_times[phase] = phase_times.get(phase, 0.0) + time.perf_counter() - phase_start
+
         try:
             code = input_dict['code']
             libraries = input_dict.get('libraries', [])
             language = input_dict['language']
             timeout = min(input_dict.get('timeout', 30), 120)
+            compile_timeout = min(input_dict.get('compile_timeout', default_compile_timeout), max_compile_timeout)
             run_profiling = input_dict.get('run_memory_profile', False)
             stdin = input_dict.get('stdin', None)
+            stdin_digest = input_dict.get('stdin_digest', None)
+            input_files = input_dict.get('input_files', None)
+            expected_output = input_dict.get('expected_output', None)
+            use_process = input_dict.get('sandbox', 'docker') == 'process'
+            # Validated and bounded on submission, see parse_repeat()
+            repeat = input_dict.get('repeat') or 1
+            warmup = input_dict.get('warmup') or 0
             # TODO(mingzhe): Move it to config
             container_configs = {
                 'mem_limit': self.mem_limit,
                 'mem_swappiness': self.mem_swappiness,
                 'memswap_limit': self.memswap_limit,
                 'oom_kill_disable': self.oom_kill_disable,
-                'cpuset_cpus': str(worker_id)
+                'cpuset_cpus': str(cpu)
             }
 
-            with SandboxSession(lang=language, verbose=False, container_configs=container_configs) as session:
+            if use_process and libraries:
+                raise ValueError('Libraries are only installed by the Docker sandbox')
+
+            # Libraries are baked into a cached derived image, so the container only has to run the code.
+            image = await timed('image_lookup', self.library_cache.acquire, language, libraries, None, setup_timeout) if libraries else None
+            try:
+                if use_process:
+                    # A confined host process per task, it starts in milliseconds so it is not pooled.
+                    session = SandboxSession(lang=language, container_configs=container_configs, use_process=True, input_store=self.input_store)
+                    await timed('container_start', session.open)
+                else:
+                    session = await timed('container_start', self.container_pool.acquire, language, container_configs, image)
+                reusable = False
                 try:
-                    @timeout_decorator.timeout(timeout, use_signals=False)
-                    def setup_and_run():
-                        session.setup(libraries=libraries)
-                        result = session.run(code=code, stdin=stdin, run_profiling=run_profiling)
-                        return result
-
-                    result = setup_and_run()
-                    task_result['output_dict'] = result
-                    task_result['status'] = 'done'
-                except timeout_decorator.timeout_decorator.TimeoutError:
-                    session.kill()
-                    task_result['status'] = 'timeout'
-                    task_result['output_dict'] = {'error': 'Timeout reached.'}
+                    def run():
+                        if repeat > 1 or warmup:
+                            # Warm runs in the same container, summarized in output_dict['repeat'].
+                            return run_repeated(
+                                session,
+                                code,
+                                stdin,
+                                repeat,
+                                warmup,
+                                include_samples=input_dict.get('include_samples', False),
+                                run_profiling=run_profiling,
+                                time_budget=max_repeat_time,
+                                artifact_cache=self.artifact_cache,
+                                compile_timeout=compile_timeout,
+                                run_timeout=timeout,
+                                max_output_bytes=max_output_bytes,
+                                stdin_digest=stdin_digest,
+                                input_files=input_files,
+                                expected_output=expected_output,
+                            )
+                        return session.run(
+                            code=code,
+                            stdin=stdin,
+                            run_profiling=run_profiling,
+                            artifact_cache=self.artifact_cache,
+                            compile_timeout=compile_timeout,
+                            run_timeout=timeout,
+                            max_output_bytes=max_output_bytes,
+                            stdin_digest=stdin_digest,
+                            input_files=input_files,
+                            expected_output=expected_output,
+                        )
+
+                    try:
+                        # Deadlines are enforced by the session (in-container timeout plus a host watchdog).
+                        await timed('setup', session.setup, [], False, setup_timeout)
+                        result = await self.blocking(run)
+                        phase_times.update(result.pop('phase_times'))
+                        task_result['output_dict'] = result
+                        if result['timeout_phase']:
+                            # The measurements up to the deadline are kept in output_dict.
+                            task_result['status'] = 'timeout'
+                            result['error'] = f"Timeout reached ({result['timeout_phase']})."
+                        else:
+                            task_result['status'] = 'done'
+                            reusable = True
+                    except TimeoutError:
+                        task_result['status'] = 'timeout'
+                        task_result['output_dict'] = {'error': 'Timeout reached (setup).'}
+                finally:
+                    if use_process:
+                        await timed('teardown', session.close)
+                    else:
+                        await timed('teardown', self.container_pool.release, session, reusable)
+            finally:
+                if image:
+                    await timed('teardown', self.library_cache.release, image)
+        except TimeoutError:
+            # Installing the libraries took longer than the setup may.
+            task_result['status'] = 'timeout'
+            task_result['output_dict'] = {'error': 'Timeout reached (setup).'}
         except Exception as e:
             task_result['status'] = 'error'
             task_result['output_dict'] = {'error': str(e), 'traceback': logging.exception(e)}
@@ -175,49 +394,225 @@ class MonolithManager:
             app.logger.info(f'[Monolith Manager] Worker-{worker_id} finished task [{task_result["task_id"]}] in {task_result["process_time"]:.2f} ms.')
             return task_result
         
-    def submit_task(self, task_id: str, input_dict: Dict) -> None:
+    def feed_batches(self) -> None:
+        # Queue the waiting cases of the batches as far as the queue limits allow, oldest batch first.
+        for batch_id, (client, priority, cases) in list(self.batch_backlogs.items()):
+            while cases and self.scheduler.can_accept(client):
+                case_id, case_input = cases.popleft()
+                self.scheduler.push(client, (case_id, case_input, time.time()), priority=priority)
+            if not cases:
+                del self.batch_backlogs[batch_id]
+
+    def dispatch(self) -> None:
+        # Start the next tasks of the scheduler on the free cores.
+        self.feed_batches()
+        while self.free_workers > 0:
+            next_task = self.scheduler.pop()
+            if next_task is None:
+                return
+            client, (task_id, input_dict, queued_at) = next_task
+            self.free_workers -= 1
+            task = asyncio.create_task(self.task_assign(client, task_id, input_dict, queued_at))
+            self.running_tasks.add(task)
+            task.add_done_callback(self.running_tasks.discard)
+
+    async def submit_task(self, task_id: str, input_dict: Dict, client: str = DEFAULT_CLIENT) -> None:
+        record = {
+            'task_id': task_id,
+            'input_dict': input_dict,
+            'worker_id': None,
+            'timestamp': time.time(),
+            'process_time': float('inf'),
+            'status': 'processing',
+            'output_dict': None
+        }
+
+        # Invalid requests are refused before they can lead identical ones (the priority is not part of the fingerprint).
+        self.scheduler.get_priority(input_dict.get('priority'))
+
+        # Identical submissions are answered from the cache, or attach to the task in flight without taking a worker.
+        fingerprint = self.result_cache.fingerprint(input_dict)
+        if fingerprint is None:
+            self.metrics.inc('result_cache_total', outcome='bypass')
+        else:
+            cached = self.result_cache.lookup(fingerprint)
+            if cached is not None:
+                self.metrics.inc('result_cache_total', outcome='hit')
+                await self.store(self.task_results.put, task_id, {**cached, 'task_id': task_id, 'input_dict': input_dict, 'cached': True})
+                return
+            in_flight = self.result_cache.attach(fingerprint, task_id, store=self.result_cache.storable(input_dict))
+            if in_flight is not None:
+                self.metrics.inc('result_cache_total', outcome='coalesced')
+                await self.task_register(task_id, record)
+                app.logger.info(f'[Monolith Manager] Task [{task_id}] is attached to the identical task [{in_flight["leader"]}].')
+                return
+            self.metrics.inc('result_cache_total', outcome='miss')
+
         try:
-            self.task_queue.put((task_id, input_dict), block=False)
-        except queue.Full:
-            app.logger.warning(f'[!] Task queue is full. Unable to submit task [{task_id}]')
+            self.scheduler.push(client, (task_id, input_dict, time.time()), priority=input_dict.get('priority'))
+        except Exception as e:
+            # This task will never run, so no identical submission may wait for it.
+            if fingerprint is not None:
+                self.result_cache.complete(fingerprint, None)
+            if isinstance(e, queue.Full):
+                app.logger.warning(f'[!] Task queue is full. Unable to submit task [{task_id}] of client [{client}]')
+            raise
+
+        if fingerprint is not None:
+            self.task_fingerprints[task_id] = fingerprint
+        await self.task_register(task_id, record)
+        self.dispatch()
+
+    async def submit_batch(self, batch_id: str, input_dict: Dict, client: str = DEFAULT_CLIENT) -> None:
+        inputs = input_dict['inputs']
+        expected_outputs = input_dict.get('expected_outputs')
+        case_template = {k: v for k, v in input_dict.items() if k not in ('inputs', 'expected_outputs')}
+
+        priority = input_dict.get('priority')
+        self.scheduler.get_priority(priority)
+        # A batch larger than the queue limit is admitted as long as its first case can be queued, see feed_batches().
+        if not self.scheduler.can_accept(client):
+            app.logger.warning(f'[!] Task queue is full. Unable to submit batch [{batch_id}] of {len(inputs)} cases of client [{client}]')
             raise queue.Full
-        
+
+        await self.task_register(batch_id, {
+            'task_id': batch_id,
+            'timestamp': time.time(),
+            'process_time': float('inf'),
+            'status': 'processing',
+            'output_dict': {'cases': [None] * len(inputs), 'finished': 0, 'passed': 0},
+        })
+
+        # Every case is an ordinary task, so the cases fan out over the idle workers (one cpuset core each).
+        # Compiled languages build once: the other cases wait on the artifact cache and reuse the binary.
+        cases = collections.deque()
+        for case_index, case in enumerate(inputs):
+            # A case is its stdin, or {"stdin_digest": ...} for an input of the input store.
+            stdin = {'stdin_digest': case['stdin_digest']} if isinstance(case, dict) else {'stdin': case}
+            case_input = dict(case_template, **stdin, batch_id=batch_id, case_index=case_index)
+            case_input['expected_output'] = expected_outputs[case_index] if expected_outputs else None
+            cases.append((f'{batch_id}-{case_index}', case_input))
+        self.batch_backlogs[batch_id] = (client, priority, cases)
+        self.dispatch()
+
 
 # Hyperparameters
-number_of_worker = 72
+number_of_worker = None # defaults to one worker per leasable physical core
+housekeeping_cores = 1  # physical cores reserved for the backend, Docker and the OS
+smt_exclusive = True    # keep the SMT siblings of leased cores idle
 task_queue_size = 128
-result_cache_size = 128
+max_queued_per_client = 64   # tasks one client may have waiting
+max_running_per_client = None # cores one client may hold at once (None for no cap)
+client_weights = {}           # fair-share weight per client (API key), 1 by default
+result_memory_budget = 256 * 1024 ** 2  # bytes of finished results kept in memory before spilling to disk
+result_ttl = 3600       # seconds a finished result can be collected
+result_cache_entries = 10000             # finished results served again to identical submissions
+result_cache_budget = 64 * 1024 ** 2     # bytes of those results kept in memory
+result_cache_ttl = 3600                  # seconds a cached result is served
+setup_timeout = 120          # seconds to prepare the container
+default_compile_timeout = 60 # seconds to compile, unless the request sets compile_timeout
+max_compile_timeout = 300
+max_repeat = 50              # measured runs of a request with "repeat"
+max_warmup = 10              # discarded runs of a request with "warmup"
+max_repeat_time = 300        # seconds after which a repeated request starts no further run
+max_output_bytes = 8 * 1024 ** 2  # bytes of stdout and of stderr returned per run, the rest is only counted in total_bytes
+sandboxes = ('docker',)  # "sandbox" of a request: a pooled container, add 'process' for a confined host process
+process_sandbox_clients = set()  # API keys (X-API-Key) allowed to use the process sandbox, it shares the kernel and interpreters of the host
 mem_limit = '1g'
+pool_size = 1           # idle containers kept per (language, container profile)
+pool_max_reuse = 64     # tasks served by one container before it is recycled
+pool_idle_timeout = 600 # seconds before an idle container is evicted
+library_cache_budget = 20 * 1024 ** 3  # bytes of derived library images kept on disk
+artifact_cache_budget = 5 * 1024 ** 3   # bytes of compiled binaries kept on disk
+build_cache_budget = 10 * 1024 ** 3     # bytes of Cargo/Go build cache volumes per language before pruning
+input_store_budget = 20 * 1024 ** 3     # bytes of uploaded inputs kept on disk
+max_input_bytes = 1024 ** 3             # bytes of a single upload to /inputs
+log_file = 'monolith.log'
+log_sample_rates = {'monolith.request': 1.0}  # fraction of the tasks whose request payload is logged
+log_max_payload_chars = 256                   # longer strings of a payload are logged as their head, size and SHA-256
+
+result_max_wait = 60    # seconds a /results request may long-poll
+
+# Records are queued and written as JSON lines by a background thread, never on the event loop.
+log_pipeline = setup_logging(filename=log_file, sample_rates=log_sample_rates, max_payload_chars=log_max_payload_chars)
+request_logger = logging.getLogger('monolith.request')
 
-app = Flask(__name__)
-app.manager = MonolithManager(number_of_worker=number_of_worker, queue_size=task_queue_size, result_cache_size=result_cache_size, mem_limit=mem_limit)
-app.logger.info(f"[Monolith Manager] Config: {number_of_worker} workers, {task_queue_size} task queue size, {result_cache_size} result cache size, {mem_limit} memory limit.")
+class MonolithRequest(Request):
+    # The body limit is fixed when the request is created, uploads to /inputs are streamed to disk and may be larger.
+    def __init__(self, method, scheme, path, *args, max_content_length=None, **kwargs):
+        if method == 'POST' and path == '/inputs':
+            max_content_length = max_input_bytes
+        super().__init__(method, scheme, path, *args, max_content_length=max_content_length, **kwargs)
+
+app = Quart(__name__)
+app.request_class = MonolithRequest
+app.ready_images = prepare_images()
+for lang, ready_image in app.ready_images.items():
+    app.logger.info(f"[Monolith Manager] Ready image for {lang}: {ready_image}")
+# Pull and validate the default images before the first task, sessions then resolve them from the registry.
+for lang, image in get_image_registry().prepare().items():
+    if image.startswith('error'):
+        app.logger.warning(f"[Monolith Manager] Image for {lang} is not usable: {image}")
+app.manager = MonolithManager(number_of_worker=number_of_worker, queue_size=task_queue_size, result_memory_budget=result_memory_budget, result_ttl=result_ttl, mem_limit=mem_limit, housekeeping_cores=housekeeping_cores, smt_exclusive=smt_exclusive, max_queued_per_client=max_queued_per_client, max_running_per_client=max_running_per_client, client_weights=client_weights, pool_size=pool_size, pool_max_reuse=pool_max_reuse, pool_idle_timeout=pool_idle_timeout, library_cache_budget=library_cache_budget, artifact_cache_budget=artifact_cache_budget, build_cache_budget=build_cache_budget, result_cache_entries=result_cache_entries, result_cache_budget=result_cache_budget, result_cache_ttl=result_cache_ttl, input_store_budget=input_store_budget, max_input_bytes=max_input_bytes)
+app.logger.info(f"[Monolith Manager] Config: {app.manager.number_of_worker} workers, {task_queue_size} task queue size, {result_ttl}s result TTL, {mem_limit} memory limit, {pool_size} pooled containers per profile.")
 app.logger.info('=============================================')
 
+@app.before_serving
+async def start_manager():
+    await app.manager.start()
+
+@app.after_serving
+async def stop_manager():
+    await app.manager.stop()
+    # Flushes the queued records, the ones logged afterwards are not written.
+    log_pipeline.stop()
+
+def get_client_id() -> str:
+    # Fair share is per API key (or client header), falling back to the address of the client.
+    return request.headers.get('X-API-Key') or request.headers.get('X-Client-Id') or request.remote_addr or DEFAULT_CLIENT
+
+def check_sandbox(input_dict: Dict) -> None:
+    # The process sandbox is for trusted code only, whatever the client asks for.
+    sandbox = input_dict.get('sandbox', 'docker')
+    if sandbox not in sandboxes:
+        raise ValueError(f'Unknown sandbox, must be one of {sandboxes}')
+    if sandbox == 'process' and request.headers.get('X-API-Key') not in process_sandbox_clients:
+        raise ValueError('The process sandbox is reserved for trusted API keys')
+
 @app.route('/execute', methods=['POST'])
-def handle_execute():
-    input_dict = request.get_json()
+async def handle_execute():
+    input_dict = await request.get_json()
     uuid_str = str(uuid.uuid4())
-    app.logger.info(f'[Monolith Manager] Received an execute request: {input_dict}, Task ID: {uuid_str}, Current Queue Size: {app.manager.task_queue.qsize()}')
+    client = get_client_id()
+    correlation_id.set(uuid_str)
+    request_logger.info(f'[Monolith Manager] Received an execute request from [{client}], Task ID: {uuid_str}, Current Queue Size: {len(app.manager.scheduler)}', extra={'request': input_dict})
 
     response = {
         'task_id': uuid_str,
         'status': 'error',
         'error': 'unknown',
     }
+    # Invalid requests are the fault of the client, other errors mean this node cannot take the task right now.
+    error_code = 503
     
     try:
         # Validate the input
         if not input_dict or 'code' not in input_dict:
             raise ValueError('No code provided')
+        check_sandbox(input_dict)
+        parse_repeat(input_dict, max_repeat, max_warmup)
+        missing_inputs = app.manager.input_store.find_missing(input_dict)
+        if missing_inputs:
+            raise ValueError(f'Unknown inputs, upload them to /inputs first: {missing_inputs}')
         # Submit the task 
-        app.manager.submit_task(uuid_str, input_dict)
+        await app.manager.submit_task(uuid_str, input_dict, client=client)
         response['status'] = 'processing'
         response['error'] = None
         app.logger.info(f'[Monolith Manager] Task [{uuid_str}] is added to the task queue.')
     except ValueError as e:
         response['status'] = 'error'
         response['error'] = str(e)
+        error_code = 400
         app.logger.error(f'[Monolith Manager] Error: {response["error"]}')
     except queue.Full:
         response['status'] = 'error'
@@ -228,28 +623,122 @@ def handle_execute():
         response['error'] = logging.exception(e)
         app.logger.error(f'[Monolith Manager] Error: {response["error"]}')
     finally:
-        return jsonify(response), 503 if response['status'] == 'error' else 200
+        return jsonify(response), error_code if response['status'] == 'error' else 200
+
+@app.route('/execute_batch', methods=['POST'])
+async def handle_execute_batch():
+    input_dict = await request.get_json()
+    uuid_str = str(uuid.uuid4())
+
+    response = {
+        'task_id': uuid_str,
+        'status': 'error',
+        'error': 'unknown',
+    }
+    # Invalid requests are the fault of the client, other errors mean this node cannot take the task right now.
+    error_code = 503
+
+    try:
+        # Validate the input
+        if not input_dict or 'code' not in input_dict:
+            raise ValueError('No code provided')
+        inputs = input_dict.get('inputs')
+        if not isinstance(inputs, list) or not inputs:
+            raise ValueError('No inputs provided')
+        expected_outputs = input_dict.get('expected_outputs')
+        if expected_outputs is not None and (not isinstance(expected_outputs, list) or len(expected_outputs) != len(inputs)):
+            raise ValueError('expected_outputs must be a list of the same length as inputs')
+        check_sandbox(input_dict)
+        parse_repeat(input_dict, max_repeat, max_warmup)
+        missing_inputs = app.manager.input_store.find_missing(input_dict)
+        for case in inputs:
+            if isinstance(case, dict):
+                missing_inputs += app.manager.input_store.find_missing(case)
+        if missing_inputs:
+            raise ValueError(f'Unknown inputs, upload them to /inputs first: {missing_inputs}')
+        client = get_client_id()
+        correlation_id.set(uuid_str)
+        app.logger.info(f'[Monolith Manager] Received a batch execute request of {len(inputs)} cases from [{client}], Task ID: {uuid_str}, Current Queue Size: {len(app.manager.scheduler)}')
+
+        # Submit the batch
+        await app.manager.submit_batch(uuid_str, input_dict, client=client)
+        response['status'] = 'processing'
+        response['error'] = None
+        app.logger.info(f'[Monolith Manager] Batch [{uuid_str}] is added to the task queue.')
+    except ValueError as e:
+        response['error'] = str(e)
+        error_code = 400
+        app.logger.error(f'[Monolith Manager] Error: {response["error"]}')
+    except queue.Full:
+        response['error'] = 'Task queue is full'
+        app.logger.error(f'[Monolith Manager] Error: {response["error"]}')
+    except Exception as e:
+        response['error'] = str(e)
+        app.logger.exception(e)
+    finally:
+        return jsonify(response), error_code if response['status'] == 'error' else 200
+
+@app.route('/inputs', methods=['POST'])
+async def handle_upload_input():
+    # Large stdin and test data are uploaded once and referenced by digest in /execute (stdin_digest, input_files).
+    # Writing, hashing and the fsync and rename of commit() run on the executor, not on the event loop.
+    writer = await app.manager.blocking(app.manager.input_store.writer)
+    try:
+        async for chunk in request.body:
+            await app.manager.blocking(writer.write, chunk)
+        digest = await app.manager.blocking(writer.commit)
+    except ValueError as e:
+        await app.manager.blocking(writer.abort)
+        return jsonify({'status': 'error', 'error': str(e)}), 413
+    except BaseException:
+        writer.abort()
+        raise
+    size = await app.manager.blocking(app.manager.input_store.get_size, digest)
+    app.logger.info(f'[Monolith Manager] Stored input {digest} ({size} bytes)')
+    return jsonify({'status': 'success', 'digest': digest, 'size': size}), 200
+
+@app.route('/inputs/<digest>', methods=['GET'])
+async def get_input(digest):
+    try:
+        size = app.manager.input_store.get_size(digest)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    if size is None:
+        return jsonify({'status': 'error', 'error': 'Input not found'}), 404
+    return jsonify({'status': 'success', 'digest': f'sha256:{parse_digest(digest)}', 'size': size}), 200
 
 @app.route('/results/<task_id>', methods=['GET'])
-def get_result(task_id):
+async def get_result(task_id):
     app.logger.debug(f'[+] Received a Result Request: [{task_id}]')
-    with app.manager.task_results_lock:
-        result = app.manager.task_results.get(task_id)
+    # With ?wait=<seconds>, hold the request until the task finishes (or the wait runs out) instead of returning at once.
+    wait = min(request.args.get('wait', 0, type=float), result_max_wait)
+    result = await app.manager.store(app.manager.task_results.get, task_id)
+    if result is not None and result['status'] == 'processing':
+        await app.manager.task_wait(task_id, wait)
+        result = await app.manager.store(app.manager.task_results.get, task_id)
     
     if result is None:
         return jsonify({'error': 'Task not found', 'status': 'error'}), 404
     if result['status'] != 'processing':
-        app.manager.task_results.pop(task_id)
+        await app.manager.store(app.manager.task_results.pop, task_id)
         app.logger.info(f'[-] Task [{task_id}] is removed from the task results.')
     
     return jsonify(result), 200
 
 @app.route('/status', methods=['GET'])
-def get_status():
-    return jsonify(app.manager.get_status()), 200
+async def get_status():
+    status = app.manager.get_status()
+    # Languages with a ready image, the dispatcher only routes these languages to this node.
+    status['languages'] = [lang for lang, ready_image in app.ready_images.items() if not ready_image.startswith('error')]
+    status['logging'] = log_pipeline.get_status()
+    return jsonify(status), 200
+
+@app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    return Response(app.manager.metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
-def index():
+async def index():
     return redirect("https://huggingface.co/spaces/Elfsong/Monolith", code=302)
 
 
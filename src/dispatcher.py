@@ -0,0 +1,515 @@
+# coding: utf-8
+
+# Author: Du Mingzhe (mingzhe@nus.edu.sg)
+# Date: 2025-05-02
+
+import os
+import time
+import shutil
+import logging
+import requests
+import tempfile
+import threading
+import collections
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+from llm_sandbox.library_cache import normalize_libraries
+from llm_sandbox.input_store import parse_digest
+from logging.handlers import RotatingFileHandler
+from flask import Flask, request, jsonify, redirect
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Logging Configuration
+log_handler = RotatingFileHandler(
+    filename='dispatcher.log',
+    maxBytes=100 * 1024 * 1024,
+    backupCount=5
+)
+log_handler.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s', '%Y-%m-%d %H:%M:%S')
+log_handler.setFormatter(formatter)
+
+logger = logging.getLogger()
+logger.handlers.clear()
+logger.setLevel(logging.INFO)
+logger.addHandler(log_handler)
+
+
+class Node:
+    def __init__(self, name: str, url: str):
+        """
+        A Monolith backend (sync or async) behind the dispatcher, as last seen on its /status
+        :param name: Node name, used in the drain endpoints
+        :param url: Base URL of the backend, i.e. http://127.0.0.1:8008
+        """
+        self.name = name
+        self.url = url.rstrip('/')
+        self.healthy = False
+        self.draining = False
+        self.error: Optional[str] = None
+        self.last_poll = 0.0
+        self.number_of_worker = 1
+        self.queued = 0
+        self.busy = 0
+        self.memory_percent = 0.0
+        self.languages: Optional[List[str]] = None
+        # Tasks routed since the last poll, so that a burst does not all land on the node that looked idle.
+        self.pending = 0
+        # Requests forwarded and not answered yet (synchronous /execute calls of sync backends).
+        self.in_flight = 0
+
+    def update(self, status: Dict[str, Any]) -> None:
+        self.number_of_worker = max(int(status.get('number_of_worker') or len(status.get('worker_status') or []) or 1), 1)
+        self.queued = int(status.get('current_queue_size') or 0)
+        # Async backends report their idle workers, sync backends are as busy as the requests we have in flight.
+        worker_status = status.get('worker_status')
+        self.busy = worker_status.count(False) if worker_status is not None else 0
+        self.memory_percent = float((status.get('memory_usage') or {}).get('percent') or 0.0)
+        self.languages = status.get('languages')
+        self.pending = 0
+        self.healthy = True
+        self.error = None
+        self.last_poll = time.time()
+
+    def supports(self, language: Optional[str]) -> bool:
+        # Nodes that do not report their ready images are assumed to run every language.
+        return self.languages is None or language is None or language in self.languages
+
+    def load(self) -> float:
+        # Tasks per worker, with memory pressure as the tie breaker between equally loaded nodes.
+        busy = max(self.busy, self.in_flight)
+        return (self.queued + busy + self.pending) / self.number_of_worker + self.memory_percent / 1000
+
+    def to_dict(self, outstanding: int) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'url': self.url,
+            'healthy': self.healthy,
+            'draining': self.draining,
+            # A draining node is drained once nothing routed to it is left to collect and its queue is empty.
+            'drained': self.draining and outstanding == 0 and self.in_flight == 0 and self.queued == 0 and self.busy == 0,
+            'error': self.error,
+            'last_poll': self.last_poll,
+            'load': self.load(),
+            'number_of_worker': self.number_of_worker,
+            'queued': self.queued,
+            'busy': self.busy,
+            'in_flight': self.in_flight,
+            'outstanding_tasks': outstanding,
+            'memory_percent': self.memory_percent,
+            'languages': self.languages,
+        }
+
+
+class Dispatcher:
+    def __init__(self, nodes: Dict[str, str], poll_interval: float = 1.0, poll_timeout: float = 2.0, max_memory_percent: float = 90.0, sticky_slack: float = 1.0, max_sticky_keys: int = 4096, task_ttl: float = 3600, max_input_keys: int = 100000):
+        """
+        Route tasks over several Monolith nodes by load, read from their /status
+        :param nodes: Mapping from node name to base URL
+        :param poll_interval: Seconds between two polls of every node
+        :param poll_timeout: Seconds before a /status request counts as failed
+        :param max_memory_percent: Nodes using more host memory than this get no new tasks
+        :param sticky_slack: Tasks per worker a node with the cached library image may be above the least loaded node and still be chosen
+        :param max_sticky_keys: Library sets remembered for sticky routing (LRU)
+        :param task_ttl: Seconds a routed task can be collected through the dispatcher
+        :param max_input_keys: Uploaded inputs remembered for routing the tasks that reference them (LRU)
+        """
+        self.nodes = {name: Node(name, url) for name, url in nodes.items()}
+        self.poll_interval = poll_interval
+        self.poll_timeout = poll_timeout
+        self.max_memory_percent = max_memory_percent
+        self.sticky_slack = sticky_slack
+        self.max_sticky_keys = max_sticky_keys
+        self.task_ttl = task_ttl
+        self.max_input_keys = max_input_keys
+
+        self.lock = threading.Lock()
+        self.http = requests.Session()
+        # (language, libraries) -> node that built the derived image
+        self.sticky: "collections.OrderedDict[Tuple[str, Tuple[str, ...]], str]" = collections.OrderedDict()
+        # digest of an uploaded input (bare hex) -> node that stores it, tasks referencing it must run there
+        self.inputs: "collections.OrderedDict[str, str]" = collections.OrderedDict()
+        # task_id -> (node, routed_at), oldest first
+        self.tasks: "collections.OrderedDict[str, Tuple[str, float]]" = collections.OrderedDict()
+        self.stats = collections.Counter()
+        self.poller: Optional[threading.Thread] = None
+
+    def start_poller(self) -> None:
+        if self.poller is None:
+            self.poll()
+            self.poller = threading.Thread(target=self.poll_loop, name='monolith-dispatcher-poller', daemon=True)
+            self.poller.start()
+
+    def poll_loop(self) -> None:
+        while True:
+            time.sleep(self.poll_interval)
+            self.poll()
+
+    def poll(self) -> None:
+        for node in list(self.nodes.values()):
+            try:
+                response = self.http.get(f'{node.url}/status', timeout=self.poll_timeout)
+                response.raise_for_status()
+                status = response.json()
+                with self.lock:
+                    node.update(status)
+            except Exception as e:
+                with self.lock:
+                    if node.healthy:
+                        logger.warning(f'[!] Node [{node.name}] is unreachable: {e}')
+                    node.healthy = False
+                    node.error = str(e)
+        self.expire()
+
+    def expire(self) -> None:
+        with self.lock:
+            now = time.time()
+            while self.tasks:
+                task_id, (_, routed_at) = next(iter(self.tasks.items()))
+                if now - routed_at < self.task_ttl:
+                    break
+                del self.tasks[task_id]
+
+    @staticmethod
+    def sticky_key(input_dict: Dict) -> Optional[Tuple[str, Tuple[str, ...]]]:
+        # Only tasks with libraries are sticky: their derived image is cached on the node that built it.
+        libraries = normalize_libraries(input_dict.get('libraries'))
+        if not libraries:
+            return None
+        return input_dict.get('language'), tuple(libraries)
+
+    @staticmethod
+    def input_digests(input_dict: Dict) -> List[str]:
+        # Inputs referenced by a task or by the cases of a batch (stdin_digest, input_files), malformed ones are left to the node.
+        cases = input_dict.get('inputs') if isinstance(input_dict.get('inputs'), list) else []
+        digests = list()
+        for reference in [input_dict] + [case for case in cases if isinstance(case, dict)]:
+            input_files = reference.get('input_files')
+            for digest in ([reference.get('stdin_digest')] + (list(input_files.values()) if isinstance(input_files, dict) else [])):
+                try:
+                    digests.append(parse_digest(digest))
+                except ValueError:
+                    continue
+        return digests
+
+    def input_node(self, input_dict: Dict) -> Optional[str]:
+        """
+        :param input_dict: Task
+        :return: Node storing the inputs the task references, None if it references none uploaded through the dispatcher
+        :raises ValueError: if the inputs are stored on different nodes
+        """
+        with self.lock:
+            names = set()
+            for digest in self.input_digests(input_dict):
+                if digest in self.inputs:
+                    self.inputs.move_to_end(digest)
+                    names.add(self.inputs[digest])
+        if len(names) > 1:
+            raise ValueError(f'The inputs of the task are stored on different nodes ({sorted(names)}), upload them to one node (POST /inputs?node=<name>)')
+        return names.pop() if names else None
+
+    def candidates(self, input_dict: Dict, pinned: Optional[str] = None) -> List[Node]:
+        """
+        Nodes that may take the task, best first: the sticky node if it is not much busier than the least loaded one, then by load
+        :param input_dict: Task
+        :param pinned: Only consider this node (the one storing the inputs of the task)
+        :return: Healthy, not draining nodes with a ready image of the language and memory to spare
+        """
+        language = input_dict.get('language')
+        key = self.sticky_key(input_dict)
+        with self.lock:
+            nodes = [
+                node for node in self.nodes.values()
+                if node.healthy and not node.draining and node.supports(language) and node.memory_percent < self.max_memory_percent
+                and pinned in (None, node.name)
+            ]
+            nodes.sort(key=lambda node: node.load())
+            sticky = self.sticky.get(key) if key else None
+            for index, node in enumerate(nodes):
+                if node.name == sticky and node.load() <= nodes[0].load() + self.sticky_slack:
+                    nodes.insert(0, nodes.pop(index))
+                    self.stats['sticky_hits'] += 1
+                    break
+        return nodes
+
+    def routed(self, node: Node, input_dict: Dict, response: Dict) -> None:
+        with self.lock:
+            node.pending += 1
+            key = self.sticky_key(input_dict)
+            if key:
+                self.sticky[key] = node.name
+                self.sticky.move_to_end(key)
+                while len(self.sticky) > self.max_sticky_keys:
+                    self.sticky.popitem(last=False)
+            # Async backends answer right away, their result is collected from the same node later.
+            if response.get('status') == 'processing' and response.get('task_id'):
+                self.tasks[response['task_id']] = (node.name, time.time())
+            self.stats['routed'] += 1
+
+    def forward(self, path: str, input_dict: Dict, headers: Dict[str, str]) -> Tuple[Dict, int]:
+        """
+        Forward a submission to the best node, falling back to the next one if a node is unreachable or its queue is full
+        :param path: Backend endpoint, /execute or /execute_batch
+        :param input_dict: Request body
+        :param headers: Client headers to pass on (fair share on the node is per client)
+        :return: Response body and status code
+        """
+        try:
+            pinned = self.input_node(input_dict)
+        except ValueError as e:
+            return {'status': 'error', 'error': str(e)}, 400
+        nodes = self.candidates(input_dict, pinned)
+        if not nodes:
+            self.stats['rejected'] += 1
+            if pinned:
+                return {'status': 'error', 'error': f'Node {pinned} storing the inputs of the task is not available, upload them again'}, 503
+            return {'status': 'error', 'error': f"No node available for language {input_dict.get('language')}"}, 503
+
+        body, code = None, 503
+        for node in nodes:
+            with self.lock:
+                node.in_flight += 1
+            try:
+                # Sync backends run the task in the request, so the read timeout covers the longest task.
+                response = self.http.post(f'{node.url}{path}', json=input_dict, headers=headers, timeout=(self.poll_timeout, None))
+                body, code = response.json(), response.status_code
+            except (requests.ConnectionError, requests.Timeout, ValueError) as e:
+                logger.warning(f'[!] Node [{node.name}] failed on {path}: {e}')
+                with self.lock:
+                    node.healthy = False
+                    node.error = str(e)
+                body, code = {'status': 'error', 'error': f'Node {node.name} is unreachable'}, 503
+                self.stats['retries'] += 1
+                continue
+            finally:
+                with self.lock:
+                    node.in_flight -= 1
+
+            if code == 503 and body.get('error') == 'Task queue is full':
+                self.stats['retries'] += 1
+                continue
+            body['node'] = node.name
+            self.routed(node, input_dict, body)
+            logger.info(f'[+] Routed task [{body.get("task_id")}] to node [{node.name}] (load {node.load():.2f}).')
+            return body, code
+
+        self.stats['rejected'] += 1
+        return body, code
+
+    def upload(self, stream: BinaryIO, headers: Dict[str, str], pinned: Optional[str] = None) -> Tuple[Dict, int]:
+        """
+        Store an input on the least loaded node, the tasks referencing its digest are then routed to that node
+        :param stream: Content of the input, spooled to a temporary file so that it can be sent again to the next node
+        :param headers: Client headers to pass on
+        :param pinned: Store it on this node, i.e. next to the other inputs of the same tasks
+        :return: Response body of the node (with the node name) and status code
+        """
+        if pinned is not None and pinned not in self.nodes:
+            return {'status': 'error', 'error': f'Unknown node {pinned}'}, 404
+        with self.lock:
+            nodes = sorted(
+                (node for node in self.nodes.values() if node.healthy and not node.draining and node.memory_percent < self.max_memory_percent and pinned in (None, node.name)),
+                key=lambda node: node.load(),
+            )
+        if not nodes:
+            return {'status': 'error', 'error': 'No node available'}, 503
+
+        body, code = {'status': 'error', 'error': 'No node available'}, 503
+        with tempfile.TemporaryFile() as spool:
+            shutil.copyfileobj(stream, spool, 1024 ** 2)
+            for node in nodes:
+                spool.seek(0)
+                try:
+                    response = self.http.post(f'{node.url}/inputs', data=spool, headers=headers, timeout=(self.poll_timeout, None))
+                    body, code = response.json(), response.status_code
+                except (requests.ConnectionError, requests.Timeout, ValueError) as e:
+                    logger.warning(f'[!] Node [{node.name}] failed on /inputs: {e}')
+                    with self.lock:
+                        node.healthy = False
+                        node.error = str(e)
+                    body, code = {'status': 'error', 'error': f'Node {node.name} is unreachable'}, 503
+                    continue
+                if code == 200 and body.get('digest'):
+                    body['node'] = node.name
+                    with self.lock:
+                        digest = parse_digest(body['digest'])
+                        self.inputs[digest] = node.name
+                        self.inputs.move_to_end(digest)
+                        while len(self.inputs) > self.max_input_keys:
+                            self.inputs.popitem(last=False)
+                    logger.info(f'[+] Stored input {body["digest"]} on node [{node.name}].')
+                return body, code
+        return body, code
+
+    def get_input(self, digest: str) -> Tuple[Dict, int]:
+        with self.lock:
+            name = self.inputs.get(parse_digest(digest))
+        if name is None:
+            return {'status': 'error', 'error': 'Input not found'}, 404
+        node = self.nodes[name]
+        try:
+            response = self.http.get(f'{node.url}/inputs/{digest}', timeout=self.poll_timeout)
+            return {**response.json(), 'node': name}, response.status_code
+        except (requests.ConnectionError, requests.Timeout, ValueError) as e:
+            return {'status': 'error', 'error': f'Node {name} is unreachable: {e}'}, 503
+
+    def get_result(self, task_id: str, args: Dict[str, str]) -> Tuple[Dict, int]:
+        with self.lock:
+            entry = self.tasks.get(task_id)
+        if entry is None:
+            return {'error': 'Task not found', 'status': 'error'}, 404
+        node = self.nodes[entry[0]]
+        try:
+            wait = float(args.get('wait', 0) or 0)
+            response = self.http.get(f'{node.url}/results/{task_id}', params=args, timeout=(self.poll_timeout, wait + self.poll_timeout))
+            body, code = response.json(), response.status_code
+        except (requests.ConnectionError, requests.Timeout, ValueError) as e:
+            return {'error': f'Node {node.name} is unreachable: {e}', 'status': 'error'}, 503
+        # Results are handed out once by the node, so is the route.
+        if code == 404 or body.get('status') != 'processing':
+            with self.lock:
+                self.tasks.pop(task_id, None)
+        return body, code
+
+    def drain(self, name: str, draining: bool = True) -> Dict[str, Any]:
+        """
+        Stop (or resume) routing new tasks to a node. Results of the tasks already routed to it can still be collected.
+        :param name: Node name
+        :param draining: if False, put the node back into rotation
+        :return: Node status
+        """
+        with self.lock:
+            node = self.nodes[name]
+            node.draining = draining
+            if draining:
+                # Library sets of a draining node go to whichever node builds them next.
+                for key in [key for key, sticky in self.sticky.items() if sticky == name]:
+                    del self.sticky[key]
+        logger.info(f'[+] Node [{name}] is {"draining" if draining else "back in rotation"}.')
+        return self.get_node_status(name)
+
+    def get_node_status(self, name: str) -> Dict[str, Any]:
+        with self.lock:
+            outstanding = sum(1 for node_name, _ in self.tasks.values() if node_name == name)
+            return self.nodes[name].to_dict(outstanding)
+
+    def get_status(self) -> Dict[str, Any]:
+        with self.lock:
+            # Same shape as the /status of a backend, so that the frontend can show every worker behind the dispatcher.
+            worker_status = [
+                index >= node.busy
+                for node in self.nodes.values() if node.healthy
+                for index in range(node.number_of_worker)
+            ]
+        return {
+            'worker_status': worker_status,
+            'nodes': [self.get_node_status(name) for name in self.nodes],
+            'routed': self.stats['routed'],
+            'sticky_hits': self.stats['sticky_hits'],
+            'sticky_keys': len(self.sticky),
+            'retries': self.stats['retries'],
+            'rejected': self.stats['rejected'],
+            'outstanding_tasks': len(self.tasks),
+            'inputs': len(self.inputs),
+        }
+
+
+def parse_nodes(text: str) -> Dict[str, str]:
+    """
+    Parse the node list, i.e. "http://127.0.0.1:8008,http://127.0.0.1:8009" or "a=http://10.0.0.1:8008,b=http://10.0.0.2:8008"
+    :param text: Comma separated URLs, optionally named
+    :return: Mapping from node name to URL (unnamed nodes are node-0, node-1, ...)
+    """
+    nodes = dict()
+    for index, entry in enumerate(part.strip() for part in text.split(',') if part.strip()):
+        name, _, url = entry.rpartition('=') if '=' in entry else (f'node-{index}', '', entry)
+        nodes[name] = url
+    return nodes
+
+
+# Hyperparameters
+nodes = parse_nodes(os.getenv('MONOLITH_NODES', 'http://127.0.0.1:8008'))
+poll_interval = 1.0        # seconds between two /status polls of every node
+poll_timeout = 2.0         # seconds before a node counts as unreachable
+max_memory_percent = 90.0  # host memory usage above which a node gets no new tasks
+sticky_slack = 1.0         # tasks per worker a node with the cached library image may be above the least loaded node
+max_sticky_keys = 4096     # library sets remembered for sticky routing
+task_ttl = 3600            # seconds a routed task can be collected, matches result_ttl of the async backend
+max_input_keys = 100000    # uploaded inputs remembered for routing the tasks that reference them
+max_input_bytes = 1024 ** 3  # bytes of a single upload to /inputs, matches the backends
+
+# The routing state lives in this process, so run the dispatcher as a single (threaded) Gunicorn worker.
+app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
+app.dispatcher = Dispatcher(nodes, poll_interval=poll_interval, poll_timeout=poll_timeout, max_memory_percent=max_memory_percent, sticky_slack=sticky_slack, max_sticky_keys=max_sticky_keys, task_ttl=task_ttl, max_input_keys=max_input_keys)
+app.dispatcher.start_poller()
+logger.info(f'[Monolith Dispatcher] Nodes: {nodes}')
+
+def get_client_headers() -> Dict[str, str]:
+    # Keep the fair share of the nodes per client, not per dispatcher.
+    headers = {key: request.headers[key] for key in ('X-API-Key', 'X-Client-Id') if key in request.headers}
+    if not headers and request.remote_addr:
+        headers['X-Client-Id'] = request.remote_addr
+    return headers
+
+@app.route('/execute', methods=['POST'])
+def handle_execute():
+    input_dict = request.get_json(silent=True)
+    if not input_dict or 'code' not in input_dict:
+        return jsonify({'status': 'error', 'error': 'No code provided'}), 400
+    body, code = app.dispatcher.forward('/execute', input_dict, get_client_headers())
+    return jsonify(body), code
+
+@app.route('/execute_batch', methods=['POST'])
+def handle_execute_batch():
+    input_dict = request.get_json(silent=True)
+    if not input_dict or 'code' not in input_dict:
+        return jsonify({'status': 'error', 'error': 'No code provided'}), 400
+    body, code = app.dispatcher.forward('/execute_batch', input_dict, get_client_headers())
+    return jsonify(body), code
+
+@app.route('/inputs', methods=['POST'])
+def handle_upload_input():
+    # Stored on one node, the tasks referencing the digest are then routed to it.
+    try:
+        request.max_content_length = max_input_bytes
+        body, code = app.dispatcher.upload(request.stream, get_client_headers(), pinned=request.args.get('node'))
+    except RequestEntityTooLarge as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 413
+    return jsonify(body), code
+
+@app.route('/inputs/<digest>', methods=['GET'])
+def get_input(digest):
+    try:
+        body, code = app.dispatcher.get_input(digest)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    return jsonify(body), code
+
+@app.route('/results/<task_id>', methods=['GET'])
+def get_result(task_id):
+    body, code = app.dispatcher.get_result(task_id, request.args.to_dict())
+    return jsonify(body), code
+
+@app.route('/nodes/<name>/drain', methods=['POST'])
+def drain_node(name):
+    if name not in app.dispatcher.nodes:
+        return jsonify({'status': 'error', 'error': f'Unknown node {name}'}), 404
+    return jsonify(app.dispatcher.drain(name)), 200
+
+@app.route('/nodes/<name>/undrain', methods=['POST'])
+def undrain_node(name):
+    if name not in app.dispatcher.nodes:
+        return jsonify({'status': 'error', 'error': f'Unknown node {name}'}), 404
+    return jsonify(app.dispatcher.drain(name, draining=False)), 200
+
+@app.route('/status', methods=['GET'])
+def get_status():
+    return jsonify(app.dispatcher.get_status()), 200
+
+@app.route('/')
+def index():
+    return redirect("https://huggingface.co/spaces/Elfsong/Monolith", code=302)
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=8010, debug=False, threaded=True)
@@ -3,6 +3,7 @@
 # Author: Du Mingzhe (mingzhe@nus.edu.sg)
 # Date: 2025-03-01
 
+import os
 import time
 import requests
 import pandas as pd
@@ -19,19 +20,22 @@ lang_map = {
     "Rust": ["rust", "rust", "// Don't Worry, You Can't Break It. We Promise.\nfn main() {\n\tprintln!('Hello World!'); \n}\n"],
 }
 
+# A single backend or the dispatcher in front of several nodes
+monolith_url = os.getenv('MONOLITH_URL', 'https://monolith.cool')
+
 def post_task(lang, code, libs=None, timeout=30, memory_profile=False):
-    url = 'https://monolith.cool/execute'
+    url = f'{monolith_url}/execute'
     data = {'language': lang, 'code': code, 'libraries': libs, 'timeout': timeout, 'run_memory_profile': memory_profile}
     response = requests.post(url, json=data)
     return response.json()
 
 def get_result(task_id):
-    url = f'https://monolith.cool/results/{task_id}'
+    url = f'{monolith_url}/results/{task_id}'
     response = requests.get(url)
     return response.json()
 
 def get_status():
-    url = 'https://monolith.cool/status'
+    url = f'{monolith_url}/status'
     response = requests.get(url)
     return response.json()
 
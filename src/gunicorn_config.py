@@ -4,11 +4,49 @@
 # Date: 2025-04-06
 
 import os
-import psutil
+import shutil
+import tempfile
+import logging
 import platform
+from llm_sandbox.image import prepare_images
+from llm_sandbox.image_registry import get_image_registry
+from llm_sandbox.core_lease import CoreLeaseManager
+from llm_sandbox.structured_log import setup_logging
+
+# Core leases: one physical core per worker (SMT siblings idle), housekeeping cores reserved for Gunicorn and Docker
+housekeeping_cores = 1
+smt_exclusive = True
+
+# Gunicorn and the backend write the same JSON-lines log through one queue per process (the backend reuses this pipeline)
+log_file = 'monolith.log'
 
 def on_starting(server):
     server._worker_id_overload = set()
+    log_pipeline = setup_logging(filename=log_file)
+    for name in ("gunicorn.error", "gunicorn.access"):
+        logging.getLogger(name).addHandler(log_pipeline.handler)
+
+    # Every worker flushes its metrics here and /metrics adds them up, whichever worker serves the scrape.
+    metrics_dir = os.environ.setdefault("MONOLITH_METRICS_DIR", os.path.join(tempfile.gettempdir(), f"monolith-metrics-{os.getpid()}"))
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+    server._core_leases = CoreLeaseManager(housekeeping_cores=housekeeping_cores, smt_exclusive=smt_exclusive)
+    server.log.info(f"[+] Benchmark CPUs: {sorted(server._core_leases.get_cpus())}, housekeeping CPUs: {server._core_leases.housekeeping}")
+
+    # Build the measurement-ready images once in the master, before any worker forks.
+    try:
+        for lang, ready_image in prepare_images().items():
+            server.log.info(f"[+] Ready image for {lang}: {ready_image}")
+    except Exception as e:
+        server.log.warning(f"[-] Failed to prepare ready images, falling back to base images: {e}")
+
+    # Pull and validate the default images once, so that no worker pulls on its first task.
+    try:
+        for lang, image in get_image_registry().prepare().items():
+            if image.startswith("error"):
+                server.log.warning(f"[-] Image for {lang} is not usable: {image}")
+    except Exception as e:
+        server.log.warning(f"[-] Failed to pull the default images: {e}")
 
 
 def nworkers_changed(server, new_value, old_value):
@@ -29,22 +67,31 @@ def on_reload(server):
 
 def pre_fork(server, worker):
     worker._worker_id = _next_worker_id(server)
+    worker._core_lease = server._core_leases.acquire(owner=f"worker-{worker._worker_id}", blocking=False)
+    if worker._core_lease is None:
+        slots = server._core_leases.slots
+        worker._cpu_id, worker._idle_siblings = slots[worker._worker_id % len(slots)]
+        server.log.warning(f"[-] More workers than leasable cores, Worker-{worker._worker_id} shares CPU {worker._cpu_id}.")
+    else:
+        worker._cpu_id, worker._idle_siblings = worker._core_lease.cpu, worker._core_lease.idle_siblings
     server.log.info(f"[+] ========================================================")
     server.log.info(f"[+] Worker-{worker._worker_id} is starting.")
 
 
+def child_exit(server, worker):
+    server._core_leases.release(getattr(worker, "_core_lease", None))
+
+
 def post_fork(server, worker):
     pid = worker.pid
     worker_id = worker._worker_id
-    cpu_id = -1
+    cpu_id = worker._cpu_id
     server.log.info(f"[+] Worker-{worker_id} started -> PID {pid}.")
     
-    # Set CPU affinity for the worker
+    # The leased core runs the sandbox container (cpuset), the worker process itself stays on the housekeeping cores.
     if platform.system().lower() == "linux":
-        num_cpus = psutil.cpu_count(logical=True) or 1
-        cpu_id = worker_id % num_cpus
-        os.sched_setaffinity(pid, {cpu_id})
-        server.log.info(f"[+] Worker-{worker_id} (PID {pid}) pinned to physical CPU core {cpu_id}.")
+        os.sched_setaffinity(pid, set(server._core_leases.housekeeping))
+        server.log.info(f"[+] Worker-{worker_id} (PID {pid}) leased physical CPU core {cpu_id} (idle siblings: {worker._idle_siblings}).")
     else:
         server.log.info(f"[-] CPU affinity only works on Linux. Skipping...")
         
@@ -52,3 +99,6 @@ def post_fork(server, worker):
     os.environ["GUNICORN_WORKER_ID"] = str(worker_id)
     os.environ["GUNICORN_PROCESS_ID"] = str(pid)
     os.environ["GUNICORN_CPU_CORE_ID"] = str(cpu_id)
+    os.environ["GUNICORN_CPU_IDLE_SIBLINGS"] = ",".join(map(str, worker._idle_siblings))
+    os.environ["GUNICORN_HOUSEKEEPING_CPUS"] = ",".join(map(str, server._core_leases.housekeeping))
+    os.environ["GUNICORN_NUMBER_OF_WORKERS"] = str(server.cfg.workers)
@@ -1 +1,14 @@
 from .session import SandboxSession  # noqa: F401
+from .process import SandboxProcessSession  # noqa: F401
+from .pool import ContainerPool  # noqa: F401
+from .library_cache import LibraryImageCache  # noqa: F401
+from .artifact_cache import ArtifactCache  # noqa: F401
+from .build_cache import BuildCache  # noqa: F401
+from .result_store import ResultStore  # noqa: F401
+from .result_cache import ResultCache  # noqa: F401
+from .input_store import InputStore  # noqa: F401
+from .core_lease import CoreLeaseManager  # noqa: F401
+from .metrics import Metrics  # noqa: F401
+from .client import DockerClientRegistry, get_docker_client  # noqa: F401
+from .image_registry import ImageRegistry, get_image_registry  # noqa: F401
+from .structured_log import LogPipeline, setup_logging  # noqa: F401
@@ -0,0 +1,118 @@
+import io
+import os
+import json
+import hashlib
+import tarfile
+import tempfile
+import threading
+import collections
+from typing import List, Optional
+
+
+class ArtifactCache:
+    def __init__(self, root: Optional[str] = None, max_bytes: int = 5 * 1024 ** 3, verbose: bool = False):
+        """
+        Host-side cache of compiled binaries, keyed by (language, toolchain image, compile commands, source hash)
+        :param root: Directory of the cache, shared by all processes on the host
+        :param max_bytes: Bytes the cached artifacts may occupy before the least recently used ones are removed
+        :param verbose: if True, print messages
+        """
+        self.root = root or os.path.join(os.path.expanduser("~"), ".cache", "monolith", "artifacts")
+        self.max_bytes = max_bytes
+        self.verbose = verbose
+        os.makedirs(self.root, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.key_locks: List[threading.Lock] = [threading.Lock() for _ in range(64)]
+        self.stats = collections.Counter()
+
+    @staticmethod
+    def cache_key(lang: str, image_id: str, compile_commands: List[str], code: str) -> str:
+        """
+        :param lang: Language of the code
+        :param image_id: ID of the image the code is compiled in (toolchain and installed libraries)
+        :param compile_commands: Compile commands, including their flags
+        :param code: Source code
+        :return: Cache key
+        """
+        source_hash = hashlib.sha256(code.encode("utf-8")).hexdigest()
+        payload = json.dumps([lang, image_id, compile_commands, source_hash])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def key_lock(self, key: str) -> threading.Lock:
+        # Concurrent misses on the same key wait for the first compile instead of compiling again.
+        return self.key_locks[int(key[:8], 16) % len(self.key_locks)]
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.tar")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        :param key: Cache key
+        :return: Tar archive of the artifact, ready for put_archive("/", ...), or None on a miss
+        """
+        try:
+            with open(self.path(key), "rb") as f:
+                archive = f.read()
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            with self.lock:
+                self.stats["misses"] += 1
+            return None
+        with self.lock:
+            self.stats["hits"] += 1
+        return archive
+
+    def put(self, key: str, bits, artifact_path: str) -> None:
+        """
+        Store the artifact from a get_archive() stream, re-rooted so that it unpacks to artifact_path from "/".
+        :param key: Cache key
+        :param bits: Chunks of the tar stream returned by container.get_archive(artifact_path)
+        :param artifact_path: Absolute path of the artifact inside the container
+        """
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=io.BytesIO(b"".join(bits)), mode="r") as source, tarfile.open(fileobj=archive, mode="w") as target:
+            member = source.next()
+            content = source.extractfile(member)
+            member.name = artifact_path.lstrip("/")
+            target.addfile(member, content)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(archive.getvalue())
+        os.replace(tmp_path, self.path(key))
+        self.prune()
+
+    def prune(self) -> None:
+        entries = list()
+        for name in os.listdir(self.root):
+            if name.endswith(".tar"):
+                try:
+                    stat = os.stat(os.path.join(self.root, name))
+                    entries.append((stat.st_mtime, stat.st_size, name))
+                except FileNotFoundError:
+                    continue
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.root, name))
+                total_size -= size
+                with self.lock:
+                    self.stats["evictions"] += 1
+            except FileNotFoundError:
+                continue
+
+    def get_status(self) -> dict:
+        with self.lock:
+            requests = self.stats["hits"] + self.stats["misses"]
+            return {
+                "root": self.root,
+                "max_bytes": self.max_bytes,
+                "hits": self.stats["hits"],
+                "misses": self.stats["misses"],
+                "hit_rate": self.stats["hits"] / requests if requests else 0.0,
+                "evictions": self.stats["evictions"],
+            }
@@ -3,9 +3,15 @@ from typing import Optional, List
 
 
 class ConsoleOutput:
-    def __init__(self, stdout=None, stderr=None):
+    def __init__(self, stdout=None, stderr=None, exit_code=None, timed_out=False, stdout_truncated=False, stderr_truncated=False, total_bytes=None):
         self._stdout = stdout
         self._stderr = stderr
+        self.exit_code = exit_code
+        self.timed_out = timed_out
+        # Output past the cap of the session is counted but not kept, see llm_sandbox/output.py.
+        self.stdout_truncated = stdout_truncated
+        self.stderr_truncated = stderr_truncated
+        self.total_bytes = total_bytes if total_bytes is not None else {"stdout": len((stdout or "").encode("utf-8")), "stderr": len((stderr or "").encode("utf-8"))}
 
     @property
     def stdout(self):
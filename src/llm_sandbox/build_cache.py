@@ -0,0 +1,192 @@
+import os
+import time
+import fcntl
+import threading
+from typing import Dict, List, Optional, Union
+
+import docker
+from docker.types import Mount
+from docker.models.images import Image
+
+from llm_sandbox.const import SupportedLanguage, DefaultImage, CARGO_TARGET_TEMPLATE_DIR, GO_BUILD_CACHE_SEED_DIR, GO_BUILD_CACHE_DIR
+from llm_sandbox.client import get_docker_client
+
+# Volume name -> mount point, per language
+BUILD_CACHE_VOLUMES = {
+    SupportedLanguage.RUST: {
+        "monolith-cargo-registry": "/usr/local/cargo/registry",
+        "monolith-cargo-target": CARGO_TARGET_TEMPLATE_DIR,
+    },
+    SupportedLanguage.GO: {
+        "monolith-go-mod": "/go/pkg/mod",
+        "monolith-go-build": GO_BUILD_CACHE_SEED_DIR,
+    },
+}
+
+# Sandboxes only read the volumes, which are written by the trusted warm containers. `go build` needs a writable
+# GOCACHE, so a sandbox builds in a private copy of the warmed one (see get_code_compile_command()).
+BUILD_CACHE_ENVIRONMENT = {
+    SupportedLanguage.GO: {"GOMODCACHE": "/go/pkg/mod", "GOCACHE": GO_BUILD_CACHE_DIR},
+}
+MAINTENANCE_ENVIRONMENT = {
+    SupportedLanguage.GO: {"GOMODCACHE": "/go/pkg/mod", "GOCACHE": GO_BUILD_CACHE_SEED_DIR},
+}
+
+WARM_COMMANDS = {
+    # Build the default project of the image once and publish its target dir as the template of this dependency set,
+    # without the binary of the default project (a failed build seeded from it would otherwise leave it in place).
+    SupportedLanguage.RUST: (
+        "cd /rust_space && template=" + CARGO_TARGET_TEMPLATE_DIR + "/$(sha256sum Cargo.toml | cut -c1-32); "
+        "if [ ! -d $template ]; then "
+        "cargo build && cp -a target $template.$$ && rm -rf $template.$$/debug/incremental $template.$$/debug/rust_space && mv -T $template.$$ $template; "
+        "rm -rf $template.$$; fi"
+    ),
+    # Download the modules required by the workspace of the image, and build them into the seed of the build cache.
+    SupportedLanguage.GO: "cd /go_space && go mod download && (go build all || true)",
+}
+
+PRUNE_COMMANDS = {
+    SupportedLanguage.RUST: f"rm -rf /usr/local/cargo/registry/* {CARGO_TARGET_TEMPLATE_DIR}/*",
+    SupportedLanguage.GO: "go clean -cache && go clean -modcache",
+}
+
+
+class BuildCache:
+    def __init__(
+        self,
+        client: Optional[docker.DockerClient] = None,
+        max_bytes: int = 10 * 1024 ** 3,
+        prune_interval: float = 3600,
+        state_dir: Optional[str] = None,
+        verbose: bool = False,
+    ):
+        """
+        Shared Cargo and Go build cache volumes mounted into sandbox containers
+        :param client: Docker client, if not provided, the shared client of the process is used (llm_sandbox/client.py)
+        :param max_bytes: Bytes the build cache volumes of one language may occupy before they are pruned
+        :param prune_interval: Seconds between two pruning runs on the host
+        :param state_dir: Directory of the host-wide pruning lock
+        :param verbose: if True, print messages
+        """
+        self.client = client if client else get_docker_client()
+        self.max_bytes = max_bytes
+        self.prune_interval = prune_interval
+        self.state_dir = state_dir or os.path.join(os.path.expanduser("~"), ".cache", "monolith")
+        self.verbose = verbose
+        os.makedirs(self.state_dir, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.warmed: Dict[str, float] = dict()
+        self.last_prune: Optional[dict] = None
+        self.pruner: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+
+    def get_mounts(self, lang: str, read_only: bool = True) -> List[Mount]:
+        """
+        :param lang: Language of the code
+        :param read_only: if True, the volumes are mounted read-only (sandboxes), only warm and prune containers write
+        :return: Mounts of the build cache volumes, empty for languages without a build cache
+        """
+        return [Mount(target=target, source=volume, type="volume", read_only=read_only) for volume, target in BUILD_CACHE_VOLUMES.get(lang, {}).items()]
+
+    def get_environment(self, lang: str) -> dict:
+        return dict(BUILD_CACHE_ENVIRONMENT.get(lang, {}))
+
+    def run_maintenance_container(self, lang: str, image: Union[Image, str], command: str) -> None:
+        self.client.containers.run(
+            image,
+            ["bash", "-c", command],
+            mounts=self.get_mounts(lang, read_only=False),
+            environment=dict(MAINTENANCE_ENVIRONMENT.get(lang, {})),
+            remove=True,
+        )
+
+    def warm(self, lang: str, image: Union[Image, str]) -> None:
+        """
+        Populate the build cache for the dependency set of the image, so that sandbox containers only read from it.
+        Runs at most once per image and pruning interval in this process.
+        :param lang: Language of the code
+        :param image: Image the sandbox containers are started from
+        """
+        if lang not in WARM_COMMANDS:
+            return
+
+        image_id = image.id if isinstance(image, Image) else self.client.images.get(image).id
+        with self.lock:
+            if time.time() - self.warmed.get(image_id, 0) < self.prune_interval:
+                return
+            self.warmed[image_id] = time.time()
+
+        try:
+            self.run_maintenance_container(lang, image_id, WARM_COMMANDS[lang])
+        except Exception as e:
+            with self.lock:
+                self.warmed.pop(image_id, None)
+            if self.verbose:
+                print(f"Failed to warm the {lang} build cache: {e}")
+
+    def get_volume_sizes(self) -> Dict[str, int]:
+        volumes = self.client.df().get("Volumes") or []
+        return {volume["Name"]: volume.get("UsageData", {}).get("Size", 0) for volume in volumes}
+
+    def prune(self) -> dict:
+        """
+        Wipe the build cache volumes of every language whose volumes exceed max_bytes.
+        Only one process on the host prunes at a time, and at most once per prune_interval.
+        :return: Volume sizes before pruning and the languages pruned, or an empty dict if skipped
+        """
+        stamp_path = os.path.join(self.state_dir, "build_cache.prune")
+        with open(os.path.join(self.state_dir, "build_cache.lock"), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return {}
+            if os.path.exists(stamp_path) and time.time() - os.path.getmtime(stamp_path) < self.prune_interval:
+                return {}
+
+            sizes = self.get_volume_sizes()
+            pruned = list()
+            for lang, volumes in BUILD_CACHE_VOLUMES.items():
+                if sum(sizes.get(volume, 0) for volume in volumes) > self.max_bytes:
+                    self.run_maintenance_container(lang, DefaultImage.__dict__[lang.upper()], PRUNE_COMMANDS[lang])
+                    pruned.append(lang)
+
+            with open(stamp_path, "w"):
+                pass
+        with self.lock:
+            if pruned:
+                # Pruned templates and modules have to be published again by the warm containers.
+                self.warmed.clear()
+            self.last_prune = {"timestamp": time.time(), "sizes": sizes, "pruned": pruned}
+        return self.last_prune
+
+    def prune_loop(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.prune()
+            except Exception as e:
+                if self.verbose:
+                    print(f"Build cache pruning failed: {e}")
+            self.stopped.wait(self.prune_interval)
+
+    def start_pruner(self) -> None:
+        if self.pruner is None:
+            self.stopped.clear()
+            self.pruner = threading.Thread(target=self.prune_loop, daemon=True)
+            self.pruner.start()
+
+    def stop_pruner(self, timeout: Optional[float] = None) -> None:
+        # A pruning run in progress is finished first.
+        self.stopped.set()
+        if self.pruner is not None:
+            self.pruner.join(timeout)
+            self.pruner = None
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return {
+                "max_bytes": self.max_bytes,
+                "prune_interval": self.prune_interval,
+                "warmed_images": len(self.warmed),
+                "last_prune": self.last_prune,
+            }
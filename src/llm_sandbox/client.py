@@ -0,0 +1,201 @@
+import os
+import time
+import argparse
+import threading
+import statistics
+import collections
+import http.server
+from typing import Optional
+
+import docker
+import requests
+
+DEFAULT_MAX_POOL_SIZE = 10         # HTTP connections kept open to the Docker daemon, docker-py's default
+DEFAULT_HEALTH_CHECK_INTERVAL = 30  # seconds between two pings of the daemon
+
+
+class DockerClientRegistry:
+    def __init__(self, max_pool_size: int = DEFAULT_MAX_POOL_SIZE, health_check_interval: float = DEFAULT_HEALTH_CHECK_INTERVAL, verbose: bool = False):
+        """
+        One Docker client per process, created on first use and shared by all sessions, pools and caches.
+        docker.from_env() opens a new connection pool and asks the daemon for its API version, so creating a client per
+        task costs a round trip and a new connection. The registry is fork-aware: a child process (i.e. a Gunicorn worker)
+        drops the client inherited from its parent and connects on its own, so that no socket is shared across processes.
+        :param max_pool_size: Connections kept open to the daemon, at least the number of threads calling Docker at once
+        :param health_check_interval: Seconds between two pings of the daemon, a failed ping reconnects (0 to disable)
+        :param verbose: if True, print messages
+        """
+        self.max_pool_size = max_pool_size
+        self.health_check_interval = health_check_interval
+        self.verbose = verbose
+
+        self.lock = threading.Lock()
+        self.client: Optional[docker.DockerClient] = None
+        self.pid = os.getpid()
+        self.last_check = 0.0
+        self.stats = collections.Counter()
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def after_fork(self) -> None:
+        # The lock may have been held by another thread of the parent, and the sockets belong to the parent.
+        self.lock = threading.Lock()
+        self.client = None
+        self.pid = os.getpid()
+        self.stats["forks"] += 1
+
+    def configure(self, max_pool_size: Optional[int] = None, health_check_interval: Optional[float] = None) -> None:
+        """
+        Change the settings, a client with another pool size is replaced on the next use
+        :param max_pool_size: Connections kept open to the daemon
+        :param health_check_interval: Seconds between two pings of the daemon
+        """
+        with self.lock:
+            if health_check_interval is not None:
+                self.health_check_interval = health_check_interval
+            if max_pool_size is not None and max_pool_size != self.max_pool_size:
+                self.max_pool_size = max_pool_size
+                self.client = None
+
+    def connect(self) -> docker.DockerClient:
+        client = docker.from_env(max_pool_size=self.max_pool_size)
+        self.last_check = time.monotonic()
+        self.stats["connects"] += 1
+        if self.verbose:
+            print(f"Connected to the Docker daemon (PID {os.getpid()}, max_pool_size {self.max_pool_size})")
+        return client
+
+    def get(self) -> docker.DockerClient:
+        """
+        :return: Docker client of this process, reconnected if the daemon stopped answering
+        """
+        if self.pid != os.getpid():
+            self.after_fork()
+        with self.lock:
+            if self.client is None:
+                self.client = self.connect()
+            elif self.health_check_interval and time.monotonic() - self.last_check >= self.health_check_interval:
+                self.last_check = time.monotonic()
+                try:
+                    self.client.ping()
+                except (docker.errors.DockerException, requests.exceptions.RequestException) as e:
+                    if self.verbose:
+                        print(f"Docker daemon did not answer the health check, reconnecting: {e}")
+                    self.stats["failed_health_checks"] += 1
+                    self.client = self.connect()
+            self.stats["gets"] += 1
+            return self.client
+
+    def invalidate(self) -> None:
+        # Reconnect on the next use, i.e. after a connection error.
+        with self.lock:
+            self.client = None
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return {
+                "connected": self.client is not None,
+                "pid": self.pid,
+                "max_pool_size": self.max_pool_size,
+                "health_check_interval": self.health_check_interval,
+                "connects": self.stats["connects"],
+                "gets": self.stats["gets"],
+                "failed_health_checks": self.stats["failed_health_checks"],
+                "forks": self.stats["forks"],
+            }
+
+
+class SharedDockerClient:
+    """
+    Stand-in for docker.DockerClient that resolves to the client of the registry on every use,
+    so that long-lived holders (pools, caches) follow reconnects and forks.
+    """
+
+    def __init__(self, registry: DockerClientRegistry):
+        self._registry = registry
+
+    def __getattr__(self, name: str):
+        return getattr(self._registry.get(), name)
+
+    def close(self) -> None:
+        # Shared by the whole process, see DockerClientRegistry.invalidate().
+        pass
+
+
+registry = DockerClientRegistry()
+shared_client = SharedDockerClient(registry)
+
+
+def get_docker_client() -> SharedDockerClient:
+    """
+    :return: The Docker client shared by this process
+    """
+    return shared_client
+
+
+class StubDaemonHandler(http.server.BaseHTTPRequestHandler):
+    # The two endpoints a client needs to start: API version negotiation and ping.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = b'{"ApiVersion": "1.45", "Version": "26.0.0"}' if self.path.endswith("/version") else b"OK"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json" if self.path.endswith("/version") else "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+def benchmark(tasks: int, calls: int) -> dict:
+    """
+    Docker client cost per task: a new client per task (the old default) against the shared client
+    :param tasks: Number of simulated tasks
+    :param calls: Docker API calls (pings) per task
+    :return: Seconds per task of both, and the saving
+    """
+    def fresh_task():
+        client = docker.from_env()
+        for _ in range(calls):
+            client.ping()
+        client.close()
+
+    def shared_task():
+        client = get_docker_client()
+        for _ in range(calls):
+            client.ping()
+
+    timings = dict()
+    for name, task in (("fresh", fresh_task), ("shared", shared_task)):
+        task()  # connect once outside the measurement
+        samples = list()
+        for _ in range(tasks):
+            start = time.perf_counter()
+            task()
+            samples.append(time.perf_counter() - start)
+        timings[name] = statistics.median(samples)
+    timings["saving"] = timings["fresh"] - timings["shared"]
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmark of a Docker client per task against the shared client.")
+    parser.add_argument("--tasks", type=int, default=200, help="number of simulated tasks")
+    parser.add_argument("--calls", type=int, default=5, help="Docker API calls per task")
+    parser.add_argument("--stub", action="store_true", help="benchmark against a local HTTP stub of the daemon instead of DOCKER_HOST")
+    args = parser.parse_args()
+
+    if args.stub:
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubDaemonHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        os.environ["DOCKER_HOST"] = f"tcp://127.0.0.1:{server.server_address[1]}"
+
+    result = benchmark(args.tasks, args.calls)
+    print(f"Client per task: {result['fresh'] * 1000:.3f} ms per task")
+    print(f"Shared client:   {result['shared'] * 1000:.3f} ms per task")
+    print(f"Saving:          {result['saving'] * 1000:.3f} ms per task ({result['saving'] / result['fresh']:.0%})")
@@ -23,6 +23,52 @@ class DefaultImage:
     RUST = "rust:1.85.0-bullseye"
 
 
+# Measurement-ready images derived from DefaultImage (see llm_sandbox/image.py)
+READY_IMAGE_REPOSITORY = "monolith-ready"
+READY_IMAGE_LABEL = "monolith.ready"
+
+# Derived images with libraries pre-installed (see llm_sandbox/library_cache.py)
+LIBRARY_IMAGE_REPOSITORY = "monolith-lib"
+LIBRARY_IMAGE_LABEL = "monolith.libraries"
+
+# Shared build cache volumes (see llm_sandbox/build_cache.py)
+CARGO_TARGET_TEMPLATE_DIR = "/cargo_target_template"
+GO_BUILD_CACHE_SEED_DIR = "/root/.cache/go-build"  # warmed Go build cache, read-only in the sandboxes
+GO_BUILD_CACHE_DIR = "/tmp/go-build"               # GOCACHE of a sandbox, seeded from the warmed one for every build
+
+# Native memory sampler of the ready images (see llm_sandbox/memory_sampler.c)
+MEMORY_SAMPLER_PATH = "/usr/local/bin/memory_sampler"
+MEMORY_SAMPLER_INTERVAL_US = 1000
+MEMORY_LOG_MAGIC = b"MNLTMEM1"
+MEMORY_SAMPLER_LABEL = "monolith.sampler"
+
+# Process sandbox (see llm_sandbox/process.py): delegated cgroup v2 subtree of the leaf cgroups, and the host interpreters
+PROCESS_CGROUP_ROOT = "/sys/fs/cgroup/monolith"
+PROCESS_INTERPRETERS = {
+    SupportedLanguage.PYTHON: ["python3"],
+    SupportedLanguage.JAVASCRIPT: ["node"],
+    SupportedLanguage.RUBY: ["ruby"],
+}
+
+# Deadlines: exit status of `timeout -s KILL`, and the extra seconds the host watchdog waits for it
+TIMEOUT_EXIT_CODE = 137
+WATCHDOG_GRACE = 2
+
+# Output capture (see llm_sandbox/output.py): bytes kept per stream, bytes kept in memory before spilling to a temporary
+# file, and the file GNU time writes its report to, so that it does not mix with the stderr of the program
+MAX_OUTPUT_BYTES = 8 * 1024 ** 2
+OUTPUT_SPOOL_THRESHOLD = 1024 ** 2
+TIME_V_OUTPUT_PATH = "/tmp/time_v.log"
+# Output of a run judged against an expected output, both compared inside the sandbox (see get_output_match_command)
+JUDGED_OUTPUT_PATH = "/tmp/stdout"
+EXPECTED_OUTPUT_PATH = "/tmp/expected"
+# OOM kill counters of the memory cgroup of a container: memory.events (cgroup v2) or memory.oom_control (cgroup v1)
+OOM_KILL_COUNTER_PATHS = ("/sys/fs/cgroup/memory.events", "/sys/fs/cgroup/memory/memory.oom_control")
+
+# Content-addressed input store (see llm_sandbox/input_store.py), bind-mounted read-only into every sandbox container
+INPUT_STORE_MOUNT = "/monolith_inputs"
+
+
 NotSupportedLibraryInstallation = ["JAVA"]
 SupportedLanguageValues = [
     v for k, v in SupportedLanguage.__dict__.items() if not k.startswith("__")
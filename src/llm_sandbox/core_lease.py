@@ -0,0 +1,169 @@
+import os
+import time
+import threading
+import collections
+from typing import Dict, List, Optional, Set, Tuple
+
+SYSFS_CPU_ROOT = "/sys/devices/system/cpu"
+
+
+def parse_cpu_list(text: str) -> List[int]:
+    """
+    Parse a kernel CPU list, i.e. "0-3,8,10-11"
+    :param text: CPU list
+    :return: Sorted CPU ids
+    """
+    cpus = set()
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        cpus.update(range(int(start), int(end or start) + 1))
+    return sorted(cpus)
+
+
+def read_sysfs(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def read_cpu_topology(root: str = SYSFS_CPU_ROOT) -> Dict[Tuple[int, int], List[int]]:
+    """
+    Read the physical cores of the host from sysfs
+    :param root: sysfs CPU directory
+    :return: Mapping from (package id, core id) to the logical CPUs (SMT siblings) of that core
+    """
+    online = read_sysfs(os.path.join(root, "online"))
+    cpus = parse_cpu_list(online) if online else list(range(os.cpu_count() or 1))
+    cores: Dict[Tuple[int, int], List[int]] = collections.OrderedDict()
+    for cpu in cpus:
+        package = read_sysfs(os.path.join(root, f"cpu{cpu}", "topology", "physical_package_id"))
+        core = read_sysfs(os.path.join(root, f"cpu{cpu}", "topology", "core_id"))
+        key = (int(package or 0), int(core)) if core is not None else (int(package or 0), cpu)
+        cores.setdefault(key, []).append(cpu)
+    return cores
+
+
+class CoreLease:
+    def __init__(self, index: int, cpu: int, idle_siblings: List[int], owner: str):
+        """
+        A core leased to one task
+        :param index: Slot index, stable for a given cpu (0..number of slots - 1)
+        :param cpu: Logical CPU the task is pinned to (cpuset_cpus)
+        :param idle_siblings: SMT siblings kept idle while the lease is held
+        :param owner: Task or worker holding the lease
+        """
+        self.index = index
+        self.cpu = cpu
+        self.idle_siblings = idle_siblings
+        self.owner = owner
+        self.since = time.time()
+
+    def to_dict(self) -> dict:
+        return {"cpu": self.cpu, "idle_siblings": self.idle_siblings, "owner": self.owner, "since": self.since}
+
+
+class CoreLeaseManager:
+    def __init__(
+        self,
+        housekeeping_cores: int = 1,
+        housekeeping_cpus: Optional[List[int]] = None,
+        smt_exclusive: bool = True,
+        max_slots: Optional[int] = None,
+        root: str = SYSFS_CPU_ROOT,
+    ):
+        """
+        Lease physical cores of the host to benchmark tasks, based on the topology in /sys
+        :param housekeeping_cores: Physical cores (lowest first) reserved for Gunicorn, Docker and the OS
+        :param housekeeping_cpus: Explicit housekeeping CPUs, overrides housekeeping_cores.
+                                  If the kernel isolates CPUs (isolcpus), every CPU that is not isolated is housekeeping.
+        :param smt_exclusive: if True, a task gets a whole physical core and its SMT siblings are kept idle,
+                              otherwise every logical CPU is a slot (distinct physical cores are handed out first)
+        :param max_slots: Use at most this many slots
+        :param root: sysfs CPU directory
+        """
+        self.smt_exclusive = smt_exclusive
+        self.topology = read_cpu_topology(root)
+        allowed = set(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else {cpu for cpus in self.topology.values() for cpu in cpus}
+        isolated = set(parse_cpu_list(read_sysfs(os.path.join(root, "isolated")) or ""))
+
+        if housekeeping_cpus is not None:
+            housekeeping = set(housekeeping_cpus)
+        elif isolated:
+            housekeeping = {cpu for cpus in self.topology.values() for cpu in cpus} - isolated
+        else:
+            housekeeping = {cpu for cpus in list(self.topology.values())[:housekeeping_cores] for cpu in cpus}
+
+        # Slots are (cpu, idle siblings). Cores with a housekeeping CPU are never leased, so benchmarks do not share them.
+        slots: List[Tuple[int, List[int]]] = list()
+        for cpus in self.topology.values():
+            usable = [cpu for cpu in cpus if cpu in allowed and (not isolated or cpu in isolated)]
+            if not usable or housekeeping & set(cpus):
+                continue
+            if smt_exclusive:
+                slots.append((usable[0], [cpu for cpu in cpus if cpu != usable[0]]))
+            else:
+                slots.extend((cpu, []) for cpu in usable)
+        if not smt_exclusive:
+            # Spread over physical cores first: first threads of every core, then second threads, ...
+            rank = {cpu: cpus.index(cpu) for cpus in self.topology.values() for cpu in cpus}
+            slots.sort(key=lambda slot: (rank[slot[0]], slot[0]))
+        if not slots:
+            # Small hosts (i.e. a single core) have nothing besides the housekeeping cores.
+            slots = [(cpu, []) for cpu in sorted(housekeeping & allowed or allowed)]
+        self.slots = slots[:max_slots] if max_slots else slots
+        self.housekeeping = sorted(housekeeping & allowed) or sorted(allowed)
+
+        self.lock = threading.Condition()
+        self.leases: Dict[int, CoreLease] = dict()
+        self.stats = collections.Counter()
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def acquire(self, owner: str, blocking: bool = True, timeout: Optional[float] = None) -> Optional[CoreLease]:
+        """
+        Lease a free core
+        :param owner: Task or worker holding the lease, shown in the lease map
+        :param blocking: if False, return None at once when every core is leased
+        :param timeout: Seconds to wait for a core when blocking
+        :return: Lease, or None if no core became free
+        """
+        with self.lock:
+            while True:
+                for index, (cpu, idle_siblings) in enumerate(self.slots):
+                    if index not in self.leases:
+                        lease = CoreLease(index, cpu, idle_siblings, owner)
+                        self.leases[index] = lease
+                        self.stats["leases"] += 1
+                        return lease
+                if not blocking or not self.lock.wait(timeout):
+                    self.stats["rejections"] += 1
+                    return None
+
+    def release(self, lease: Optional[CoreLease]) -> None:
+        if lease is None:
+            return
+        with self.lock:
+            if self.leases.get(lease.index) is lease:
+                del self.leases[lease.index]
+                self.lock.notify()
+
+    def get_cpus(self) -> Set[int]:
+        return {cpu for cpu, _ in self.slots}
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return {
+                "smt_exclusive": self.smt_exclusive,
+                "housekeeping_cpus": self.housekeeping,
+                "cores": [cpu for cpu, _ in self.slots],
+                "leased": len(self.leases),
+                "free": len(self.slots) - len(self.leases),
+                "leases": {str(lease.cpu): lease.to_dict() for lease in self.leases.values()},
+                "total_leases": self.stats["leases"],
+                "rejections": self.stats["rejections"],
+            }
@@ -1,18 +1,26 @@
 import io
 import os
+import time
+import threading
 import docker
+import docker.errors
 import tarfile
-import tempfile
-from typing import List, Optional, Union
+import shlex
+import contextlib
+from typing import Dict, List, Optional, Tuple, Union
 
 from docker.models.images import Image
 from docker.models.containers import Container
 from docker.types import Mount
 from llm_sandbox.utils import (
-    image_exists,
     get_libraries_installation_command,
     get_code_file_extension,
-    get_code_execution_command,
+    get_code_compile_command,
+    get_code_artifact_path,
+    get_code_run_command,
+    get_output_match_command,
+    with_timeout,
+    parse_oom_kills,
     parse_time_v_output
 )
 from llm_sandbox.base import Session, ConsoleOutput
@@ -21,7 +29,28 @@ from llm_sandbox.const import (
     SupportedLanguageValues,
     DefaultImage,
     NotSupportedLibraryInstallation,
+    READY_IMAGE_LABEL,
+    MEMORY_SAMPLER_LABEL,
+    TIMEOUT_EXIT_CODE,
+    OOM_KILL_COUNTER_PATHS,
+    WATCHDOG_GRACE,
+    MAX_OUTPUT_BYTES,
+    TIME_V_OUTPUT_PATH,
+    JUDGED_OUTPUT_PATH,
+    EXPECTED_OUTPUT_PATH,
 )
+from llm_sandbox.image import get_ready_image_name, MEMORY_PROFILER_PATH
+from llm_sandbox.artifact_cache import ArtifactCache
+from llm_sandbox.build_cache import BuildCache
+from llm_sandbox.input_store import InputStore, check_input_path
+from llm_sandbox.memory_log import read_memory_log_archive
+from llm_sandbox.output import capture_streams
+from llm_sandbox.client import get_docker_client
+from llm_sandbox.image_registry import ImageRegistry, get_image_registry
+
+
+# Paths a task may leave changed in a pooled container: /tmp (emptied by reset()) and the build outputs kept between tasks
+KEPT_BUILD_OUTPUTS = ("/tmp", "/rust_space/target", "/rust_space/Cargo.lock", "/rust_space/src/main.rs", "/root/.cache/go-build")
 
 
 class SandboxDockerSession(Session):
@@ -36,10 +65,14 @@ class SandboxDockerSession(Session):
         verbose: bool = False,
         mounts: Optional[list[Mount]] = None,
         container_configs: Optional[dict] = None,
+        use_ready_image: bool = True,
+        build_cache: Optional[BuildCache] = None,
+        image_registry: Optional[ImageRegistry] = None,
+        input_store: Optional[InputStore] = None,
     ):
         """
         Create a new sandbox session
-        :param client: Docker client, if not provided, a new client will be created based on local Docker context
+        :param client: Docker client, if not provided, the shared client of the process is used (llm_sandbox/client.py)
         :param image: Docker image to use
         :param dockerfile: Path to the Dockerfile, if image is not provided
         :param lang: Language of the code
@@ -48,6 +81,10 @@ class SandboxDockerSession(Session):
         :param verbose: if True, print messages
         :param mounts: List of mounts to be mounted to the container
         :param container_configs: Additional configurations for the container, i.e. resources limits (cpu_count, mem_limit), etc.
+        :param use_ready_image: if True, use the measurement-ready image derived from `image` when it has been prepared
+        :param build_cache: Shared Cargo/Go build cache volumes to mount into the container
+        :param image_registry: Cache of resolved images and their users, defaults to the registry of the client
+        :param input_store: Store of uploaded inputs to mount read-only into the container, so that runs can reference them by digest
         """
         super().__init__(lang, verbose)
         if image and dockerfile:
@@ -66,9 +103,9 @@ class SandboxDockerSession(Session):
 
         if not client:
             if self.verbose:
-                print("Using local Docker context since client is not provided..")
+                print("Using the shared Docker client since client is not provided..")
 
-            self.client = docker.from_env()
+            self.client = get_docker_client()
         else:
             self.client = client
 
@@ -82,6 +119,19 @@ class SandboxDockerSession(Session):
         self.verbose = verbose
         self.mounts = mounts
         self.container_configs = container_configs
+        self.use_ready_image = use_ready_image
+        self.build_cache = build_cache
+        self.image_registry = image_registry or get_image_registry(self.client)
+        self.input_store = input_store
+        self.input_links: List[str] = list()
+        # Host time the first run since open() or reset() started, and the changes of the container right after open()
+        self.run_started: Optional[float] = None
+        self.baseline_changes: set = set()
+        # OOM kills of the container seen so far, a run was OOM killed if the counter went up
+        self.oom_kill_count: Optional[int] = None
+        self.is_ready_image: bool = False
+        self.has_native_sampler: bool = False
+        self.reuse_count: int = 0
 
     def open(self):
         warning_str = (
@@ -102,30 +152,51 @@ class SandboxDockerSession(Session):
             )
             self.is_create_template = True
 
-        if isinstance(self.image, str):
-            if not image_exists(self.client, self.image):
-                if self.verbose:
-                    f_str = f"Pulling image {self.image}.."
-                    f_str = f"{f_str}\n{warning_str}" if self.keep_template else f_str
-                    print(f_str)
-
-                self.image = self.client.images.pull(self.image)
+        # Resolved once per process, see ImageRegistry.
+        image_name = self.image if isinstance(self.image, str) else None
+        if image_name:
+            self.image, pulled = self.image_registry.resolve(image_name, use_ready_image=self.use_ready_image)
+            if pulled:
                 self.is_create_template = True
-            else:
-                self.image = self.client.images.get(self.image)
                 if self.verbose:
-                    print(f"Using image {self.image.tags[-1]}")
-
-        self.container = self.client.containers.run(
-            self.image,
-            detach=True,
-            tty=True,
-            mounts=self.mounts,
-            auto_remove=True,
-            **self.container_configs if self.container_configs else {},
-        )
-        
+                    print(f"Pulled image {image_name}\n{warning_str}" if self.keep_template else f"Pulled image {image_name}")
+            elif self.verbose:
+                print(f"Using image {self.image.tags[-1] if self.image.tags else self.image.id}")
+
+        # Ready images ship GNU time, the memory profiler and the language workspaces already.
+        self.is_ready_image = self.image.labels.get(READY_IMAGE_LABEL) == "1"
+        self.has_native_sampler = self.image.labels.get(MEMORY_SAMPLER_LABEL) == "1"
+
+        mounts = list(self.mounts or [])
+        container_configs = dict(self.container_configs or {})
+        if self.build_cache:
+            self.build_cache.warm(self.lang, self.image)
+            mounts += self.build_cache.get_mounts(self.lang)
+            container_configs["environment"] = {**self.build_cache.get_environment(self.lang), **container_configs.get("environment", {})}
+        if self.input_store:
+            # One read-only bind mount of the whole store, inputs uploaded later show up in running (pooled) containers too.
+            mounts.append(self.input_store.get_mount())
+
+        try:
+            self.container = self.client.containers.run(
+                self.image,
+                detach=True,
+                tty=True,
+                mounts=mounts or None,
+                auto_remove=True,
+                **container_configs,
+            )
+        except docker.errors.ImageNotFound:
+            # The cached image was removed or rebuilt behind our back, the next session resolves it again.
+            if image_name:
+                self.image_registry.invalidate(image_name)
+                self.image_registry.invalidate(get_ready_image_name(image_name))
+            raise
+        self.image_registry.acquire(self.image)
+
         self.setup(libraries=[], run_profiling=True)
+        self.baseline_changes = {change["Path"] for change in self.container.diff() or []}
+        self.oom_kill_count = self.read_oom_kills()
 
     def close(self):
         if self.container:
@@ -134,137 +205,324 @@ class SandboxDockerSession(Session):
 
             self.container.remove(force=True)
             self.container = None
+            self.image_registry.release(self.image)
 
         if self.is_create_template and not self.keep_template:
-            # check if the image is used by any other container
-            containers = self.client.containers.list(all=True)
-            image_id = (
-                self.image.id
-                if isinstance(self.image, Image)
-                else self.client.images.get(self.image).id
-            )
-            image_in_use = any(
-                container.image.id == image_id for container in containers
-            )
-
-            if not image_in_use:
-                if isinstance(self.image, str):
-                    self.client.images.remove(self.image)
-                elif isinstance(self.image, Image):
-                    self.image.remove(force=True)
-                else:
-                    raise ValueError("Invalid image type")
-            else:
+            # Only the sessions of this process are counted, instead of listing every container on the host.
+            image = self.image_registry.lookup(self.image) if isinstance(self.image, str) else self.image
+            if image is None:
+                return
+            if self.image_registry.in_use(image):
                 raise ValueError("Image is in use by another container.")
+            names = list(image.tags)
+            image.remove(force=True)
+            for name in names:
+                self.image_registry.invalidate(name)
 
     def kill(self):
         if self.container:
             self.container.kill()
             self.container.remove(force=True)
             self.container = None
+            self.image_registry.release(self.image)
             if self.verbose:
                 print("Container has been forcefully killed and removed.")
-                
-    def setup(self, libraries=[], run_profiling=False):
-        if not run_profiling:
-            self.execute_command('apt update')
-            self.execute_command('apt install time')
+
+    def reset(self):
+        """
+        Bring a used container back to the state right after open(), so that it can serve another task.
+        Leftover processes are killed, /tmp is emptied and the per-run files (code, stdin, binaries, the build outputs of
+        the submission, memory logs) are removed. If the container was written anywhere else since open() (its changes
+        against the image), or the build outputs it keeps were changed after a run started, RuntimeError is raised and
+        the container must not be reused.
+        """
+        if not self.container:
+            raise RuntimeError("Session is not open. Please call open() method before resetting.")
+
+        run_artifacts = [
+            "mem_usage.log",
+            "/go_space/code.go", "/go_space/code.bin", "/go_space/mem_usage.log",
+            "/rust_space/src/code.rs", "/rust_space/mem_usage.log",
+            "/rust_space/target/debug/rust_space", "/rust_space/target/debug/rust_space.d", "/rust_space/target/debug/incremental",
+            "/rust_space/target/debug/deps/rust_space-*", "/rust_space/target/debug/.fingerprint/rust_space-*",
+        ] + [shlex.quote(path) for path in self.input_links]
+        command = f"kill -9 -1; rm -rf {' '.join(run_artifacts)}; find /tmp -xdev -mindepth 1 -delete"
+        if self.run_started is not None:
+            # Build outputs are kept between tasks, the code must not have changed them (ctime cannot be set back, unlike mtime).
+            kept = " ".join(path for path in KEPT_BUILD_OUTPUTS if path != "/tmp")
+            command += f"; find {kept} ! -type d -newerct @{self.run_started:.6f} -print 2>/dev/null | head -n 5"
+        exit_code, output = self.container.exec_run(["bash", "-c", command])
+        if exit_code != 0:
+            raise RuntimeError(f"Failed to reset container {self.container.short_id}")
+        written = output.decode("utf-8", errors="replace").split() if output else []
+
+        # Everything else the container changed since open() (deleted files included).
+        for change in self.container.diff() or []:
+            path = change["Path"]
+            if path in self.baseline_changes or any(path == kept or path.startswith(kept + "/") for kept in KEPT_BUILD_OUTPUTS):
+                continue
+            # Directories above the kept paths change with their content.
+            if change["Kind"] == 0 and any(kept.startswith(path.rstrip("/") + "/") for kept in KEPT_BUILD_OUTPUTS):
+                continue
+            written.append(path)
+        if written:
+            raise RuntimeError(f"Container {self.container.short_id} was written outside the known paths ({', '.join(written[:5])}), recycling it")
+        self.input_links = list()
+        self.run_started = None
+        self.reuse_count += 1
+
+    def interrupt(self):
+        """
+        Kill every process of the container except its init process, which ends the running exec.
+        The container itself is killed if that fails.
+        """
+        if not self.container:
+            return
+        try:
+            self.container.exec_run(["bash", "-c", "kill -9 -1"])
+        except Exception as e:
+            if self.verbose:
+                print(f"Failed to interrupt {self.container.short_id}, killing it: {e}")
+            self.container.kill()
+
+    def setup(self, libraries=[], run_profiling=False, timeout: Optional[float] = None):
+        """
+        Prepare the container, i.e. GNU time and the language workspace on images that are not ready, and the libraries
+        :param libraries: Libraries to install
+        :param run_profiling: if True, GNU time is not needed
+        :param timeout: Seconds the whole setup may take, TimeoutError is raised when it is exceeded
+        """
+        deadline = time.perf_counter() + timeout if timeout else None
+
+        def execute_command(command, workdir=None):
+            remaining = deadline - time.perf_counter() if deadline else None
+            output = self.execute_command(command, workdir=workdir, timeout=remaining)
+            if output.timed_out:
+                raise TimeoutError(f"Setup timed out after {timeout} seconds.")
+            return output
+
+        def install(library, workdir=None):
+            # A failed install must not end up in a committed (and cached) library image.
+            output = execute_command(get_libraries_installation_command(self.lang, library), workdir=workdir)
+            if output.exit_code != 0:
+                raise RuntimeError(f"Failed to install {library} (exit code {output.exit_code}): {(output.stderr or output.stdout or '').strip()[-1000:]}")
+
+        if not run_profiling and not self.is_ready_image:
+            execute_command('apt update')
+            execute_command('apt install time')
 
         if self.lang.upper() in NotSupportedLibraryInstallation and libraries != []:
             raise ValueError(f"Library installation has not been supported for {self.lang} yet!")
 
         if self.lang == SupportedLanguage.GO:
-            self.execute_command("mkdir -p /go_space")
-            self.execute_command("go mod init go_space", workdir="/go_space")
-            self.execute_command("go mod tidy", workdir="/go_space")
+            if not self.is_ready_image:
+                execute_command("mkdir -p /go_space")
+                execute_command("go mod init go_space", workdir="/go_space")
+                execute_command("go mod tidy", workdir="/go_space")
             for library in libraries:
-                command = get_libraries_installation_command(self.lang, library)
-                _ = self.execute_command(command, workdir="/go_space")
+                install(library, workdir="/go_space")
         elif self.lang == SupportedLanguage.RUST:
-            self.execute_command("cargo new rust_space")
+            if not self.is_ready_image:
+                execute_command("cargo new rust_space")
             for library in libraries:
-                command = get_libraries_installation_command(self.lang, library)
-                _ = self.execute_command(command, workdir="/rust_space")
+                install(library, workdir="/rust_space")
         else:
             for library in libraries:
-                command = get_libraries_installation_command(self.lang, library)
-                _ = self.execute_command(command)
+                install(library)
+
+    def get_workdir(self) -> Optional[str]:
+        if self.lang == SupportedLanguage.GO:
+            return "/go_space"
+        elif self.lang == SupportedLanguage.RUST:
+            return "/rust_space"
+        return None
 
-    def run(self, code: str, stdin: str, run_profiling=False, *args, **kwargs) -> ConsoleOutput:
+    def run(
+        self,
+        code: str,
+        stdin: str,
+        run_profiling=False,
+        artifact_cache: Optional[ArtifactCache] = None,
+        max_log_points: Optional[int] = 1000,
+        compile_timeout: Optional[float] = None,
+        run_timeout: Optional[float] = None,
+        max_output_bytes: Optional[int] = MAX_OUTPUT_BYTES,
+        stdin_digest: Optional[str] = None,
+        input_files: Optional[Dict[str, str]] = None,
+        expected_output: Optional[str] = None,
+        *args,
+        **kwargs,
+    ) -> ConsoleOutput:
+        """
+        Run the code in the container
+        :param code: Source code
+        :param stdin: Standard input of the program
+        :param run_profiling: if True, sample the memory usage, otherwise measure with GNU time
+        :param artifact_cache: Cache of compiled binaries, compiled languages skip the compile step on a hit
+        :param max_log_points: Resample the returned memory log to at most this many points (None keeps every sample)
+        :param compile_timeout: Seconds the compile step may take
+        :param run_timeout: Seconds the program may run
+        :param max_output_bytes: Bytes of stdout and of stderr kept, the rest is only counted (None keeps everything)
+        :param stdin_digest: Digest of a stored input to use as standard input instead of stdin, read in place from the input store
+        :param input_files: Absolute paths in the container to link to stored inputs, i.e. {"/tmp/data.txt": "sha256:..."}
+        :param expected_output: if given, the output is compared with it inside the container and only output_matched is returned, not stdout
+        :return: Response with the output and the measurements, timeout_phase is "compile" or "run" if a deadline was hit,
+                 phase_times holds the seconds spent in file_copy, compile, run, judge and log_retrieval
+        """
         if not self.container:
             raise RuntimeError("Session is not open. Please call open() method before running code.")
 
-        with tempfile.TemporaryDirectory() as directory_name:
-            # Source Path
-            code_source_path = os.path.join(directory_name, f"code.{get_code_file_extension(self.lang)}")
-            stdin_source_path = os.path.join(directory_name, f"stdin")
-            profiler_source_path = './llm_sandbox/memory_profiler.sh'
-            
-            # Destination Path
-            if self.lang == SupportedLanguage.GO:
-                code_dest_path = "/go_space/code.go"
-            elif self.lang == SupportedLanguage.RUST:
-                code_dest_path = "/rust_space/src/"
-            else:
-                code_dest_path = f"/tmp/code.{get_code_file_extension(self.lang)}"
-            profiler_dest_path = "/tmp/memory_profiler.sh"
-            stdin_dest_path = "/tmp/stdin"
-            
-            with open(code_source_path, "w") as f:
-                f.write(code)
-            
-            with open(stdin_source_path, "w") as f:
-                stdin = "" if stdin is None else stdin
-                f.write(stdin)
-
-            self.copy_to_runtime(code_source_path, code_dest_path)
-            self.copy_to_runtime(profiler_source_path, profiler_dest_path)
-            self.copy_to_runtime(stdin_source_path, stdin_dest_path)
-            
-            output = ConsoleOutput()
-            commands = get_code_execution_command(self.lang, code_dest_path, run_profiling=run_profiling, stdin=stdin)
-            
-            for index, command in enumerate(commands):
-                if self.lang == SupportedLanguage.GO:
-                    output = self.execute_command(command, workdir="/go_space")
-                elif self.lang == SupportedLanguage.RUST:
-                    output = self.execute_command(command, workdir="/rust_space")
+        # Destination Path
+        if self.lang == SupportedLanguage.GO:
+            code_dest_path = "/go_space/code.go"
+        elif self.lang == SupportedLanguage.RUST:
+            code_dest_path = "/rust_space/src/code.rs"
+        else:
+            code_dest_path = f"/tmp/code.{get_code_file_extension(self.lang)}"
+        stdin = "" if stdin is None else stdin
+
+        # Stored inputs are only linked, their content never goes through the archive.
+        links = dict()
+        if stdin_digest or input_files:
+            if not self.input_store:
+                raise ValueError("Inputs by digest need a session with an input store")
+            for path, digest in {**(input_files or {}), **({"/tmp/stdin": stdin_digest} if stdin_digest else {})}.items():
+                check_input_path(path)
+                self.input_store.acquire(digest)
+                links[path] = self.input_store.guest_path(digest)
+            self.input_links += [path for path in links if path != "/tmp/stdin"]
+
+        # Code, stdin (and the profiler on images that are not ready) go into the container in one archive.
+        phase_times = dict()
+        start_time = time.perf_counter()
+        # The GNU time report is truncated as well, so that a run killed before writing it does not report the previous one.
+        files = {code_dest_path: code, TIME_V_OUTPUT_PATH: ""}
+        if not stdin_digest:
+            files["/tmp/stdin"] = stdin
+        if expected_output is not None:
+            files[EXPECTED_OUTPUT_PATH] = expected_output
+        if not self.is_ready_image:
+            with open(MEMORY_PROFILER_PATH, "rb") as f:
+                files["/tmp/memory_profiler.sh"] = (f.read(), 0o755)
+        self.copy_files_to_runtime(files, links=links)
+        phase_times["file_copy"] = time.perf_counter() - start_time
+
+        workdir = self.get_workdir()
+        compile_commands = get_code_compile_command(self.lang, code_dest_path, build_cache=self.build_cache is not None)
+        artifact_path = get_code_artifact_path(self.lang)
+        compile_time, run_time, artifact_cache_hit, compiled = 0.0, 0.0, False, True
+        timeout_phase, oom_killed, output_matched = None, False, None
+        output = ConsoleOutput()
+
+        if compile_commands:
+            cache_key = artifact_cache.cache_key(self.lang, self.image.id, compile_commands, code) if artifact_cache else None
+            with artifact_cache.key_lock(cache_key) if cache_key else contextlib.nullcontext():
+                artifact = artifact_cache.get(cache_key) if cache_key else None
+                if artifact:
+                    # Cache hit: only inject the binary, the run step below executes it directly.
+                    start_time = time.perf_counter()
+                    self.container.put_archive("/", artifact)
+                    phase_times["file_copy"] += time.perf_counter() - start_time
+                    artifact_cache_hit = True
                 else:
-                    output = self.execute_command(command)
+                    start_time = time.perf_counter()
+                    for command in compile_commands:
+                        if compile_timeout:
+                            remaining = compile_timeout - (time.perf_counter() - start_time)
+                            command = with_timeout(command, remaining)
+                            output = self.execute_command(command, workdir=workdir, timeout=remaining, max_output_bytes=max_output_bytes)
+                        else:
+                            output = self.execute_command(command, workdir=workdir, max_output_bytes=max_output_bytes)
+                        if output.timed_out or (compile_timeout and output.exit_code == TIMEOUT_EXIT_CODE and time.perf_counter() - start_time >= compile_timeout):
+                            timeout_phase = "compile"
+                            compiled = False
+                            break
+                        if output.exit_code != 0:
+                            # Report the compiler output, whatever binary may be left in place is never run nor cached.
+                            compiled = False
+                            break
+                    compile_time = time.perf_counter() - start_time
+                    phase_times["compile"] = compile_time
+                    if cache_key and compiled:
+                        try:
+                            bits, _ = self.container.get_archive(artifact_path)
+                            artifact_cache.put(cache_key, bits, artifact_path)
+                        except docker.errors.NotFound:
+                            # No binary means the compilation failed, so report the compiler output.
+                            compiled = False
+
+        if compiled:
+            run_command = get_code_run_command(
+                self.lang, code_dest_path, run_profiling=run_profiling, stdin=stdin or stdin_digest, native_sampler=self.has_native_sampler, timeout=run_timeout,
+                stdout_path=JUDGED_OUTPUT_PATH if expected_output is not None else None,
+            )
+            if self.run_started is None:
+                self.run_started = time.time()
+            start_time = time.perf_counter()
+            output = self.execute_command(run_command, workdir=workdir, timeout=run_timeout, max_output_bytes=max_output_bytes)
+            run_time = time.perf_counter() - start_time
+            phase_times["run"] = run_time
+            if output.timed_out or (run_timeout and output.exit_code == TIMEOUT_EXIT_CODE and run_time >= run_timeout):
+                timeout_phase = "run"
+            elif output.exit_code == TIMEOUT_EXIT_CODE:
+                # SIGKILL may come from the program itself, only the memory cgroup tells an OOM kill apart.
+                count = self.read_oom_kills()
+                oom_killed = None not in (count, self.oom_kill_count) and count > self.oom_kill_count
+                self.oom_kill_count = count
+            if expected_output is not None:
+                # The output stays in the container, only its size and the verdict come back.
+                start_time = time.perf_counter()
+                judged = self.execute_command(get_output_match_command(JUDGED_OUTPUT_PATH, EXPECTED_OUTPUT_PATH), max_output_bytes=1024)
+                phase_times["judge"] = time.perf_counter() - start_time
+                output_matched = judged.exit_code == 0
+                output.total_bytes["stdout"] = int((judged.stdout or "0").strip() or 0)
 
-                if self.verbose:
-                    print('stdout:', output.stdout)
-                    print('stderr:', output.stderr)
-
-            # Construct the response
-            response = {"stdout": output.stdout, "stderr": output.stderr, "peak_memory": 0, "integral": 0, "duration": 0, 'log': list()}
-
-            if run_profiling:
-                log_path = os.path.join(directory_name, 'mem_usage.log')
-                if self.lang == SupportedLanguage.GO:
-                    self.copy_from_runtime('/go_space/mem_usage.log', log_path)
-                elif self.lang == SupportedLanguage.RUST:
-                    self.copy_from_runtime('/rust_space/mem_usage.log', log_path)
-                else:
-                    self.copy_from_runtime('mem_usage.log', log_path)
+        if self.verbose:
+            print('stdout:', output.stdout)
+            print('stderr:', output.stderr)
+
+        # Construct the response
+        response = {"stdout": output.stdout, "stderr": output.stderr, "peak_memory": 0, "integral": 0, "duration": 0, 'log': list()}
+        response['compile_time'] = compile_time
+        response['run_time'] = run_time
+        response['artifact_cache_hit'] = artifact_cache_hit
+        response['compiled'] = compiled
+        response['exit_code'] = output.exit_code
+        response['stdout_truncated'] = output.stdout_truncated
+        response['stderr_truncated'] = output.stderr_truncated
+        response['total_bytes'] = output.total_bytes
+        response['timeout_phase'] = timeout_phase
+        response['oom_killed'] = oom_killed
+        response['output_matched'] = output_matched
+        response['phase_times'] = phase_times
+
+        if compiled and run_profiling:
+            # The log is parsed from the archive stream as it arrives, without a temporary copy on disk.
+            # After a timeout it holds the samples up to the deadline, unless the watchdog had to kill the profiler too.
+            start_time = time.perf_counter()
+            try:
+                bits, _ = self.container.get_archive(f"{workdir}/mem_usage.log" if workdir else "mem_usage.log")
+                response.update(read_memory_log_archive(bits, max_log_points=max_log_points))
+            except (docker.errors.NotFound, FileNotFoundError):
+                if not timeout_phase:
+                    raise
+            finally:
+                phase_times["log_retrieval"] = time.perf_counter() - start_time
+        elif compiled:
+            try:
+                # GNU time writes its report to a file of its own, the stderr of the program may be truncated or anything.
+                time_v = parse_time_v_output(self.read_file(TIME_V_OUTPUT_PATH).decode("utf-8", errors="replace"))
+                response['time_v'] = time_v
+            except Exception as e:
+                time_v = None
+                print(f"Error parsing time_v output: {e}")
                 
-                with open(log_path, "r") as mem_profile:
-                    for line in mem_profile.readlines():
-                        timestamp, mem = line.split(" ")
-                        response['peak_memory'] = max(response['peak_memory'], int(mem))
-                        response['integral'] += response['peak_memory']
-                        response['log'].append((int(timestamp), int(mem)))
-                    response['duration'] = (response['log'][-1][0] - response['log'][0][0]) / 1000000
-                os.remove(log_path)
-            else:
-                try:
-                    time_v = parse_time_v_output(output.stderr)
-                    response['time_v'] = time_v
-                except Exception as e:
-                    time_v = None
-                    print(f"Error parsing time_v output: {e}")
-                    
-            return response
+        return response
+
+    def read_oom_kills(self) -> Optional[int]:
+        # oom_kill counter of the memory cgroup of the container (private cgroup namespace), None if there is none.
+        exit_code, output = self.container.exec_run(["cat", *OOM_KILL_COUNTER_PATHS])
+        return parse_oom_kills(output.decode("utf-8", errors="replace")) if output else None
 
     def copy_from_runtime(self, src: str, dest: str):
         if not self.container:
@@ -283,6 +541,52 @@ class SandboxDockerSession(Session):
         with tarfile.open(fileobj=tarstream, mode="r") as tar:
             tar.extractall(os.path.dirname(dest))
 
+    def read_file(self, path: str) -> bytes:
+        """
+        Read a small file of the container into memory
+        :param path: Absolute path in the container
+        :return: Content of the file
+        """
+        if not self.container:
+            raise RuntimeError("Session is not open. Please call open() method before copying files.")
+
+        bits, _ = self.container.get_archive(path)
+        with tarfile.open(fileobj=io.BytesIO(b"".join(bits)), mode="r") as tar:
+            member = tar.next()
+            return tar.extractfile(member).read() if member and member.isfile() else b""
+
+    def copy_files_to_runtime(self, files: Dict[str, Union[str, bytes, Tuple[Union[str, bytes], int]]], links: Optional[Dict[str, str]] = None):
+        """
+        Copy in-memory files into the container with a single put_archive call. Missing directories are created by the archive.
+        :param files: Mapping from absolute destination path to content, or to (content, mode) for i.e. executables
+        :param links: Mapping from absolute destination path to the target of a symbolic link, i.e. a mounted input
+        """
+        if not self.container:
+            raise RuntimeError("Session is not open. Please call open() method before copying files.")
+
+        tarstream = io.BytesIO()
+        with tarfile.open(fileobj=tarstream, mode="w") as tar:
+            for dest, content in files.items():
+                content, mode = content if isinstance(content, tuple) else (content, 0o644)
+                data = content.encode("utf-8") if isinstance(content, str) else content
+                info = tarfile.TarInfo(dest.lstrip("/"))
+                info.size = len(data)
+                info.mode = mode
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(data))
+            for dest, target in (links or {}).items():
+                info = tarfile.TarInfo(dest.lstrip("/"))
+                info.type = tarfile.SYMTYPE
+                info.linkname = target
+                info.mtime = int(time.time())
+                tar.addfile(info)
+
+        if self.verbose:
+            print(f"Copying {list(files) + list(links or {})} to {self.container.short_id}..")
+
+        tarstream.seek(0)
+        self.container.put_archive("/", tarstream)
+
     def copy_to_runtime(self, src: str, dest: str):
         if not self.container:
             raise RuntimeError("Session is not open. Please call open() method before copying files.")
@@ -305,7 +609,17 @@ class SandboxDockerSession(Session):
         tarstream.seek(0)
         self.container.put_archive(os.path.dirname(dest), tarstream)
 
-    def execute_command(self, command: Optional[str], workdir: Optional[str] = None) -> ConsoleOutput:
+    def execute_command(
+        self, command: Optional[str], workdir: Optional[str] = None, timeout: Optional[float] = None, max_output_bytes: Optional[int] = MAX_OUTPUT_BYTES
+    ) -> ConsoleOutput:
+        """
+        Execute a command in the container. The output is streamed into bounded captures instead of being buffered whole.
+        :param command: Command
+        :param workdir: Working directory of the command
+        :param timeout: Seconds after which the host watchdog interrupts the command (plus a grace period for in-container deadlines)
+        :param max_output_bytes: Bytes of stdout and of stderr kept, the rest is only counted (None keeps everything)
+        :return: Output, exit code, whether the watchdog fired, and whether the output was truncated
+        """
         if not command:
             raise ValueError("Command cannot be empty")
 
@@ -317,16 +631,28 @@ class SandboxDockerSession(Session):
         if self.verbose:
             print(f"Executing command: {command}")
 
-        if workdir:
-            exit_code, exec_log = self.container.exec_run(command, stream=False, tty=False, workdir=workdir, demux=True)
-        else:
-            exit_code, exec_log = self.container.exec_run(command, stream=False, tty=False, demux=True)
-
-        stdout = exec_log[0].decode("utf-8") if exec_log[0] else None
-        stderr = exec_log[1].decode("utf-8") if exec_log[1] else None
+        watchdog_fired = threading.Event()
+        watchdog = None
+        if timeout is not None:
+            def fire():
+                watchdog_fired.set()
+                self.interrupt()
+
+            watchdog = threading.Timer(max(timeout, 0) + WATCHDOG_GRACE, fire)
+            watchdog.daemon = True
+            watchdog.start()
+
+        try:
+            # The low-level API, since a streamed exec_run() does not report the exit code.
+            exec_id = self.client.api.exec_create(self.container.id, command, stdout=True, stderr=True, tty=False, workdir=workdir)["Id"]
+            captured = capture_streams(self.client.api.exec_start(exec_id, stream=True, demux=True), max_output_bytes)
+            exit_code = self.client.api.exec_inspect(exec_id)["ExitCode"]
+        finally:
+            if watchdog:
+                watchdog.cancel()
 
         if self.verbose:
-            print(f"stdout:\n{stdout}")
-            print(f"stderr:\n{stderr}")
+            print(f"stdout:\n{captured['stdout']}")
+            print(f"stderr:\n{captured['stderr']}")
 
-        return ConsoleOutput(stdout, stderr)
+        return ConsoleOutput(exit_code=exit_code, timed_out=watchdog_fired.is_set(), **captured)
@@ -0,0 +1,336 @@
+import io
+import os
+import time
+import shlex
+import random
+import struct
+import tarfile
+import hashlib
+import threading
+import itertools
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import docker.errors
+
+from llm_sandbox.const import (
+    SupportedLanguageValues,
+    DefaultImage,
+    READY_IMAGE_REPOSITORY,
+    OOM_KILL_COUNTER_PATHS,
+    READY_IMAGE_LABEL,
+    MEMORY_SAMPLER_PATH,
+    MEMORY_SAMPLER_LABEL,
+    MEMORY_LOG_MAGIC,
+    JUDGED_OUTPUT_PATH,
+    EXPECTED_OUTPUT_PATH,
+)
+from llm_sandbox.utils import outputs_match
+
+# Seconds each Docker call takes, roughly what we see on a busy host
+DEFAULT_LATENCIES = {
+    "container_start": 0.3,
+    "container_remove": 0.05,
+    "exec": 0.01,        # exec_run of setup, reset and interrupt commands
+    "compile": 0.5,      # exec_run of g++, go build and cargo build
+    "run": 0.05,         # exec_run of the measured program
+    "put_archive": 0.005,
+    "get_archive": 0.005,
+    "image_build": 1.0,  # images.build and container.commit
+}
+COMPILE_MARKERS = ("g++ ", "go build", "cargo build")
+RUN_MARKERS = ("/usr/bin/time -v", MEMORY_SAMPLER_PATH, "memory_profiler.sh")
+TIME_V_OUTPUT = (
+    "\tCommand being timed: \"{command}\"\n"
+    "\tUser time (seconds): {seconds:.2f}\n"
+    "\tSystem time (seconds): 0.00\n"
+    "\tPercent of CPU this job got: 99%\n"
+    "\tElapsed (wall clock) time (h:mm:ss or m:ss): 0:{seconds:05.2f}\n"
+    "\tMaximum resident set size (kbytes): 9216\n"
+    "\tExit status: 0\n"
+)
+
+
+def make_tar(files: Dict[str, bytes]) -> bytes:
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode="w") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name.lstrip("/"))
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return stream.getvalue()
+
+
+class FakeImage:
+    def __init__(self, client: "FakeDockerClient", name: str, labels: Optional[Dict[str, str]] = None, size: int = 512 * 1024 ** 2):
+        self.client = client
+        self.id = "sha256:" + hashlib.sha256(f"{name}-{time.time_ns()}".encode("utf-8")).hexdigest()
+        self.tags = [name]
+        self.labels = dict(labels or {})
+        self.attrs = {"Id": self.id, "Size": size, "Created": time.strftime("%Y-%m-%dT%H:%M:%S"), "Config": {"Labels": self.labels}}
+
+    def remove(self, force: bool = False) -> None:
+        self.client.images.remove(self.tags[0], force=force)
+
+
+class FakeImageCollection:
+    def __init__(self, client: "FakeDockerClient"):
+        self.client = client
+        self.images: Dict[str, FakeImage] = dict()
+
+    def add(self, name: str, labels: Optional[Dict[str, str]] = None) -> FakeImage:
+        image = FakeImage(self.client, name, labels)
+        with self.client.lock:
+            self.images[name] = image
+            self.images[image.id] = image
+        return image
+
+    def get(self, name: str) -> FakeImage:
+        with self.client.lock:
+            image = self.images.get(name)
+        if image is None:
+            raise docker.errors.ImageNotFound(f"No such image: {name}")
+        return image
+
+    def list(self, filters: Optional[dict] = None, **kwargs) -> List[FakeImage]:
+        label = (filters or {}).get("label")
+        with self.client.lock:
+            images = {image.id: image for image in self.images.values()}.values()
+        return [image for image in images if label is None or label.split("=")[0] in image.labels]
+
+    def pull(self, name: str, **kwargs) -> FakeImage:
+        self.client.sleep("image_build")
+        return self.add(name)
+
+    def build(self, tag: str, **kwargs) -> Tuple[FakeImage, Iterator[dict]]:
+        self.client.sleep("image_build")
+        # Only the measurement-ready images are built, see llm_sandbox/image.py.
+        labels = {READY_IMAGE_LABEL: "1", MEMORY_SAMPLER_LABEL: "1"} if tag.startswith(READY_IMAGE_REPOSITORY) else {}
+        return self.add(tag, labels), iter(())
+
+    def remove(self, name: str, force: bool = False, **kwargs) -> None:
+        with self.client.lock:
+            image = self.images.get(name)
+            if image is None:
+                raise docker.errors.ImageNotFound(f"No such image: {name}")
+            for key in [key for key, value in self.images.items() if value is image]:
+                del self.images[key]
+
+
+class FakeContainer:
+    def __init__(self, client: "FakeDockerClient", image: FakeImage, name: str, mounts: Optional[list] = None):
+        self.client = client
+        self.image = image
+        self.name = name
+        self.id = hashlib.sha256(name.encode("utf-8")).hexdigest()
+        self.short_id = self.id[:12]
+        self.attrs = {"Id": self.id, "Name": name, "State": {"Status": "running", "OOMKilled": False}}
+        # oom_kill counter of the memory cgroup, see OOM_KILL_COUNTER_PATHS
+        self.oom_kills = 0
+        self.status = "running"
+        self.files: Dict[str, bytes] = dict()
+        self.links: Dict[str, str] = dict()
+        # Bind mounts are real: files under their target are read from the host.
+        self.binds = {mount["Target"]: mount["Source"] for mount in mounts or [] if mount.get("Type") == "bind"}
+
+    def read(self, path: str) -> bytes:
+        path = self.links.get(path, path)
+        for target, source in self.binds.items():
+            if path.startswith(target + "/"):
+                with open(os.path.join(source, path[len(target) + 1:]), "rb") as f:
+                    return f.read()
+        return self.files.get(path, b"")
+
+    def exec_run(self, cmd, stream: bool = False, tty: bool = False, workdir: Optional[str] = None, demux: bool = False, **kwargs):
+        """
+        Pretend to run a command: compile commands leave a binary behind, measured runs echo their stdin
+        and write the GNU time report (or the memory log of the native sampler), output comparisons compare for real.
+        """
+        command = " ".join(cmd) if isinstance(cmd, (list, tuple)) else cmd
+        stdout, stderr, exit_code = b"", b"", 0
+        if any(marker in command for marker in COMPILE_MARKERS):
+            self.client.sleep("compile")
+            for path in ("/tmp/a.out", "/go_space/code.bin", "/rust_space/target/debug/rust_space"):
+                self.files[path] = b"\x7fELF"
+        elif any(marker in command for marker in RUN_MARKERS):
+            seconds = self.client.sleep("run")
+            stdout = self.read("/tmp/stdin")
+            if f"> {JUDGED_OUTPUT_PATH}" in command:
+                self.files[JUDGED_OUTPUT_PATH], stdout = stdout, b""
+            now, samples = time.time_ns(), range(max(int(seconds * 1000), 1))
+            if MEMORY_SAMPLER_PATH in command:
+                records = b"".join(struct.pack("<qq", now + index * 1000000, 8192 + index) for index in samples)
+                self.files[os.path.join(workdir or "/", "mem_usage.log")] = MEMORY_LOG_MAGIC + records + struct.pack("<qq", -1, 1000)
+            elif "memory_profiler.sh" in command:
+                lines = "".join(f"{now + index * 1000000} {8192 + index}\n" for index in samples)
+                self.files[os.path.join(workdir or "/", "mem_usage.log")] = lines.encode("utf-8")
+            elif "/usr/bin/time -v" in command:
+                report = TIME_V_OUTPUT.format(command=command, seconds=seconds).encode("utf-8")
+                match = re.search(r"/usr/bin/time -v -o (\S+)", command)
+                if match:
+                    self.files[match.group(1)] = report
+                else:
+                    stderr = report
+        elif "cmp -s" in command:
+            self.client.sleep("exec")
+            output = self.read(JUDGED_OUTPUT_PATH)
+            stdout = f"{len(output)}\n".encode("utf-8")
+            exit_code = 0 if outputs_match(output.splitlines(), self.read(EXPECTED_OUTPUT_PATH).splitlines()) else 1
+        elif command.startswith(f"cat {OOM_KILL_COUNTER_PATHS[0]}"):
+            stdout = f"low 0\nhigh 0\nmax 0\noom 0\noom_kill {self.oom_kills}\n".encode("utf-8")
+        else:
+            self.client.sleep("exec")
+            if command.startswith("bash -c kill -9 -1; rm -rf"):
+                # reset() between two tasks of a pooled container
+                self.files.clear()
+                self.links.clear()
+        if demux:
+            return exit_code, (stdout or None, stderr or None)
+        return exit_code, stdout + stderr
+
+    def diff(self) -> List[dict]:
+        # Changes against the image: every file written (Kind 1, added).
+        return [{"Path": path, "Kind": 1} for path in list(self.files) + list(self.links)]
+
+    def put_archive(self, path: str, data) -> bool:
+        self.client.sleep("put_archive")
+        data = data.getvalue() if hasattr(data, "getvalue") else data
+        with tarfile.open(fileobj=io.BytesIO(data), mode="r") as tar:
+            for member in tar.getmembers():
+                if member.isfile():
+                    self.files[os.path.join(path, member.name)] = tar.extractfile(member).read()
+                    self.links.pop(os.path.join(path, member.name), None)
+                elif member.issym():
+                    self.links[os.path.join(path, member.name)] = member.linkname
+                    self.files.pop(os.path.join(path, member.name), None)
+        return True
+
+    def get_archive(self, path: str, chunk_size: int = 2 * 1024 * 1024) -> Tuple[Iterator[bytes], dict]:
+        self.client.sleep("get_archive")
+        path = os.path.join("/", path)
+        if path not in self.files:
+            raise docker.errors.NotFound(f"Could not find the file {path} in container {self.name}")
+        archive = make_tar({os.path.basename(path): self.files[path]})
+        chunks = (archive[index:index + chunk_size] for index in range(0, len(archive), chunk_size))
+        return chunks, {"name": os.path.basename(path), "size": len(self.files[path])}
+
+    def commit(self, repository: str, tag: str, changes: Optional[List[str]] = None, **kwargs) -> FakeImage:
+        self.client.sleep("image_build")
+        labels = dict(self.image.labels)
+        for change in changes or []:
+            if change.startswith("LABEL "):
+                labels.update(item.split("=", 1) for item in shlex.split(change[len("LABEL "):]))
+        return self.client.images.add(f"{repository}:{tag}", labels)
+
+    def kill(self, **kwargs) -> None:
+        self.status = "exited"
+
+    def stop(self, **kwargs) -> None:
+        self.status = "exited"
+
+    def remove(self, force: bool = False, **kwargs) -> None:
+        self.client.sleep("container_remove")
+        self.client.containers.forget(self)
+
+
+class FakeContainerCollection:
+    def __init__(self, client: "FakeDockerClient"):
+        self.client = client
+        self.containers: Dict[str, FakeContainer] = dict()
+        self.sequence = itertools.count()
+
+    def run(self, image, command=None, detach: bool = False, remove: bool = False, **kwargs):
+        self.client.sleep("container_start")
+        image = image if isinstance(image, FakeImage) else self.client.images.get(image)
+        if not detach:
+            # Maintenance containers (i.e. warming the build cache) run their command and are gone.
+            return b""
+        container = FakeContainer(self.client, image, f"fake-{next(self.sequence)}", mounts=kwargs.get("mounts"))
+        with self.client.lock:
+            self.containers[container.id] = container
+        return container
+
+    def list(self, all: bool = False, **kwargs) -> List[FakeContainer]:
+        with self.client.lock:
+            return list(self.containers.values())
+
+    def get(self, container_id: str) -> FakeContainer:
+        with self.client.lock:
+            for container in self.containers.values():
+                if container_id in (container.id, container.short_id, container.name):
+                    return container
+        raise docker.errors.NotFound(f"No such container: {container_id}")
+
+    def forget(self, container: FakeContainer) -> None:
+        with self.client.lock:
+            self.containers.pop(container.id, None)
+
+
+class FakeAPIClient:
+    def __init__(self, client: "FakeDockerClient"):
+        """
+        The exec endpoints of the low-level API, for streamed execs (see SandboxDockerSession.execute_command)
+        """
+        self.client = client
+        self.sequence = itertools.count()
+        self.execs: Dict[str, dict] = dict()
+
+    def exec_create(self, container: str, cmd, workdir: Optional[str] = None, **kwargs) -> dict:
+        exec_id = f"exec-{next(self.sequence)}"
+        with self.client.lock:
+            self.execs[exec_id] = {"container": container, "cmd": cmd, "workdir": workdir, "exit_code": None}
+        return {"Id": exec_id}
+
+    def exec_start(self, exec_id: str, stream: bool = False, demux: bool = False, chunk_size: int = 64 * 1024, **kwargs):
+        entry = self.execs[exec_id]
+        container = self.client.containers.get(entry["container"])
+        entry["exit_code"], (stdout, stderr) = container.exec_run(entry["cmd"], workdir=entry["workdir"], demux=True)
+        if not stream:
+            return (stdout, stderr) if demux else (stdout or b"") + (stderr or b"")
+        # Frames of at most chunk_size bytes, the way the daemon multiplexes them.
+        frames = [(stdout[index:index + chunk_size], None) for index in range(0, len(stdout or b""), chunk_size)]
+        frames += [(None, stderr[index:index + chunk_size]) for index in range(0, len(stderr or b""), chunk_size)]
+        return iter(frames)
+
+    def exec_inspect(self, exec_id: str) -> dict:
+        with self.client.lock:
+            entry = self.execs.pop(exec_id)
+        return {"ExitCode": entry["exit_code"], "Running": False}
+
+
+class FakeDockerClient:
+    def __init__(self, latencies: Optional[Dict[str, float]] = None, jitter: float = 0.0, seed: Optional[int] = None):
+        """
+        In-process stand-in for docker.DockerClient, for benchmarking the HTTP and queueing layers without a daemon.
+        Every call sleeps for its configured latency, so worker threads block the way they do on real Docker calls.
+        :param latencies: Seconds per call type, overrides DEFAULT_LATENCIES
+        :param jitter: Relative jitter of the latencies, i.e. 0.2 for +-20%
+        :param seed: Seed of the jitter
+        """
+        self.latencies = {**DEFAULT_LATENCIES, **(latencies or {})}
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls: Dict[str, int] = {kind: 0 for kind in self.latencies}
+        self.images = FakeImageCollection(self)
+        self.containers = FakeContainerCollection(self)
+        self.api = FakeAPIClient(self)
+        for lang in SupportedLanguageValues:
+            self.images.add(DefaultImage.__dict__[lang.upper()])
+
+    def sleep(self, kind: str) -> float:
+        with self.lock:
+            self.calls[kind] += 1
+            seconds = self.latencies[kind] * (1 + self.random.uniform(-self.jitter, self.jitter))
+        if seconds > 0:
+            time.sleep(seconds)
+        return seconds
+
+    def df(self) -> dict:
+        return {"Volumes": []}
+
+    def ping(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,132 @@
+import io
+import os
+import tarfile
+import argparse
+from typing import List, Optional
+
+from docker import DockerClient
+
+from llm_sandbox.utils import image_exists
+from llm_sandbox.const import (
+    SupportedLanguage,
+    SupportedLanguageValues,
+    DefaultImage,
+    READY_IMAGE_REPOSITORY,
+    READY_IMAGE_LABEL,
+    MEMORY_SAMPLER_PATH,
+    MEMORY_SAMPLER_LABEL,
+)
+from llm_sandbox.client import get_docker_client
+
+MEMORY_PROFILER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "memory_profiler.sh")
+MEMORY_SAMPLER_SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "memory_sampler.c")
+
+
+def get_ready_image_name(image: str) -> str:
+    """
+    Get the name of the measurement-ready image derived from the given image
+    :param image: Base image, i.e. python:3.9.19-bullseye
+    :return: Derived image name, i.e. monolith-ready/python:3.9.19-bullseye
+    """
+    repository, _, tag = image.rpartition(":") if ":" in image.split("/")[-1] else (image, "", "latest")
+    return f"{READY_IMAGE_REPOSITORY}/{repository.replace('/', '-').replace(':', '-')}:{tag}"
+
+
+def get_ready_image_dockerfile(lang: str, image: str) -> str:
+    """
+    Generate the Dockerfile of the measurement-ready image for the given language
+    :param lang: Programming language
+    :param image: Base image
+    :return: Dockerfile content
+    """
+    lines = [
+        # The native memory sampler is built statically in the C++ toolchain image, so it runs in every language image.
+        f"FROM {DefaultImage.CPP} AS sampler",
+        "COPY memory_sampler.c /memory_sampler.c",
+        "RUN gcc -O2 -static -o /memory_sampler /memory_sampler.c",
+        f"FROM {image}",
+        "RUN apt-get update && apt-get install -y --no-install-recommends time && rm -rf /var/lib/apt/lists/*",
+        "COPY memory_profiler.sh /tmp/memory_profiler.sh",
+        "RUN chmod +x /tmp/memory_profiler.sh",
+        f"COPY --from=sampler /memory_sampler {MEMORY_SAMPLER_PATH}",
+    ]
+    if lang == SupportedLanguage.GO:
+        lines.append("RUN mkdir -p /go_space && cd /go_space && go mod init go_space && go mod tidy")
+    elif lang == SupportedLanguage.RUST:
+        lines.append("RUN cd / && cargo new rust_space")
+    lines.append(f'LABEL {READY_IMAGE_LABEL}="1" {MEMORY_SAMPLER_LABEL}="1"')
+    return "\n".join(lines) + "\n"
+
+
+def build_ready_image(client: DockerClient, lang: str, image: Optional[str] = None, verbose: bool = False) -> str:
+    """
+    Build the measurement-ready image for the given language
+    :param client: Docker client
+    :param lang: Programming language
+    :param image: Base image, defaults to the language image
+    :param verbose: if True, print messages
+    :return: Name of the built image
+    """
+    image = image or DefaultImage.__dict__[lang.upper()]
+    ready_image = get_ready_image_name(image)
+    if verbose:
+        print(f"Building {ready_image} from {image}..")
+
+    context = io.BytesIO()
+    with tarfile.open(fileobj=context, mode="w") as tar:
+        dockerfile = get_ready_image_dockerfile(lang, image).encode("utf-8")
+        info = tarfile.TarInfo("Dockerfile")
+        info.size = len(dockerfile)
+        tar.addfile(info, io.BytesIO(dockerfile))
+        tar.add(MEMORY_PROFILER_PATH, arcname="memory_profiler.sh")
+        tar.add(MEMORY_SAMPLER_SOURCE_PATH, arcname="memory_sampler.c")
+    context.seek(0)
+
+    client.images.build(fileobj=context, custom_context=True, tag=ready_image, rm=True)
+    return ready_image
+
+
+def prepare_images(client: Optional[DockerClient] = None, languages: Optional[List[str]] = None, force: bool = False, verbose: bool = False) -> dict:
+    """
+    Make sure a measurement-ready image exists for each language. Images that already exist are not rebuilt unless forced.
+    :param client: Docker client, if not provided, the shared client of the process is used (llm_sandbox/client.py)
+    :param languages: Languages to prepare, defaults to all supported languages
+    :param force: if True, rebuild the images even if they exist
+    :param verbose: if True, print messages
+    :return: Mapping from language to the ready image name, or the error message if the build failed
+    """
+    client = client if client else get_docker_client()
+    prepared = dict()
+    for lang in languages or SupportedLanguageValues:
+        image = DefaultImage.__dict__[lang.upper()]
+        ready_image = get_ready_image_name(image)
+        try:
+            # Ready images built before the native sampler existed are rebuilt as well.
+            if force or not image_exists(client, ready_image) or MEMORY_SAMPLER_LABEL not in client.images.get(ready_image).labels:
+                build_ready_image(client, lang, image, verbose=verbose)
+            prepared[lang] = ready_image
+        except Exception as e:
+            prepared[lang] = f"error: {e}"
+            if verbose:
+                print(f"Failed to build {ready_image}: {e}")
+    return prepared
+
+
+def get_ready_languages(client: Optional[DockerClient] = None) -> List[str]:
+    """
+    List the languages whose measurement-ready image exists, without building anything
+    :param client: Docker client, if not provided, the shared client of the process is used (llm_sandbox/client.py)
+    :return: Languages with a ready image
+    """
+    client = client if client else get_docker_client()
+    return [lang for lang in SupportedLanguageValues if image_exists(client, get_ready_image_name(DefaultImage.__dict__[lang.upper()]))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the measurement-ready Monolith images.")
+    parser.add_argument("--lang", nargs="*", choices=SupportedLanguageValues, help="languages to prepare (default: all)")
+    parser.add_argument("--force", action="store_true", help="rebuild images that already exist")
+    args = parser.parse_args()
+
+    for lang, ready_image in prepare_images(languages=args.lang, force=args.force, verbose=True).items():
+        print(f"{lang}: {ready_image}")
@@ -0,0 +1,173 @@
+import os
+import threading
+import collections
+from typing import Dict, List, Optional, Tuple
+
+import docker
+import docker.errors
+from docker import DockerClient
+from docker.models.images import Image
+
+from llm_sandbox.const import SupportedLanguageValues, DefaultImage, READY_IMAGE_LABEL, MEMORY_SAMPLER_LABEL
+from llm_sandbox.image import get_ready_image_name
+from llm_sandbox.client import get_docker_client
+
+
+class ImageRegistry:
+    def __init__(self, client: Optional[DockerClient] = None, verbose: bool = False):
+        """
+        Resolved images by name, so that opening a session does not ask the daemon again, and the number of sessions
+        of this process using each image, so that closing one does not have to list every container on the host.
+        :param client: Docker client, if not provided, the shared client of the process is used (llm_sandbox/client.py)
+        :param verbose: if True, print messages
+        """
+        self.client = client if client else get_docker_client()
+        self.verbose = verbose
+
+        self.lock = threading.Lock()
+        self.key_locks: List[threading.Lock] = [threading.Lock() for _ in range(16)]
+        # name -> Image, or None for a name known not to exist (i.e. a ready image that was never built)
+        self.images: Dict[str, Optional[Image]] = dict()
+        # image ID -> open sessions of this process
+        self.refcounts: Dict[str, int] = collections.Counter()
+        self.stats = collections.Counter()
+        self.pid = os.getpid()
+
+    def check_fork(self) -> None:
+        # Image objects hold the connection of the process that resolved them, and sessions are per process.
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.lock = threading.Lock()
+            self.key_locks = [threading.Lock() for _ in self.key_locks]
+            self.images = dict()
+            self.refcounts = collections.Counter()
+
+    def lookup(self, name: str) -> Optional[Image]:
+        """
+        :param name: Image name or ID
+        :return: Image, or None if it does not exist, from the cache after the first call
+        """
+        self.check_fork()
+        with self.lock:
+            if name in self.images:
+                self.stats["hits"] += 1
+                return self.images[name]
+            self.stats["misses"] += 1
+        try:
+            image = self.client.images.get(name)
+        except docker.errors.ImageNotFound:
+            image = None
+        with self.lock:
+            self.images[name] = image
+        return image
+
+    def resolve(self, name: str, use_ready_image: bool = True, pull: bool = True) -> Tuple[Image, bool]:
+        """
+        Find the image to start a container from
+        :param name: Image name
+        :param use_ready_image: if True, prefer the measurement-ready image derived from it when it has been prepared
+        :param pull: if True, pull the image if it does not exist locally
+        :return: Image, and whether it had to be pulled
+        """
+        self.check_fork()
+        if use_ready_image:
+            ready_image = self.lookup(get_ready_image_name(name))
+            if ready_image is not None:
+                return ready_image, False
+        image = self.lookup(name)
+        if image is not None:
+            return image, False
+        if not pull:
+            raise docker.errors.ImageNotFound(f"No such image: {name}")
+
+        # One pull per image, concurrent sessions wait for it.
+        with self.key_locks[hash(name) % len(self.key_locks)]:
+            with self.lock:
+                image = self.images.get(name)
+            if image is not None:
+                return image, False
+            if self.verbose:
+                print(f"Pulling image {name}..")
+            image = self.client.images.pull(name)
+            with self.lock:
+                self.images[name] = image
+                self.stats["pulls"] += 1
+            return image, True
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        # Forget a name (i.e. after removing or rebuilding the image), or every name.
+        with self.lock:
+            if name is None:
+                self.images.clear()
+            else:
+                self.images.pop(name, None)
+
+    def acquire(self, image: Image) -> None:
+        self.check_fork()
+        with self.lock:
+            self.refcounts[image.id] += 1
+
+    def release(self, image: Image) -> None:
+        self.check_fork()
+        with self.lock:
+            self.refcounts[image.id] -= 1
+            if self.refcounts[image.id] <= 0:
+                del self.refcounts[image.id]
+
+    def in_use(self, image: Image) -> bool:
+        """
+        :param image: Image
+        :return: True if an open session of this process runs a container of the image
+        """
+        self.check_fork()
+        with self.lock:
+            return self.refcounts.get(image.id, 0) > 0
+
+    def prepare(self, languages: Optional[List[str]] = None, pull: bool = True) -> Dict[str, str]:
+        """
+        Pull and validate the default image of every language ahead of the first task, and cache the resolved images
+        :param languages: Languages to prepare, defaults to all supported languages
+        :param pull: if True, pull missing images, otherwise only look them up
+        :return: Mapping from language to the image its sessions start from, or the error message if it is not usable
+        """
+        self.invalidate()
+        prepared = dict()
+        for lang in languages or SupportedLanguageValues:
+            name = DefaultImage.__dict__[lang.upper()]
+            try:
+                image, _ = self.resolve(name, pull=pull)
+                if image.attrs.get("Os", "linux") != "linux":
+                    raise ValueError(f"{image.tags} is not a Linux image")
+                if image.labels.get(READY_IMAGE_LABEL) == "1" and image.labels.get(MEMORY_SAMPLER_LABEL) != "1":
+                    raise ValueError(f"{image.tags} was built before the native memory sampler, rebuild it with python -m llm_sandbox.image --force")
+                prepared[lang] = image.tags[0] if image.tags else image.id
+            except Exception as e:
+                prepared[lang] = f"error: {e}"
+                if self.verbose:
+                    print(f"Image of {lang} ({name}) is not usable: {e}")
+        return prepared
+
+    def get_status(self) -> dict:
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                "images": sorted(name for name, image in self.images.items() if image is not None),
+                "in_use": dict(self.refcounts),
+                "hits": self.stats["hits"],
+                "misses": self.stats["misses"],
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "pulls": self.stats["pulls"],
+            }
+
+
+shared_registry = ImageRegistry()
+
+
+def get_image_registry(client: Optional[DockerClient] = None) -> ImageRegistry:
+    """
+    :param client: Docker client, defaults to the shared client of the process
+    :return: The registry shared by the process for the shared client, a registry of its own for any other client
+    """
+    if client is None or client is get_docker_client():
+        return shared_registry
+    return ImageRegistry(client)
@@ -0,0 +1,215 @@
+import os
+import re
+import time
+import hashlib
+import tempfile
+import threading
+import collections
+from typing import BinaryIO, List, Optional
+
+from docker.types import Mount
+
+from llm_sandbox.const import INPUT_STORE_MOUNT
+
+DIGEST_PATTERN = re.compile(r"^(?:sha256:)?([0-9a-f]{64})$")
+
+
+def parse_digest(digest: str) -> str:
+    """
+    :param digest: Digest of an input, "sha256:<hex>" or the bare hex
+    :return: The bare hex, which is also the file name in the store
+    """
+    match = DIGEST_PATTERN.match(digest or "") if isinstance(digest, str) else None
+    if match is None:
+        raise ValueError(f"Invalid input digest {digest!r}, expected sha256:<64 hex digits>")
+    return match.group(1)
+
+
+def check_input_path(path: str) -> str:
+    """
+    :param path: Path in the sandbox an input is linked at, i.e. "/tmp/data.txt"
+    :return: The path, ValueError is raised unless it is absolute and free of "." and ".." components
+    """
+    if not isinstance(path, str) or not path.startswith("/") or path.endswith("/"):
+        raise ValueError(f"Input file path must be an absolute file path, got {path!r}")
+    if any(part in (".", "..") for part in path.split("/")) or os.path.normpath(path) != path:
+        raise ValueError(f"Input file path must be normalized, without . or .. components, got {path!r}")
+    return path
+
+
+class InputWriter:
+    def __init__(self, store: "InputStore"):
+        """
+        Upload of one input, hashed while it is written so that the content is never held in memory
+        :param store: Store the input is added to
+        """
+        self.store = store
+        self.hash = hashlib.sha256()
+        self.size = 0
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.root, suffix=".tmp")
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes) -> None:
+        if self.store.max_input_bytes is not None and self.size + len(data) > self.store.max_input_bytes:
+            self.abort()
+            raise ValueError(f"Input exceeds {self.store.max_input_bytes} bytes")
+        self.hash.update(data)
+        self.file.write(data)
+        self.size += len(data)
+
+    def commit(self) -> str:
+        """
+        :return: Digest of the input, an input that is already stored is kept as it is
+        """
+        self.file.close()
+        digest = self.hash.hexdigest()
+        path = self.store.path(digest)
+        if os.path.exists(path):
+            os.remove(self.tmp_path)
+            os.utime(path)
+            with self.store.lock:
+                self.store.stats["duplicates"] += 1
+        else:
+            # Read-only for the sandboxes, and a rename so that no run ever sees a partial file.
+            os.chmod(self.tmp_path, 0o444)
+            os.replace(self.tmp_path, path)
+            with self.store.lock:
+                self.store.stats["stores"] += 1
+            self.store.prune()
+        return f"sha256:{digest}"
+
+    def abort(self) -> None:
+        self.file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class InputStore:
+    def __init__(self, root: Optional[str] = None, max_bytes: int = 20 * 1024 ** 3, max_input_bytes: Optional[int] = 1024 ** 3, verbose: bool = False):
+        """
+        Host-side store of large inputs (stdin, test data) keyed by their SHA-256, shared by all processes on the host.
+        Inputs are uploaded once and referenced by digest, the store is bind-mounted read-only into every sandbox
+        container at INPUT_STORE_MOUNT, so a run reads its input in place instead of receiving a copy.
+        :param root: Directory of the store, it has to be on the Docker host since it is bind-mounted
+        :param max_bytes: Bytes the inputs may occupy before the least recently used ones are removed
+        :param max_input_bytes: Bytes of a single input (None for no limit)
+        :param verbose: if True, print messages
+        """
+        self.root = root or os.path.join(os.path.expanduser("~"), ".cache", "monolith", "inputs")
+        self.max_bytes = max_bytes
+        self.max_input_bytes = max_input_bytes
+        self.verbose = verbose
+        os.makedirs(self.root, exist_ok=True)
+        os.chmod(self.root, 0o755)
+
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+
+    def path(self, digest: str) -> str:
+        # Host path of the input.
+        return os.path.join(self.root, parse_digest(digest))
+
+    def guest_path(self, digest: str) -> str:
+        # Path of the input inside the sandbox containers.
+        return f"{INPUT_STORE_MOUNT}/{parse_digest(digest)}"
+
+    def writer(self) -> InputWriter:
+        return InputWriter(self)
+
+    def put(self, stream: BinaryIO, chunk_size: int = 1024 ** 2) -> str:
+        """
+        Store an input read from a stream
+        :param stream: File-like object, i.e. the body of the upload request
+        :param chunk_size: Bytes read at once
+        :return: Digest of the input
+        """
+        writer = self.writer()
+        try:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.commit()
+
+    def get_size(self, digest: str) -> Optional[int]:
+        """
+        :param digest: Digest of the input
+        :return: Size of the input in bytes, None if it is not stored
+        """
+        try:
+            return os.path.getsize(self.path(digest))
+        except FileNotFoundError:
+            return None
+
+    def find_missing(self, input_dict: dict) -> List[str]:
+        """
+        :param input_dict: Request of a task, referencing inputs with "stdin_digest" and "input_files" ({path: digest})
+        :return: Referenced digests that are not stored, ValueError is raised for malformed references
+        """
+        input_files = input_dict.get("input_files") or {}
+        if not isinstance(input_files, dict):
+            raise ValueError("input_files must map paths to digests")
+        for path in input_files:
+            check_input_path(path)
+        digests = list(input_files.values()) + ([input_dict["stdin_digest"]] if input_dict.get("stdin_digest") else [])
+        if input_dict.get("stdin_digest") and input_dict.get("stdin"):
+            raise ValueError("Provide either stdin or stdin_digest, not both")
+        return [digest for digest in digests if not os.path.exists(self.path(digest))]
+
+    def acquire(self, digest: str) -> str:
+        """
+        Mark an input as used by a run, so that it is evicted last
+        :param digest: Digest of the input
+        :return: Digest of the input, normalized
+        """
+        try:
+            os.utime(self.path(digest))
+        except FileNotFoundError:
+            with self.lock:
+                self.stats["misses"] += 1
+            raise ValueError(f"Unknown input {digest}, upload it to /inputs first")
+        with self.lock:
+            self.stats["hits"] += 1
+        return f"sha256:{parse_digest(digest)}"
+
+    def get_mount(self) -> Mount:
+        return Mount(target=INPUT_STORE_MOUNT, source=self.root, type="bind", read_only=True)
+
+    def prune(self, min_age: float = 60) -> None:
+        # Least recently used first, inputs used in the last min_age seconds are kept (a run may be about to read them).
+        entries = list()
+        for name in os.listdir(self.root):
+            if DIGEST_PATTERN.match(name):
+                try:
+                    stat = os.stat(os.path.join(self.root, name))
+                    entries.append((stat.st_mtime, stat.st_size, name))
+                except FileNotFoundError:
+                    continue
+
+        total_size = sum(size for _, size, _ in entries)
+        for mtime, size, name in sorted(entries):
+            if total_size <= self.max_bytes or time.time() - mtime < min_age:
+                break
+            try:
+                os.remove(os.path.join(self.root, name))
+                total_size -= size
+                with self.lock:
+                    self.stats["evictions"] += 1
+            except FileNotFoundError:
+                continue
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return {
+                "root": self.root,
+                "max_bytes": self.max_bytes,
+                "max_input_bytes": self.max_input_bytes,
+                "stores": self.stats["stores"],
+                "duplicates": self.stats["duplicates"],
+                "hits": self.stats["hits"],
+                "misses": self.stats["misses"],
+                "evictions": self.stats["evictions"],
+            }
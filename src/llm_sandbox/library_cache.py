@@ -0,0 +1,192 @@
+import json
+import time
+import hashlib
+import threading
+import collections
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import docker
+import docker.errors
+from docker.models.images import Image
+
+from llm_sandbox.utils import image_exists
+from llm_sandbox.docker import SandboxDockerSession
+from llm_sandbox.const import DefaultImage, LIBRARY_IMAGE_REPOSITORY, LIBRARY_IMAGE_LABEL
+from llm_sandbox.client import get_docker_client
+from llm_sandbox.image_registry import get_image_registry
+
+
+def normalize_libraries(libraries: Optional[List[str]]) -> List[str]:
+    """
+    Normalize a library list so that equivalent requests share one cache entry
+    :param libraries: List of libraries as submitted
+    :return: Sorted list of unique, stripped library specifiers
+    """
+    return sorted({library.strip() for library in libraries or [] if library and library.strip()})
+
+
+class LibraryImageCache:
+    def __init__(self, client: Optional[docker.DockerClient] = None, disk_budget: int = 20 * 1024 ** 3, verbose: bool = False):
+        """
+        Cache of derived images with libraries pre-installed, keyed by (language, base image, library set)
+        :param client: Docker client, if not provided, the shared client of the process is used (llm_sandbox/client.py)
+        :param disk_budget: Bytes the derived images may occupy before unused ones are evicted (LRU)
+        :param verbose: if True, print messages
+        """
+        self.client = client if client else get_docker_client()
+        self.image_registry = get_image_registry(client)
+        self.disk_budget = disk_budget
+        self.verbose = verbose
+
+        self.lock = threading.Lock()
+        # Striped by the cache key, so that the locks do not grow with the number of library sets ever requested.
+        self.build_locks: List[threading.Lock] = [threading.Lock() for _ in range(64)]
+        self.entries: "collections.OrderedDict[str, dict]" = collections.OrderedDict()
+        self.refcounts: Dict[str, int] = collections.Counter()
+        self.stats = collections.Counter()
+        self.load_index()
+
+    def load_index(self) -> None:
+        # Derived images outlive the process, so pick up the ones built earlier (oldest first for LRU).
+        images = self.client.images.list(filters={"label": LIBRARY_IMAGE_LABEL})
+        for image in sorted(images, key=lambda image: image.attrs.get("Created", "")):
+            if image.tags:
+                self.entries[image.tags[0]] = {"size": self.image_size(image), "last_used": 0.0}
+
+    def image_size(self, image: Image) -> int:
+        # Only the layers on top of the base image are owned by the cache.
+        base_size = 0
+        base_image_id = image.labels.get(f"{LIBRARY_IMAGE_LABEL}.base")
+        if base_image_id and image_exists(self.client, base_image_id):
+            base_size = self.client.images.get(base_image_id).attrs.get("Size", 0)
+        return max(image.attrs.get("Size", 0) - base_size, 0)
+
+    def resolve_base_image(self, lang: str, base_image: Optional[str] = None) -> Image:
+        base_image = base_image or DefaultImage.__dict__[lang.upper()]
+        image, _ = self.image_registry.resolve(base_image)
+        return image
+
+    @staticmethod
+    def cache_key(lang: str, base_image_id: str, libraries: List[str]) -> str:
+        payload = json.dumps([lang, base_image_id, normalize_libraries(libraries)])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def build(self, lang: str, base_image: Image, libraries: List[str], image_name: str, timeout: Optional[float] = None) -> None:
+        if self.verbose:
+            print(f"Building {image_name} with {libraries}..")
+
+        repository, tag = image_name.rsplit(":", 1)
+        session = SandboxDockerSession(client=self.client, image=base_image.id, lang=lang, keep_template=True, use_ready_image=False)
+        try:
+            session.open()
+            session.setup(libraries=libraries, run_profiling=True, timeout=timeout)
+            image = session.container.commit(
+                repository=repository,
+                tag=tag,
+                changes=[f'LABEL {LIBRARY_IMAGE_LABEL}="{lang}" {LIBRARY_IMAGE_LABEL}.base="{base_image.id}"'],
+            )
+        finally:
+            session.close()
+        size = self.image_size(self.client.images.get(image.id))
+        self.image_registry.invalidate(image_name)
+        with self.lock:
+            self.entries[image_name] = {"size": size, "last_used": time.time()}
+
+    def acquire(self, lang: str, libraries: List[str], base_image: Optional[str] = None, timeout: Optional[float] = None) -> str:
+        """
+        Get a derived image with the given libraries installed, building it on the first request.
+        The image is pinned until release() is called with the returned name.
+        :param lang: Language of the code
+        :param libraries: Libraries to install
+        :param base_image: Base image, defaults to the (ready) language image
+        :param timeout: Seconds the installation may take on a miss, TimeoutError is raised when it is exceeded
+        :return: Name of the derived image
+        """
+        base = self.resolve_base_image(lang, base_image)
+        digest = self.cache_key(lang, base.id, libraries)
+        image_name = f"{LIBRARY_IMAGE_REPOSITORY}/{lang}:{digest[:32]}"
+
+        with self.lock:
+            self.refcounts[image_name] += 1
+
+        try:
+            # One build per key, concurrent requests for the same library set wait for it.
+            with self.build_locks[int(digest[:8], 16) % len(self.build_locks)]:
+                with self.lock:
+                    cached = image_name in self.entries
+                if not cached and image_exists(self.client, image_name):
+                    size = self.image_size(self.client.images.get(image_name))
+                    with self.lock:
+                        self.entries[image_name] = {"size": size, "last_used": time.time()}
+                    cached = True
+                if not cached:
+                    self.build(lang, base, normalize_libraries(libraries), image_name, timeout)
+
+            with self.lock:
+                self.stats["hits" if cached else "misses"] += 1
+                self.entries[image_name]["last_used"] = time.time()
+                self.entries.move_to_end(image_name)
+        except Exception:
+            self.release(image_name)
+            raise
+
+        self.evict()
+        return image_name
+
+    def release(self, image_name: str) -> None:
+        with self.lock:
+            self.refcounts[image_name] -= 1
+            if self.refcounts[image_name] <= 0:
+                del self.refcounts[image_name]
+
+    @contextmanager
+    def lease(self, lang: str, libraries: List[str], base_image: Optional[str] = None):
+        image_name = self.acquire(lang, libraries, base_image)
+        try:
+            yield image_name
+        finally:
+            self.release(image_name)
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used derived images until the cache fits the disk budget. Images in use are skipped.
+        """
+        with self.lock:
+            total_size = sum(entry["size"] for entry in self.entries.values())
+            candidates = [name for name in self.entries if self.refcounts.get(name, 0) == 0]
+
+        for image_name in candidates:
+            if total_size <= self.disk_budget:
+                break
+            with self.lock:
+                if self.refcounts.get(image_name, 0) > 0:
+                    continue
+            try:
+                # Without force, Docker refuses to remove images that containers (i.e. other workers) still use.
+                self.client.images.remove(image_name)
+            except docker.errors.ImageNotFound:
+                pass
+            except docker.errors.APIError as e:
+                if self.verbose:
+                    print(f"Skip evicting {image_name}: {e}")
+                continue
+            self.image_registry.invalidate(image_name)
+            with self.lock:
+                if self.refcounts.get(image_name, 0) == 0 and image_name in self.entries:
+                    total_size -= self.entries.pop(image_name)["size"]
+                    self.stats["evictions"] += 1
+
+    def get_status(self) -> dict:
+        with self.lock:
+            requests = self.stats["hits"] + self.stats["misses"]
+            return {
+                "images": len(self.entries),
+                "disk_usage": sum(entry["size"] for entry in self.entries.values()),
+                "disk_budget": self.disk_budget,
+                "in_use": dict(self.refcounts),
+                "hits": self.stats["hits"],
+                "misses": self.stats["misses"],
+                "hit_rate": self.stats["hits"] / requests if requests else 0.0,
+                "evictions": self.stats["evictions"],
+            }
@@ -0,0 +1,149 @@
+import io
+import tarfile
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+from llm_sandbox.const import MEMORY_LOG_MAGIC
+
+RECORD_DTYPE = np.dtype([("timestamp", "<i8"), ("memory", "<i8")])
+CHUNK_SIZE = 1024 * 1024
+
+
+class ChunkStream(io.RawIOBase):
+    """
+    Read-only file object over an iterator of byte chunks, i.e. the stream returned by container.get_archive().
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self.buffer:
+            try:
+                self.buffer = next(self.chunks)
+            except StopIteration:
+                return 0
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+class MemoryLogParser:
+    def __init__(self):
+        """
+        Incremental parser of memory logs, either the binary log of the native memory sampler
+        or the text log of memory_profiler.sh. Samples are kept as int64 arrays, never as Python tuples.
+        """
+        self.pending = b""
+        self.is_binary: Optional[bool] = None
+        self.timestamps: List[np.ndarray] = list()
+        self.memories: List[np.ndarray] = list()
+        self.sampler_cpu_us: Optional[int] = None
+
+    def feed(self, data: bytes) -> None:
+        data = self.pending + data
+        if self.is_binary is None:
+            if len(data) < len(MEMORY_LOG_MAGIC):
+                self.pending = data
+                return
+            self.is_binary = data.startswith(MEMORY_LOG_MAGIC)
+            if self.is_binary:
+                data = data[len(MEMORY_LOG_MAGIC):]
+
+        if self.is_binary:
+            complete = len(data) - len(data) % RECORD_DTYPE.itemsize
+            records = np.frombuffer(data[:complete], dtype=RECORD_DTYPE)
+            self.pending = data[complete:]
+            # The trailer record (timestamp -1) carries the CPU time of the sampler.
+            trailer = records["timestamp"] == -1
+            if trailer.any():
+                self.sampler_cpu_us = int(records["memory"][trailer][-1])
+                records = records[~trailer]
+            self.timestamps.append(records["timestamp"].copy())
+            self.memories.append(records["memory"].copy())
+        else:
+            complete = data.rfind(b"\n") + 1
+            self.pending = data[complete:]
+            self.append_text(data[:complete])
+
+    def append_text(self, data: bytes) -> None:
+        values = np.array(data.split(), dtype=np.int64)
+        # A line cut off by a killed profiler has a single field, drop it.
+        values = values[:len(values) - len(values) % 2].reshape(-1, 2)
+        self.timestamps.append(values[:, 0])
+        self.memories.append(values[:, 1])
+
+    def close(self) -> None:
+        if not self.is_binary and self.pending:
+            self.append_text(self.pending)
+        self.pending = b""
+
+    def arrays(self):
+        """
+        :return: Timestamps in nanoseconds and memory usage in kB of all samples so far
+        """
+        if not self.timestamps:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(self.timestamps), np.concatenate(self.memories)
+
+
+def summarize_memory(timestamps: np.ndarray, memories: np.ndarray, max_log_points: Optional[int] = 1000, percentiles=(50, 90, 99)) -> dict:
+    """
+    Compute the memory statistics of a run from its samples
+    :param timestamps: Sample timestamps in nanoseconds
+    :param memories: Memory usage of each sample in kB
+    :param max_log_points: Resample the returned log to at most this many points (None keeps every sample)
+    :param percentiles: Percentiles of the memory usage to report
+    :return: peak_memory (kB), integral (trapezoidal, kB*ms), duration (ms), memory_percentiles (kB), samples and log
+    """
+    summary = {"peak_memory": 0, "integral": 0, "duration": 0, "memory_percentiles": dict(), "samples": int(len(memories)), "log": list()}
+    if len(memories) == 0:
+        return summary
+
+    order = np.argsort(timestamps, kind="stable")
+    timestamps, memories = timestamps[order], memories[order]
+    times_ms = (timestamps - timestamps[0]) / 1e6
+    memories_kb = memories.astype(np.float64)
+
+    summary["peak_memory"] = int(memories.max())
+    summary["integral"] = float(np.sum((memories_kb[1:] + memories_kb[:-1]) * np.diff(times_ms)) / 2)
+    summary["duration"] = float(times_ms[-1])
+    summary["memory_percentiles"] = {f"p{p}": float(v) for p, v in zip(percentiles, np.percentile(memories_kb, percentiles))}
+
+    if max_log_points and len(memories) > max_log_points:
+        # Linear interpolation on a uniform time grid, the peak is reported exactly above.
+        grid = np.linspace(times_ms[0], times_ms[-1], max_log_points)
+        resampled = np.interp(grid, times_ms, memories_kb)
+        log_timestamps = timestamps[0] + (grid * 1e6).astype(np.int64)
+        summary["log"] = list(zip(log_timestamps.tolist(), np.rint(resampled).astype(np.int64).tolist()))
+    else:
+        summary["log"] = list(zip(timestamps.tolist(), memories.tolist()))
+    return summary
+
+
+def read_memory_log_archive(bits: Iterable[bytes], max_log_points: Optional[int] = 1000) -> dict:
+    """
+    Parse the memory log straight from the tar stream of container.get_archive(), chunk by chunk
+    :param bits: Chunks of the tar stream
+    :param max_log_points: Resample the returned log to at most this many points (None keeps every sample)
+    :return: Memory summary (see summarize_memory) and profiler_cpu_time in seconds (None for memory_profiler.sh)
+    """
+    parser = MemoryLogParser()
+    with tarfile.open(fileobj=io.BufferedReader(ChunkStream(bits), CHUNK_SIZE), mode="r|") as tar:
+        member = tar.next()
+        if member is None or not member.isfile():
+            raise FileNotFoundError("Memory log not found in the archive")
+        log = tar.extractfile(member)
+        while chunk := log.read(CHUNK_SIZE):
+            parser.feed(chunk)
+    parser.close()
+
+    summary = summarize_memory(*parser.arrays(), max_log_points=max_log_points)
+    summary["profiler_cpu_time"] = parser.sampler_cpu_us / 1e6 if parser.sampler_cpu_us is not None else None
+    return summary
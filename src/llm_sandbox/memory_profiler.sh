@@ -11,6 +11,7 @@ CMD=("$@")
 
 # Set log name
 LOG_FILE="mem_usage.log"
+: > "$LOG_FILE"  # one log per run, also when a container runs the code repeatedly
 
 exec 3<&0
 exec </dev/null
@@ -0,0 +1,258 @@
+/*
+ * memory_sampler: run a command and sample the memory usage of its process tree.
+ * It replaces memory_profiler.sh in the measurement-ready images (see llm_sandbox/image.py),
+ * where it is built as a static binary and installed as /usr/local/bin/memory_sampler.
+ *
+ * Usage: memory_sampler [-i interval_us] [-o log_file] [-c] [-t timeout_ms] -- command [args...]
+ *   -i  sampling interval in microseconds (default 1000, sub-millisecond values are allowed)
+ *   -o  log file (default mem_usage.log)
+ *   -c  sample the container cgroup (memory.current) instead of the RSS of the process tree
+ *   -t  kill the process group of the command with SIGKILL after timeout_ms (exit status 137), the samples
+ *       taken until then are still written. Unlike an outer `timeout`, this adds no process to the sampled tree.
+ *
+ * Log format (little endian): the 8-byte magic "MNLTMEM1", followed by one 16-byte record per sample
+ *   int64 timestamp_ns (CLOCK_MONOTONIC), int64 memory_kb
+ * and one trailer record with timestamp_ns = -1 whose second field is the CPU time of the sampler
+ * itself in microseconds, so the overhead of every profiled run is known.
+ *
+ * Overhead: the bash profiler forks `date` and `awk` for every sample, which takes milliseconds and
+ * competes with the measured program for its (single, pinned) core. This sampler forks nothing. A sample
+ * is one open/read/close of /proc/<pid>/statm plus one directory scan and one read of the `children`
+ * file per thread of each process in the tree (or a single pread of memory.current with -c), and records
+ * are buffered in memory and written in 1 MiB chunks. Its CPU use per run is reported in the trailer record;
+ * divided by the run time it gives the fraction of the core taken from the program. Lower -i values trade
+ * precision of the time-memory integral for that fraction, so check the trailer when lowering it.
+ */
+#define _GNU_SOURCE
+#include <dirent.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <signal.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+#include <sys/resource.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+
+#define LOG_MAGIC "MNLTMEM1"
+#define MAX_PIDS 4096
+
+static pid_t child_pid = -1;
+static int64_t page_kb = 4;
+
+static void forward_signal(int sig) {
+    if (child_pid > 0) {
+        kill(child_pid, sig);
+    }
+}
+
+static ssize_t read_file(const char *path, char *buf, size_t size) {
+    int fd = open(path, O_RDONLY | O_CLOEXEC);
+    if (fd < 0) {
+        return -1;
+    }
+    ssize_t n = read(fd, buf, size - 1);
+    close(fd);
+    if (n < 0) {
+        return -1;
+    }
+    buf[n] = '\0';
+    return n;
+}
+
+/* Resident set size of one process in kB: the second field of /proc/<pid>/statm, in pages. */
+static int64_t process_rss_kb(pid_t pid) {
+    char path[64], buf[256];
+    snprintf(path, sizeof(path), "/proc/%d/statm", pid);
+    if (read_file(path, buf, sizeof(buf)) < 0) {
+        return 0;
+    }
+    char *resident = strchr(buf, ' ');
+    return resident ? strtoll(resident + 1, NULL, 10) * page_kb : 0;
+}
+
+/* Append the children of every thread of pid to the queue, from /proc/<pid>/task/<tid>/children. */
+static int enqueue_children(pid_t pid, pid_t *pids, int tail) {
+    char path[320], buf[4096];
+    snprintf(path, sizeof(path), "/proc/%d/task", pid);
+    DIR *tasks = opendir(path);
+    if (!tasks) {
+        return tail;
+    }
+    struct dirent *task;
+    while ((task = readdir(tasks)) != NULL) {
+        if (task->d_name[0] == '.') {
+            continue;
+        }
+        snprintf(path, sizeof(path), "/proc/%d/task/%s/children", pid, task->d_name);
+        if (read_file(path, buf, sizeof(buf)) <= 0) {
+            continue;
+        }
+        char *cursor = buf, *end;
+        for (long child = strtol(cursor, &end, 10); end != cursor && tail < MAX_PIDS; child = strtol(cursor, &end, 10)) {
+            pids[tail++] = (pid_t)child;
+            cursor = end;
+        }
+    }
+    closedir(tasks);
+    return tail;
+}
+
+/* RSS of the process tree rooted at root, in kB. */
+static int64_t tree_rss_kb(pid_t root) {
+    static pid_t pids[MAX_PIDS];
+    int64_t total = 0;
+    int head = 0, tail = 0;
+    pids[tail++] = root;
+    while (head < tail) {
+        pid_t pid = pids[head++];
+        total += process_rss_kb(pid);
+        tail = enqueue_children(pid, pids, tail);
+    }
+    return total;
+}
+
+/* Memory charged to the cgroup of the container, in kB (cgroup v2 first, then v1). */
+static int open_cgroup_memory(void) {
+    int fd = open("/sys/fs/cgroup/memory.current", O_RDONLY | O_CLOEXEC);
+    if (fd < 0) {
+        fd = open("/sys/fs/cgroup/memory/memory.usage_in_bytes", O_RDONLY | O_CLOEXEC);
+    }
+    return fd;
+}
+
+static int64_t cgroup_memory_kb(int fd) {
+    char buf[64];
+    ssize_t n = pread(fd, buf, sizeof(buf) - 1, 0);
+    if (n <= 0) {
+        return 0;
+    }
+    buf[n] = '\0';
+    return strtoll(buf, NULL, 10) / 1024;
+}
+
+static int64_t now_ns(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (int64_t)ts.tv_sec * 1000000000LL + ts.tv_nsec;
+}
+
+static void write_record(FILE *log, int64_t timestamp_ns, int64_t value) {
+    int64_t record[2] = {timestamp_ns, value};
+    fwrite(record, sizeof(record), 1, log);
+}
+
+static void usage(const char *name) {
+    fprintf(stderr, "Usage: %s [-i interval_us] [-o log_file] [-c] [-t timeout_ms] -- command [args...]\n", name);
+}
+
+int main(int argc, char **argv) {
+    long interval_us = 1000;
+    const char *log_path = "mem_usage.log";
+    int use_cgroup = 0;
+    long timeout_ms = 0;
+
+    int opt;
+    while ((opt = getopt(argc, argv, "+i:o:ct:")) != -1) {
+        switch (opt) {
+        case 'i':
+            interval_us = strtol(optarg, NULL, 10);
+            break;
+        case 'o':
+            log_path = optarg;
+            break;
+        case 'c':
+            use_cgroup = 1;
+            break;
+        case 't':
+            timeout_ms = strtol(optarg, NULL, 10);
+            break;
+        default:
+            usage(argv[0]);
+            return 2;
+        }
+    }
+    if (optind >= argc || interval_us <= 0 || timeout_ms < 0) {
+        usage(argv[0]);
+        return 2;
+    }
+    page_kb = sysconf(_SC_PAGESIZE) / 1024;
+
+    int cgroup_fd = -1;
+    if (use_cgroup && (cgroup_fd = open_cgroup_memory()) < 0) {
+        fprintf(stderr, "memory_sampler: no cgroup memory file found\n");
+        return 2;
+    }
+
+    FILE *log = fopen(log_path, "wb");
+    if (!log) {
+        perror("memory_sampler: fopen");
+        return 2;
+    }
+    setvbuf(log, NULL, _IOFBF, 1 << 20);
+    fwrite(LOG_MAGIC, 1, strlen(LOG_MAGIC), log);
+    fflush(log);
+
+    child_pid = fork();
+    if (child_pid < 0) {
+        perror("memory_sampler: fork");
+        return 2;
+    }
+    if (child_pid == 0) {
+        /* Own process group, so the deadline kills everything the command started. */
+        setpgid(0, 0);
+        close(fileno(log));
+        execvp(argv[optind], &argv[optind]);
+        fprintf(stderr, "memory_sampler: %s: %s\n", argv[optind], strerror(errno));
+        _exit(127);
+    }
+
+    signal(SIGINT, forward_signal);
+    signal(SIGTERM, forward_signal);
+    signal(SIGHUP, forward_signal);
+
+    setpgid(child_pid, child_pid);
+    int status = 0;
+    struct timespec next;
+    clock_gettime(CLOCK_MONOTONIC, &next);
+    int64_t deadline_ns = timeout_ms > 0 ? now_ns() + timeout_ms * 1000000LL : 0;
+    for (;;) {
+        int64_t memory_kb = use_cgroup ? cgroup_memory_kb(cgroup_fd) : tree_rss_kb(child_pid);
+        pid_t done = waitpid(child_pid, &status, WNOHANG);
+        if (done == child_pid || (done < 0 && errno != EINTR)) {
+            break;
+        }
+        int64_t timestamp_ns = now_ns();
+        write_record(log, timestamp_ns, memory_kb);
+        if (deadline_ns && timestamp_ns >= deadline_ns) {
+            kill(-child_pid, SIGKILL);
+            deadline_ns = 0;
+        }
+
+        /* Absolute deadlines keep the interval from drifting by the time spent sampling. */
+        next.tv_nsec += interval_us * 1000;
+        next.tv_sec += next.tv_nsec / 1000000000L;
+        next.tv_nsec %= 1000000000L;
+        while (clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, &next, NULL) == EINTR) {
+        }
+    }
+
+    struct rusage usage_self;
+    getrusage(RUSAGE_SELF, &usage_self);
+    int64_t cpu_us = (int64_t)(usage_self.ru_utime.tv_sec + usage_self.ru_stime.tv_sec) * 1000000LL
+                     + usage_self.ru_utime.tv_usec + usage_self.ru_stime.tv_usec;
+    write_record(log, -1, cpu_us);
+    fclose(log);
+
+    if (WIFEXITED(status)) {
+        return WEXITSTATUS(status);
+    }
+    if (WIFSIGNALED(status)) {
+        return 128 + WTERMSIG(status);
+    }
+    return 1;
+}
@@ -0,0 +1,169 @@
+import os
+import json
+import math
+import bisect
+import threading
+import collections
+from typing import Dict, List, Optional, Tuple
+
+from llm_sandbox.const import SupportedLanguageValues
+
+# Phases of a task, in order. Phases a task does not go through (i.e. compile for Python) are not observed.
+PHASES = (
+    "queue_wait",     # submission until a worker picks the task (async backend)
+    "image_lookup",   # derived library image, built on a cache miss
+    "container_start",  # pooled container, started on a pool miss
+    "setup",          # setup of the container, i.e. GNU time and workspaces on images that are not ready
+    "file_copy",      # code, stdin and cached binaries into the container
+    "compile",
+    "run",
+    "judge",          # comparison with the expected output, inside the sandbox
+    "log_retrieval",  # memory log out of the container and its parsing
+    "teardown",       # reset or removal of the container, release of the library image
+)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+COUNTERS = {
+    "tasks_total": "Finished tasks by language and status",
+    "timeouts_total": "Tasks that hit a deadline, by language and phase",
+    "oom_kills_total": "Programs killed by the OOM killer of the memory cgroup of their sandbox",
+    "errors_total": "Tasks that failed with an error, by language",
+    "result_cache_total": "Submissions by result cache outcome: hit, coalesced (attached to an identical task in flight), miss or bypass",
+}
+
+
+def escape_label(value) -> str:
+    # Label values are quoted strings, backslash, double quote and line feed are escaped.
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    def __init__(self, namespace: str = "monolith", buckets=DEFAULT_BUCKETS, directory: Optional[str] = None):
+        """
+        Prometheus histograms of the task phases per language, and task counters
+        :param namespace: Prefix of the metric names
+        :param buckets: Upper bounds (seconds) of the histogram buckets, +Inf is added
+        :param directory: Shared directory of the workers of a multi-process server. Every process flushes its own
+                          snapshot there, and render() adds up the snapshots of all processes, like the multiprocess
+                          mode of prometheus_client.
+        """
+        self.namespace = namespace
+        self.buckets = tuple(sorted(buckets))
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        # (phase, language) -> [bucket counts (not cumulative, the last one is +Inf), sum]
+        self.histograms: Dict[Tuple[str, str], list] = dict()
+        # (counter, sorted label items) -> value
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = collections.Counter()
+
+    def observe(self, phase: str, language: str, seconds: float) -> None:
+        if phase not in PHASES:
+            raise ValueError(f"Unknown phase {phase}, must be one of {PHASES}")
+        with self.lock:
+            histogram = self.histograms.setdefault((phase, language), [[0] * (len(self.buckets) + 1), 0.0])
+            histogram[0][bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram[1] += seconds
+
+    def observe_phases(self, language: str, phase_times: Optional[Dict[str, float]]) -> None:
+        for phase, seconds in (phase_times or {}).items():
+            if seconds is not None:
+                self.observe(phase, language, seconds)
+
+    def inc(self, counter: str, value: float = 1, **labels: str) -> None:
+        if counter not in COUNTERS:
+            raise ValueError(f"Unknown counter {counter}, must be one of {list(COUNTERS)}")
+        with self.lock:
+            self.counters[(counter, tuple(sorted((key, str(label)) for key, label in labels.items())))] += value
+
+    def record_task(self, language: str, status: str, phase_times: Optional[Dict[str, float]] = None, timeout_phase: Optional[str] = None, oom_killed: bool = False) -> None:
+        """
+        Record a finished task
+        :param language: Language of the task, languages that are not supported are counted as unknown
+        :param status: Status of the task, i.e. done, success, timeout or error
+        :param phase_times: Seconds spent in each phase (see PHASES)
+        :param timeout_phase: Phase that hit its deadline (setup, compile or run)
+        :param oom_killed: if True, the program was killed by the OOM killer (oom_killed of the response)
+        """
+        # The language comes from the request, anything else would add a series per distinct value.
+        language = language if language in SupportedLanguageValues else "unknown"
+        self.observe_phases(language, phase_times)
+        self.inc("tasks_total", language=language, status=status)
+        if status == "timeout":
+            self.inc("timeouts_total", language=language, phase=timeout_phase or "unknown")
+        elif status == "error":
+            self.inc("errors_total", language=language)
+        if oom_killed:
+            self.inc("oom_kills_total", language=language)
+        if self.directory:
+            self.flush()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "buckets": list(self.buckets),
+                "histograms": [[phase, language, list(counts), total] for (phase, language), (counts, total) in self.histograms.items()],
+                "counters": [[counter, dict(labels), value] for (counter, labels), value in self.counters.items()],
+            }
+
+    def flush(self) -> None:
+        # Atomic replace, so that a concurrent render() never reads half a file.
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f"{path}.tmp", path)
+
+    def collect(self) -> List[dict]:
+        snapshots = [self.snapshot()]
+        if self.directory:
+            # Snapshots of workers that exited are kept, counters must not go backwards.
+            own = f"{os.getpid()}.json"
+            for name in sorted(os.listdir(self.directory)):
+                if name.endswith(".json") and name != own:
+                    try:
+                        with open(os.path.join(self.directory, name)) as f:
+                            snapshots.append(json.load(f))
+                    except (OSError, ValueError):
+                        continue
+        return snapshots
+
+    def render(self) -> str:
+        """
+        :return: Metrics of every process in the Prometheus text exposition format (version 0.0.4)
+        """
+        histograms: Dict[Tuple[str, str], list] = dict()
+        counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = collections.Counter()
+        for snapshot in self.collect():
+            if tuple(snapshot["buckets"]) != self.buckets:
+                continue
+            for phase, language, counts, total in snapshot["histograms"]:
+                histogram = histograms.setdefault((phase, language), [[0] * len(counts), 0.0])
+                histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+                histogram[1] += total
+            for counter, labels, value in snapshot["counters"]:
+                counters[(counter, tuple(sorted(labels.items())))] += value
+
+        name = f"{self.namespace}_task_phase_seconds"
+        lines = [
+            f"# HELP {name} Seconds spent in each phase of a task, by language",
+            f"# TYPE {name} histogram",
+        ]
+        for (phase, language), (counts, total) in sorted(histograms.items(), key=lambda item: (PHASES.index(item[0][0]), item[0][1])):
+            labels = f'phase="{escape_label(phase)}",language="{escape_label(language)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {total}")
+            lines.append(f"{name}_count{{{labels}}} {cumulative}")
+
+        for counter, description in COUNTERS.items():
+            name = f"{self.namespace}_{counter}"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            for (_, labels), value in sorted((key, value) for key, value in counters.items() if key[0] == counter):
+                label_text = ",".join(f'{key}="{escape_label(label)}"' for key, label in labels)
+                lines.append(f"{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
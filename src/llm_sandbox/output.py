@@ -0,0 +1,90 @@
+import mmap
+import tempfile
+from typing import Iterable, Optional, Tuple, Union
+
+from llm_sandbox.const import MAX_OUTPUT_BYTES, OUTPUT_SPOOL_THRESHOLD
+
+
+def decode_output(data: Union[bytes, bytearray]) -> Optional[str]:
+    # A cap can split a multi-byte character, and programs may print anything, so invalid bytes are replaced.
+    return data.decode("utf-8", errors="replace") if data else None
+
+
+class OutputCapture:
+    def __init__(self, max_bytes: Optional[int] = MAX_OUTPUT_BYTES, spool_threshold: int = OUTPUT_SPOOL_THRESHOLD):
+        """
+        Bounded capture of one output stream. The first max_bytes bytes are kept, in memory up to spool_threshold and in a
+        temporary file past it, the rest is only counted, so that a program printing gigabytes cannot exhaust the worker.
+        :param max_bytes: Bytes kept (None keeps everything)
+        :param spool_threshold: Bytes kept in memory before spilling to a temporary file
+        """
+        self.max_bytes = max_bytes
+        self.spool_threshold = spool_threshold
+        self.memory = bytearray()
+        self.file = None
+        self.kept_bytes = 0
+        self.total_bytes = 0
+
+    def write(self, data: Optional[bytes]) -> None:
+        if not data:
+            return
+        self.total_bytes += len(data)
+        room = len(data) if self.max_bytes is None else self.max_bytes - self.kept_bytes
+        if room > 0:
+            chunk = data[:room]
+            if self.file is None and self.kept_bytes + len(chunk) > self.spool_threshold:
+                self.file = tempfile.TemporaryFile()
+                self.file.write(self.memory)
+                self.memory = bytearray()
+            if self.file is None:
+                self.memory += chunk
+            else:
+                self.file.write(chunk)
+            self.kept_bytes += len(chunk)
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_bytes > self.kept_bytes
+
+    def getvalue(self) -> Optional[str]:
+        # Decoded in place (the memory buffer, or the spool mapped read-only), so only the returned string is allocated.
+        if not self.kept_bytes:
+            return None
+        if self.file is None:
+            return decode_output(self.memory)
+        self.file.flush()
+        with mmap.mmap(self.file.fileno(), self.kept_bytes, access=mmap.ACCESS_READ) as data:
+            return str(data, "utf-8", "replace")
+
+    def close(self) -> None:
+        self.memory = bytearray()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def capture_streams(frames: Iterable[Tuple[Optional[bytes], Optional[bytes]]], max_bytes: Optional[int] = MAX_OUTPUT_BYTES) -> dict:
+    """
+    Drain a demultiplexed exec stream into two bounded captures. The stream is read to the end even past the caps,
+    so that the program is not blocked on a full pipe and its measurements stay comparable.
+    :param frames: (stdout, stderr) chunks, i.e. from APIClient.exec_start(stream=True, demux=True)
+    :param max_bytes: Bytes kept per stream
+    :return: stdout and stderr (None if empty), stdout_truncated, stderr_truncated, and total_bytes per stream
+    """
+    with OutputCapture(max_bytes) as stdout, OutputCapture(max_bytes) as stderr:
+        for stdout_chunk, stderr_chunk in frames:
+            stdout.write(stdout_chunk)
+            stderr.write(stderr_chunk)
+        return {
+            "stdout": stdout.getvalue(),
+            "stderr": stderr.getvalue(),
+            "stdout_truncated": stdout.truncated,
+            "stderr_truncated": stderr.truncated,
+            "total_bytes": {"stdout": stdout.total_bytes, "stderr": stderr.total_bytes},
+        }
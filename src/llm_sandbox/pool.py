@@ -0,0 +1,226 @@
+import time
+import threading
+import collections
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import docker
+
+from llm_sandbox.const import DefaultImage
+from llm_sandbox.docker import SandboxDockerSession
+from llm_sandbox.build_cache import BuildCache
+from llm_sandbox.input_store import InputStore
+from llm_sandbox.client import get_docker_client
+
+
+class ContainerPool:
+    def __init__(
+        self,
+        client: Optional[docker.DockerClient] = None,
+        pool_size: int = 1,
+        max_reuse: int = 64,
+        idle_timeout: float = 600,
+        refill_interval: float = 1.0,
+        build_cache: Optional[BuildCache] = None,
+        input_store: Optional[InputStore] = None,
+        verbose: bool = False,
+    ):
+        """
+        Keep pre-started, pre-configured sandbox containers per (language, image, container profile)
+        :param client: Docker client, if not provided, the shared client of the process is used (llm_sandbox/client.py)
+        :param pool_size: Number of idle containers to keep for each profile
+        :param max_reuse: Number of tasks a container may serve before it is recycled
+        :param idle_timeout: Seconds an idle container may wait in the pool before it is evicted
+        :param refill_interval: Seconds between two runs of the background refill loop
+        :param build_cache: Shared Cargo/Go build cache volumes to mount into the containers
+        :param input_store: Store of uploaded inputs to mount read-only into the containers
+        :param verbose: if True, print messages
+        """
+        self.client = client if client else get_docker_client()
+        self.pool_size = pool_size
+        self.max_reuse = max_reuse
+        self.idle_timeout = idle_timeout
+        self.refill_interval = refill_interval
+        self.build_cache = build_cache
+        self.input_store = input_store
+        self.verbose = verbose
+
+        self.lock = threading.Lock()
+        self.idle: Dict[Tuple, collections.deque] = dict()
+        self.pending: Dict[Tuple, int] = collections.Counter()
+        self.profiles: Dict[Tuple, Tuple[str, Optional[str], Optional[dict]]] = dict()
+        self.last_acquired: Dict[Tuple, float] = dict()
+        self.stats = collections.Counter()
+
+        self.running = True
+        self.refill_thread = threading.Thread(target=self.refill_loop, daemon=True)
+        self.refill_thread.start()
+
+    @staticmethod
+    def profile_key(lang: str, image: Optional[str], container_configs: Optional[dict]) -> Tuple:
+        image = image or DefaultImage.__dict__[lang.upper()]
+        return lang, image, tuple(sorted((container_configs or {}).items()))
+
+    def create_session(self, lang: str, image: Optional[str], container_configs: Optional[dict]) -> SandboxDockerSession:
+        session = SandboxDockerSession(
+            client=self.client,
+            image=image,
+            lang=lang,
+            keep_template=True,
+            verbose=False,
+            container_configs=container_configs,
+            build_cache=self.build_cache,
+            input_store=self.input_store,
+        )
+        session.open()
+        return session
+
+    def acquire(self, lang: str, container_configs: Optional[dict] = None, image: Optional[str] = None) -> SandboxDockerSession:
+        """
+        Hand out an open session for the given profile. A warm container is used if one is idle, otherwise a new one is started.
+        :param lang: Language of the code
+        :param container_configs: Container configurations of the profile, i.e. cpuset_cpus, mem_limit, etc.
+        :param image: Docker image to use, defaults to the language image
+        :return: An open SandboxDockerSession
+        """
+        key = self.profile_key(lang, image, container_configs)
+        with self.lock:
+            self.profiles.setdefault(key, (lang, image, container_configs))
+            self.last_acquired[key] = time.time()
+            idle = self.idle.setdefault(key, collections.deque())
+            session = idle.popleft()[0] if idle else None
+            self.stats['hits' if session else 'misses'] += 1
+
+        if session is None:
+            session = self.create_session(lang, image, container_configs)
+        session.pool_key = key
+        return session
+
+    def release(self, session: SandboxDockerSession, reusable: bool = True) -> None:
+        """
+        Return a session to the pool. It is reset and kept warm if reusable, otherwise its container is removed.
+        :param session: Session obtained from acquire()
+        :param reusable: False if the task left the container in an unknown state (timeout, library installation, errors)
+        """
+        key = getattr(session, 'pool_key', None)
+        if reusable and self.running and key is not None and session.reuse_count + 1 < self.max_reuse:
+            try:
+                session.reset()
+                with self.lock:
+                    idle = self.idle.setdefault(key, collections.deque())
+                    if len(idle) < self.pool_size:
+                        idle.append((session, time.time()))
+                        self.stats['reused'] += 1
+                        return
+            except Exception as e:
+                if self.verbose:
+                    print(f"Failed to reset session, recycling it: {e}")
+
+        with self.lock:
+            self.stats['recycled'] += 1
+        self.discard(session)
+
+    @contextmanager
+    def session(self, lang: str, container_configs: Optional[dict] = None, image: Optional[str] = None):
+        session = self.acquire(lang, container_configs, image)
+        try:
+            yield session
+        except Exception:
+            self.release(session, reusable=False)
+            raise
+        else:
+            self.release(session)
+
+    def discard(self, session: SandboxDockerSession) -> None:
+        try:
+            session.close()
+        except Exception as e:
+            if self.verbose:
+                print(f"Failed to close session: {e}")
+
+    def evict_idle(self) -> None:
+        expired = list()
+        now = time.time()
+        with self.lock:
+            for idle in self.idle.values():
+                while idle and now - idle[0][1] > self.idle_timeout:
+                    expired.append(idle.popleft()[0])
+            self.stats['evicted'] += len(expired)
+            # Stop refilling profiles nobody asked for recently, i.e. one-off library images.
+            for key, last_acquired in list(self.last_acquired.items()):
+                if now - last_acquired > self.idle_timeout:
+                    del self.last_acquired[key]
+                    del self.profiles[key]
+        for session in expired:
+            self.discard(session)
+
+    def refill(self) -> None:
+        with self.lock:
+            shortfall = {
+                key: self.pool_size - len(self.idle.get(key, ())) - self.pending[key]
+                for key in self.profiles
+            }
+            for key, missing in shortfall.items():
+                self.pending[key] += max(missing, 0)
+
+        for key, missing in shortfall.items():
+            for _ in range(max(missing, 0)):
+                session = None
+                try:
+                    session = self.create_session(*self.profiles[key])
+                    session.pool_key = key
+                except Exception as e:
+                    if self.verbose:
+                        print(f"Failed to pre-start container for {key[0]}: {e}")
+                with self.lock:
+                    self.pending[key] -= 1
+                    if session is not None and self.running:
+                        self.idle.setdefault(key, collections.deque()).append((session, time.time()))
+                        session = None
+                if session is not None:
+                    self.discard(session)
+
+    def refill_loop(self) -> None:
+        while self.running:
+            try:
+                self.evict_idle()
+                self.refill()
+            except Exception as e:
+                if self.verbose:
+                    print(f"Container pool refill failed: {e}")
+            time.sleep(self.refill_interval)
+
+    def warm(self, lang: str, container_configs: Optional[dict] = None, image: Optional[str] = None) -> None:
+        """
+        Register a profile so that the background loop starts filling it before the first task arrives.
+        """
+        key = self.profile_key(lang, image, container_configs)
+        with self.lock:
+            self.profiles.setdefault(key, (lang, image, container_configs))
+            self.last_acquired[key] = time.time()
+
+    def get_status(self) -> dict:
+        with self.lock:
+            requests = self.stats['hits'] + self.stats['misses']
+            return {
+                'pool_size': self.pool_size,
+                'max_reuse': self.max_reuse,
+                'idle_timeout': self.idle_timeout,
+                'hits': self.stats['hits'],
+                'misses': self.stats['misses'],
+                'hit_rate': self.stats['hits'] / requests if requests else 0.0,
+                'reused': self.stats['reused'],
+                'recycled': self.stats['recycled'],
+                'evicted': self.stats['evicted'],
+                'idle': {
+                    f"{key[0]}{dict(key[2])}": len(idle) for key, idle in self.idle.items()
+                },
+            }
+
+    def shutdown(self) -> None:
+        self.running = False
+        with self.lock:
+            sessions = [entry[0] for idle in self.idle.values() for entry in idle]
+            self.idle.clear()
+        for session in sessions:
+            self.discard(session)
@@ -0,0 +1,587 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import errno
+import shutil
+import shlex
+import signal
+import resource
+import tempfile
+import functools
+import threading
+import subprocess
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import psutil
+
+from llm_sandbox.base import Session, ConsoleOutput
+from llm_sandbox.const import SupportedLanguage, PROCESS_CGROUP_ROOT, PROCESS_INTERPRETERS, TIMEOUT_EXIT_CODE, MAX_OUTPUT_BYTES
+from llm_sandbox.utils import get_code_file_extension, parse_oom_kills, outputs_match
+from llm_sandbox.memory_log import summarize_memory
+from llm_sandbox.output import decode_output
+from llm_sandbox.input_store import InputStore, parse_digest, check_input_path
+
+INPUT_MOUNT_NAME = ".monolith_inputs"  # mount point of the input store in the private /tmp
+MASKED_PATHS = ("/run", "/var/run")    # hidden behind an empty tmpfs in the namespace (with the home of the backend user),
+                                       # i.e. the Docker socket, which --net does not cut off
+
+# Stands between the sandbox and the program like GNU time does in the containers: the rusage of a process forked from
+# the backend would count the memory of the backend (ru_maxrss survives exec), the rusage of a child of this small
+# process does not. Writes the rusage of the program as JSON to the file descriptor in argv[1].
+RUSAGE_REPORTER = """
+import os, sys, json
+pid = os.fork()
+if pid == 0:
+    os.execvp(sys.argv[2], sys.argv[2:])
+_, status, usage = os.wait4(pid, 0)
+os.write(int(sys.argv[1]), json.dumps({key: getattr(usage, key) for key in dir(usage) if key.startswith("ru_")}).encode())
+code = os.waitstatus_to_exitcode(status)
+os._exit(128 - code if code < 0 else code)
+"""
+RUSAGE_FIELDS = ("ru_utime", "ru_stime", "ru_maxrss", "ru_minflt", "ru_majflt", "ru_nvcsw", "ru_nivcsw", "ru_nswap", "ru_inblock", "ru_oublock", "ru_nsignals")
+
+
+def parse_memory_size(size: Union[int, str]) -> int:
+    """
+    Parse a Docker style memory size
+    :param size: Bytes, or a number with a b, k, m or g suffix, i.e. "512m" or "1g"
+    :return: Bytes
+    """
+    if isinstance(size, int):
+        return size
+    match = re.fullmatch(r"\s*(\d+)\s*([bkmg]?)b?\s*", size.lower())
+    if not match:
+        raise ValueError(f"Invalid memory size {size}")
+    return int(match.group(1)) * 1024 ** "bkmg".index(match.group(2) or "b")
+
+
+@functools.lru_cache(maxsize=None)
+def unshare_available() -> bool:
+    # Unprivileged user namespaces can be disabled by the kernel or the container we run in.
+    try:
+        return subprocess.run(
+            ["unshare", "--user", "--map-root-user", "--mount", "--pid", "--fork", "--net", "true"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10,
+        ).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+
+def masked_paths() -> List[str]:
+    # Resolved and without duplicates, /var/run is usually a link to /run.
+    home = os.path.expanduser("~")
+    paths = list(MASKED_PATHS) + ([home] if home not in ("", "/") else [])
+    docker_host = os.environ.get("DOCKER_HOST", "")
+    if docker_host.startswith("unix://"):
+        paths.append(os.path.dirname(docker_host[len("unix://"):]))
+    masked = list()
+    for path in paths:
+        path = os.path.realpath(path)
+        # Anything under /tmp is hidden by the private /tmp already.
+        if os.path.isdir(path) and path not in ("/", "/tmp") and not path.startswith("/tmp/") and path not in masked:
+            masked.append(path)
+    return masked
+
+
+class SandboxProcessSession(Session):
+    def __init__(
+        self,
+        lang: str = SupportedLanguage.PYTHON,
+        verbose: bool = False,
+        mem_limit: Union[int, str] = "1g",
+        cpuset_cpus: Optional[str] = None,
+        max_processes: int = 64,
+        max_open_files: int = 256,
+        max_file_size: int = 64 * 1024 ** 2,
+        cgroup_root: str = PROCESS_CGROUP_ROOT,
+        interpreters: Optional[Dict[str, List[str]]] = None,
+        sample_interval: float = 0.001,
+        input_store: Optional[InputStore] = None,
+    ):
+        """
+        Run code in a host subprocess instead of a container, for trusted interpreter-only workloads.
+        The process gets its own user, PID, mount, network, IPC and UTS namespaces (unshare) with a private /tmp,
+        /run and the home of the backend user masked, a cgroup v2 leaf (memory, pids, cpuset) and rlimits.
+        open() refuses to start without namespaces, without a delegated cgroup v2 subtree the memory limit falls back
+        to RLIMIT_AS.
+        :param lang: Language of the code, one of the interpreted languages in PROCESS_INTERPRETERS
+        :param verbose: if True, print messages
+        :param mem_limit: Memory limit, i.e. "1g" (memory.max, no swap)
+        :param cpuset_cpus: CPUs the code may run on, i.e. "3" or "2-3" (cpuset.cpus and the CPU affinity)
+        :param max_processes: Processes and threads the code may have at once (pids.max)
+        :param max_open_files: RLIMIT_NOFILE
+        :param max_file_size: RLIMIT_FSIZE in bytes
+        :param cgroup_root: Delegated cgroup v2 directory the leaf cgroups are created in
+        :param interpreters: Command of the interpreter per language, overrides PROCESS_INTERPRETERS
+        :param sample_interval: Seconds between two memory samples when profiling
+        :param input_store: Store of uploaded inputs that runs can reference by digest, read in place from the host
+        """
+        super().__init__(lang, verbose)
+        self.interpreters = {**PROCESS_INTERPRETERS, **(interpreters or {})}
+        if lang not in self.interpreters:
+            raise ValueError(f"The process sandbox only runs {list(self.interpreters)}, use the Docker sandbox for {lang}")
+
+        self.mem_limit = parse_memory_size(mem_limit)
+        self.cpus = self.parse_cpus(cpuset_cpus)
+        self.cpuset_cpus = cpuset_cpus
+        self.max_processes = max_processes
+        self.max_open_files = max_open_files
+        self.max_file_size = max_file_size
+        self.cgroup_root = cgroup_root
+        self.sample_interval = sample_interval
+        self.input_store = input_store
+
+        self.root: Optional[str] = None
+        self.io_dir: Optional[str] = None
+        self.cgroup: Optional[str] = None
+        self.process: Optional[subprocess.Popen] = None
+        self.reuse_count: int = 0
+
+    @staticmethod
+    def parse_cpus(cpuset_cpus: Optional[str]) -> Optional[List[int]]:
+        if not cpuset_cpus:
+            return None
+        cpus = set()
+        for part in str(cpuset_cpus).split(","):
+            start, _, end = part.partition("-")
+            cpus.update(range(int(start), int(end or start) + 1))
+        return sorted(cpus)
+
+    def open(self):
+        command = self.interpreters[self.lang]
+        if shutil.which(command[0]) is None:
+            raise ValueError(f"Interpreter {command[0]} for {self.lang} is not installed on the host")
+
+        # Without namespaces the code would be a plain host process, with the network and the files of the backend.
+        if not unshare_available():
+            raise RuntimeError("The process sandbox needs unprivileged user namespaces (unshare), use the Docker sandbox")
+
+        # The private /tmp of the code, and a directory for its captured output that the code cannot see.
+        self.root = tempfile.mkdtemp(prefix="monolith-process-")
+        self.io_dir = tempfile.mkdtemp(prefix="monolith-process-io-")
+        self.cgroup = self.create_cgroup()
+        if self.input_store:
+            os.mkdir(os.path.join(self.root, INPUT_MOUNT_NAME))
+        if self.verbose:
+            print(f"Opened process sandbox in {self.root} (cgroup: {self.cgroup})")
+
+    def create_cgroup(self) -> Optional[str]:
+        # cgroup v2 only, and only if the backend may write to the subtree (delegated to its user, or root).
+        if not os.path.exists(os.path.join(os.path.dirname(self.cgroup_root), "cgroup.controllers")):
+            return None
+        try:
+            os.makedirs(self.cgroup_root, exist_ok=True)
+            for controller in ("memory", "pids", "cpuset"):
+                try:
+                    self.write_cgroup(self.cgroup_root, "cgroup.subtree_control", f"+{controller}")
+                except OSError:
+                    pass
+            cgroup = os.path.join(self.cgroup_root, f"session-{uuid.uuid4().hex[:12]}")
+            os.mkdir(cgroup)
+            self.write_cgroup(cgroup, "memory.max", str(self.mem_limit))
+            self.write_cgroup(cgroup, "memory.swap.max", "0")
+            self.write_cgroup(cgroup, "pids.max", str(self.max_processes))
+            if self.cpuset_cpus:
+                self.write_cgroup(cgroup, "cpuset.cpus", str(self.cpuset_cpus))
+            return cgroup
+        except OSError as e:
+            if self.verbose:
+                print(f"cgroup v2 is not available under {self.cgroup_root}, falling back to rlimits: {e}")
+            return None
+
+    @staticmethod
+    def write_cgroup(cgroup: str, name: str, value: str) -> None:
+        with open(os.path.join(cgroup, name), "w") as f:
+            f.write(value)
+
+    def close(self):
+        self.interrupt()
+        for directory in (self.root, self.io_dir):
+            if directory:
+                shutil.rmtree(directory, ignore_errors=True)
+        self.root = self.io_dir = None
+        if self.cgroup:
+            # The cgroup can only be removed once its last process is reaped.
+            for _ in range(100):
+                try:
+                    os.rmdir(self.cgroup)
+                    break
+                except OSError as e:
+                    if e.errno != errno.EBUSY:
+                        break
+                    time.sleep(0.01)
+            self.cgroup = None
+
+    def reset(self):
+        """
+        Bring a used session back to the state right after open(), so that it can serve another task.
+        """
+        if not self.root:
+            raise RuntimeError("Session is not open. Please call open() method before resetting.")
+        self.interrupt()
+        for directory in (self.root, self.io_dir):
+            for name in os.listdir(directory):
+                if directory == self.root and name == INPUT_MOUNT_NAME:
+                    continue
+                path = os.path.join(directory, name)
+                shutil.rmtree(path) if os.path.isdir(path) and not os.path.islink(path) else os.remove(path)
+        self.reuse_count += 1
+
+    def interrupt(self):
+        """
+        Kill every process of the running command (its process group, and the whole cgroup if there is one).
+        """
+        if self.cgroup and os.path.exists(os.path.join(self.cgroup, "cgroup.kill")):
+            try:
+                self.write_cgroup(self.cgroup, "cgroup.kill", "1")
+            except OSError:
+                pass
+        if self.process is not None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    def setup(self, libraries=[], run_profiling=False, timeout: Optional[float] = None):
+        """
+        Nothing to prepare, the host interpreters are used as they are
+        :param libraries: Must be empty, the process sandbox does not install libraries
+        """
+        if libraries:
+            raise ValueError("The process sandbox does not install libraries, use the Docker sandbox")
+
+    def host_path(self, path: str) -> str:
+        # The code only sees its private /tmp, and nothing may resolve outside of it on the host.
+        if not check_input_path(path).startswith("/tmp/"):
+            raise ValueError(f"Only /tmp is visible in the process sandbox, got {path}")
+        host_path = os.path.join(self.root, path[len("/tmp/"):])
+        # The directories are resolved (a leftover symlink could point anywhere), the file itself may be a link being replaced.
+        root = os.path.realpath(self.root)
+        directory = os.path.realpath(os.path.dirname(host_path))
+        if directory != root and not directory.startswith(root + os.sep):
+            raise ValueError(f"Path {path} resolves outside of the process sandbox")
+        return os.path.join(directory, os.path.basename(host_path))
+
+    def guest_path(self, name: str) -> str:
+        return f"/tmp/{name}"
+
+    def input_path(self, digest: str) -> str:
+        # Where the code sees a stored input: the read-only mount in the private /tmp.
+        return self.guest_path(f"{INPUT_MOUNT_NAME}/{parse_digest(digest)}")
+
+    def kept_paths(self, masked: List[str]) -> List[str]:
+        # Installations under a masked directory (i.e. pyenv in the home) stay visible, read-only: the reporter and the interpreter.
+        candidates = [sys.base_prefix]
+        for executable in (shutil.which(self.interpreters[self.lang][0]),):
+            if executable:
+                candidates += [os.path.dirname(os.path.dirname(path)) for path in (executable, os.path.realpath(executable))]
+        # Parents sort first, so nested candidates are dropped. /run itself is the parking place, nothing is kept from it.
+        under = sorted({path for path in map(os.path.realpath, candidates) if any(path.startswith(directory + os.sep) for directory in masked if directory != "/run")})
+        kept = list()
+        for path in under:
+            if not any(path == other or path.startswith(other + os.sep) for other in kept):
+                kept.append(path)
+        return kept
+
+    def wrap(self, argv: List[str]) -> List[str]:
+        # Root in a new user namespace, no network, the private directory bind-mounted over /tmp, and the masked
+        # directories replaced by empty ones. Kept installations are parked in the new /run while the home is masked.
+        masked = masked_paths()
+        kept = self.kept_paths(masked)
+        steps = list()
+        if self.input_store:
+            # The input store goes read-only into the private directory first, /tmp then takes it along (rbind).
+            target = shlex.quote(os.path.join(self.root, INPUT_MOUNT_NAME))
+            steps += [f"mount --bind {shlex.quote(self.input_store.root)} {target}", f"mount -o remount,bind,ro {target}"]
+        steps.append(f"mount --rbind {shlex.quote(self.root)} /tmp")
+        steps.append("mount -t tmpfs -o size=1m,mode=755 tmpfs /run")
+        for index, path in enumerate(kept):
+            steps += [f"mkdir -p /run/kept/{index}", f"mount --rbind {shlex.quote(path)} /run/kept/{index}", f"mount -o remount,bind,ro /run/kept/{index}"]
+        steps += [f"mount -t tmpfs -o size=1m,mode=755 tmpfs {shlex.quote(path)}" for path in masked if path != "/run"]
+        for index, path in enumerate(kept):
+            steps += [f"mkdir -p {shlex.quote(path)}", f"mount --move /run/kept/{index} {shlex.quote(path)}"]
+        return [
+            "unshare", "--user", "--map-root-user", "--mount", "--pid", "--fork", "--mount-proc", "--net", "--ipc", "--uts", "--",
+            "/bin/sh", "-c", " && ".join(steps + ['cd /tmp', 'exec "$@"']), "sandbox",
+        ] + argv
+
+    def preexec(self) -> None:
+        # Runs in the child between fork and exec: new process group, cgroup leaf, rlimits, CPU affinity.
+        os.setsid()
+        if self.cgroup:
+            self.write_cgroup(self.cgroup, "cgroup.procs", "0")
+        else:
+            resource.setrlimit(resource.RLIMIT_AS, (self.mem_limit, self.mem_limit))
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        resource.setrlimit(resource.RLIMIT_NOFILE, (self.max_open_files, self.max_open_files))
+        resource.setrlimit(resource.RLIMIT_FSIZE, (self.max_file_size, self.max_file_size))
+        if self.cpus:
+            os.sched_setaffinity(0, self.cpus)
+
+    def sample_memory(self, pid: int) -> int:
+        # kB in use: the cgroup if there is one, otherwise the RSS of the process tree.
+        if self.cgroup:
+            with open(os.path.join(self.cgroup, "memory.current")) as f:
+                return int(f.read()) // 1024
+        process = psutil.Process(pid)
+        return sum(p.memory_info().rss for p in [process] + process.children(recursive=True)) // 1024
+
+    def read_oom_kills(self) -> Optional[int]:
+        # oom_kill counter of the cgroup leaf, None without one (RLIMIT_AS makes allocations fail instead).
+        if not self.cgroup:
+            return None
+        with open(os.path.join(self.cgroup, "memory.events")) as f:
+            return parse_oom_kills(f.read())
+
+    def spawn(
+        self, argv: List[str], stdin_path: Optional[str] = None, timeout: Optional[float] = None, profile: bool = False, max_output_bytes: Optional[int] = MAX_OUTPUT_BYTES
+    ) -> dict:
+        """
+        Run a command in the sandbox and wait for it
+        :param argv: Command
+        :param stdin_path: Host path of the standard input
+        :param timeout: Seconds before the command is killed
+        :param profile: if True, sample the memory usage while it runs
+        :param max_output_bytes: Bytes of stdout and of stderr read back, the rest is only counted (None reads everything)
+        :return: exit_code, stdout, stderr, their truncation and total_bytes, rusage (ru_* fields), elapsed, timed_out, and the samples if profiling
+        """
+        environment = {"PATH": os.environ.get("PATH", "/usr/bin:/bin"), "HOME": self.guest_path(""), "TMPDIR": self.guest_path(""), "LANG": "C.UTF-8"}
+        stdout_path, stderr_path = os.path.join(self.io_dir, "stdout"), os.path.join(self.io_dir, "stderr")
+        rusage_path = os.path.join(self.io_dir, "rusage")
+        timed_out, finished = threading.Event(), threading.Event()
+        timestamps, memories, sampler_cpu = list(), list(), [0.0]
+
+        with open(stdin_path or os.devnull, "rb") as stdin, open(stdout_path, "wb") as stdout, open(stderr_path, "wb") as stderr, open(rusage_path, "wb") as report:
+            command = [sys.executable, "-I", "-S", "-c", RUSAGE_REPORTER, str(report.fileno())] + argv
+            start_time = time.perf_counter()
+            self.process = subprocess.Popen(
+                self.wrap(command), stdin=stdin, stdout=stdout, stderr=stderr, cwd=self.root, env=environment,
+                preexec_fn=self.preexec, pass_fds=(report.fileno(),),
+            )
+        pid = self.process.pid
+
+        def fire():
+            timed_out.set()
+            self.interrupt()
+
+        def sample():
+            cpu_start = time.thread_time()
+            while not finished.is_set():
+                try:
+                    memories.append(self.sample_memory(pid))
+                    timestamps.append(time.time_ns())
+                except (OSError, psutil.Error):
+                    pass
+                finished.wait(self.sample_interval)
+            sampler_cpu[0] = time.thread_time() - cpu_start
+
+        watchdog = threading.Timer(timeout, fire) if timeout else None
+        sampler = threading.Thread(target=sample, daemon=True) if profile else None
+        for thread in (watchdog, sampler):
+            if thread:
+                thread.daemon = True
+                thread.start()
+        try:
+            # wait4 instead of Popen.wait, for the resource usage of the command (GNU time reads the same numbers).
+            _, status, rusage = os.wait4(pid, 0)
+            elapsed = time.perf_counter() - start_time
+            self.process.returncode = os.waitstatus_to_exitcode(status)
+        finally:
+            finished.set()
+            if watchdog:
+                watchdog.cancel()
+            if sampler:
+                sampler.join()
+            # Leftovers of the command, i.e. processes it started in the background.
+            self.interrupt()
+            self.process = None
+
+        returncode = os.waitstatus_to_exitcode(status)
+        # The output went straight to files (bounded by max_file_size), only their head is read back.
+        total_bytes = {"stdout": os.path.getsize(stdout_path), "stderr": os.path.getsize(stderr_path)}
+        with open(stdout_path, "rb") as f:
+            stdout_bytes = f.read(-1 if max_output_bytes is None else max_output_bytes)
+        with open(stderr_path, "rb") as f:
+            stderr_bytes = f.read(-1 if max_output_bytes is None else max_output_bytes)
+        try:
+            with open(rusage_path) as f:
+                usage = json.load(f)
+        except (OSError, ValueError):
+            # The reporter was killed with the program (deadline), only the CPU times of the whole group are known.
+            usage = {key: getattr(rusage, key) for key in RUSAGE_FIELDS}
+            usage["ru_maxrss"] = 0
+        return {
+            # Killed by a signal is reported like the shell does (128 + signal), i.e. 137 for SIGKILL.
+            "exit_code": 128 - returncode if returncode < 0 else returncode,
+            "stdout": decode_output(stdout_bytes),
+            "stderr": decode_output(stderr_bytes),
+            "stdout_truncated": total_bytes["stdout"] > len(stdout_bytes),
+            "stderr_truncated": total_bytes["stderr"] > len(stderr_bytes),
+            "total_bytes": total_bytes,
+            "rusage": usage,
+            "elapsed": elapsed,
+            "timed_out": timed_out.is_set(),
+            "timestamps": np.array(timestamps, dtype=np.int64),
+            "memories": np.array(memories, dtype=np.int64),
+            "sampler_cpu_time": sampler_cpu[0],
+        }
+
+    @staticmethod
+    def rusage_to_time_v(command: List[str], rusage: dict, elapsed: float, exit_code: int) -> dict:
+        # Same keys as parse_time_v_output(), from the rusage that GNU time prints.
+        cpu_time = rusage["ru_utime"] + rusage["ru_stime"]
+        return {
+            "command": " ".join(command),
+            "user_time": rusage["ru_utime"],
+            "system_time": rusage["ru_stime"],
+            "cpu_percent": int(100 * cpu_time / elapsed) if elapsed else 0,
+            "elapsed_time_seconds": elapsed,
+            "max_resident_set_kb": rusage["ru_maxrss"],
+            "minor_page_faults": rusage["ru_minflt"],
+            "major_page_faults": rusage["ru_majflt"],
+            "voluntary_context_switches": rusage["ru_nvcsw"],
+            "involuntary_context_switches": rusage["ru_nivcsw"],
+            "swaps": rusage["ru_nswap"],
+            "file_system_inputs": rusage["ru_inblock"],
+            "file_system_outputs": rusage["ru_oublock"],
+            "signals_delivered": rusage["ru_nsignals"],
+            "page_size_bytes": resource.getpagesize(),
+            "exit_status": exit_code,
+        }
+
+    def run(
+        self,
+        code: str,
+        stdin: str,
+        run_profiling=False,
+        artifact_cache=None,
+        max_log_points: Optional[int] = 1000,
+        compile_timeout: Optional[float] = None,
+        run_timeout: Optional[float] = None,
+        max_output_bytes: Optional[int] = MAX_OUTPUT_BYTES,
+        stdin_digest: Optional[str] = None,
+        input_files: Optional[Dict[str, str]] = None,
+        expected_output: Optional[str] = None,
+        *args,
+        **kwargs,
+    ) -> dict:
+        """
+        Run the code in the sandbox, with the same response as SandboxDockerSession.run()
+        :param code: Source code
+        :param stdin: Standard input of the program
+        :param run_profiling: if True, sample the memory usage, otherwise report the GNU time statistics (time_v)
+        :param artifact_cache: Unused, there is nothing to compile
+        :param max_log_points: Resample the returned memory log to at most this many points (None keeps every sample)
+        :param compile_timeout: Unused, there is nothing to compile
+        :param run_timeout: Seconds the program may run
+        :param max_output_bytes: Bytes of stdout and of stderr kept, the rest is only counted (None keeps everything)
+        :param stdin_digest: Digest of a stored input to use as standard input instead of stdin
+        :param input_files: Paths under /tmp to link to stored inputs, i.e. {"/tmp/data.txt": "sha256:..."}
+        :param expected_output: if given, the output file of the sandbox is compared with it and only output_matched is returned, not stdout
+        :return: Response with the output and the measurements, timeout_phase is "run" if the deadline was hit
+        """
+        if not self.root:
+            raise RuntimeError("Session is not open. Please call open() method before running code.")
+
+        phase_times = dict()
+        start_time = time.perf_counter()
+        code_name = f"code.{get_code_file_extension(self.lang)}"
+        with open(os.path.join(self.root, code_name), "w") as f:
+            f.write(code)
+        if (stdin_digest or input_files) and not self.input_store:
+            raise ValueError("Inputs by digest need a session with an input store")
+        for path, digest in (input_files or {}).items():
+            self.input_store.acquire(digest)
+            link = self.host_path(path)
+            os.makedirs(os.path.dirname(link), exist_ok=True)
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(self.input_path(digest), link)
+        if stdin_digest:
+            # Read in place, the stored input is the standard input of the process.
+            self.input_store.acquire(stdin_digest)
+            stdin_path = self.input_store.path(stdin_digest)
+        else:
+            stdin_path = os.path.join(self.io_dir, "stdin")
+            with open(stdin_path, "w") as f:
+                f.write("" if stdin is None else stdin)
+        phase_times["file_copy"] = time.perf_counter() - start_time
+
+        command = self.interpreters[self.lang] + [self.guest_path(code_name)]
+        oom_kills = self.read_oom_kills()
+        output = self.spawn(command, stdin_path=stdin_path, timeout=run_timeout, profile=run_profiling, max_output_bytes=max_output_bytes)
+        phase_times["run"] = output["elapsed"]
+        output_matched = None
+        if expected_output is not None:
+            start_time = time.perf_counter()
+            with open(os.path.join(self.io_dir, "stdout"), "rb") as f:
+                output_matched = outputs_match(f, expected_output.encode("utf-8").splitlines())
+            phase_times["judge"] = time.perf_counter() - start_time
+            output["stdout"], output["stdout_truncated"] = None, False
+
+        if self.verbose:
+            print('stdout:', output["stdout"])
+            print('stderr:', output["stderr"])
+
+        # Construct the response
+        response = {"stdout": output["stdout"], "stderr": output["stderr"], "peak_memory": 0, "integral": 0, "duration": 0, 'log': list()}
+        response['compile_time'] = 0.0
+        response['run_time'] = output["elapsed"]
+        response['artifact_cache_hit'] = False
+        response['compiled'] = True
+        response['exit_code'] = output["exit_code"]
+        response['stdout_truncated'] = output["stdout_truncated"]
+        response['stderr_truncated'] = output["stderr_truncated"]
+        response['total_bytes'] = output["total_bytes"]
+        response['timeout_phase'] = "run" if output["timed_out"] or (run_timeout and output["exit_code"] == TIMEOUT_EXIT_CODE and output["elapsed"] >= run_timeout) else None
+        # SIGKILL may come from the program itself, only the memory cgroup tells an OOM kill apart.
+        response['oom_killed'] = not response['timeout_phase'] and oom_kills is not None and (self.read_oom_kills() or 0) > oom_kills
+        response['output_matched'] = output_matched
+        response['phase_times'] = phase_times
+
+        if run_profiling:
+            start_time = time.perf_counter()
+            response.update(summarize_memory(output["timestamps"], output["memories"], max_log_points=max_log_points))
+            response['profiler_cpu_time'] = output["sampler_cpu_time"]
+            phase_times["log_retrieval"] = time.perf_counter() - start_time
+        else:
+            response['time_v'] = self.rusage_to_time_v(command, output["rusage"], output["elapsed"], output["exit_code"])
+        return response
+
+    def execute_command(
+        self, command: Optional[str], workdir: Optional[str] = None, timeout: Optional[float] = None, max_output_bytes: Optional[int] = MAX_OUTPUT_BYTES
+    ) -> ConsoleOutput:
+        """
+        Execute a shell command in the sandbox
+        :param command: Command
+        :param workdir: Unused, commands run in the private /tmp
+        :param timeout: Seconds before the command is killed
+        :param max_output_bytes: Bytes of stdout and of stderr kept, the rest is only counted (None keeps everything)
+        :return: Output, exit code, whether the deadline was hit, and whether the output was truncated
+        """
+        if not command:
+            raise ValueError("Command cannot be empty")
+        if not self.root:
+            raise RuntimeError("Session is not open. Please call open() method before executing commands.")
+        output = self.spawn(["/bin/sh", "-c", command], timeout=timeout, max_output_bytes=max_output_bytes)
+        return ConsoleOutput(
+            output["stdout"], output["stderr"], exit_code=output["exit_code"], timed_out=output["timed_out"],
+            stdout_truncated=output["stdout_truncated"], stderr_truncated=output["stderr_truncated"], total_bytes=output["total_bytes"],
+        )
+
+    def copy_to_runtime(self, src: str, dest: str):
+        if not self.root:
+            raise RuntimeError("Session is not open. Please call open() method before copying files.")
+        os.makedirs(os.path.dirname(self.host_path(dest)), exist_ok=True)
+        shutil.copy(src, self.host_path(dest))
+
+    def copy_from_runtime(self, src: str, dest: str):
+        if not self.root:
+            raise RuntimeError("Session is not open. Please call open() method before copying files.")
+        if not os.path.exists(self.host_path(src)):
+            raise FileNotFoundError(f"File {src} not found in the sandbox")
+        shutil.copy(self.host_path(src), dest)
@@ -0,0 +1,162 @@
+import math
+import time
+import statistics
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from llm_sandbox.base import Session
+
+# Measurements summarized over the repeated runs
+REPEAT_METRICS = (
+    "wall_time",    # seconds, run step only
+    "cpu_time",     # seconds of user + system time (GNU time), not measured when profiling
+    "peak_memory",  # kB, from the memory log when profiling, otherwise the maximum resident set size of GNU time
+    "integral",     # kB*ms, only measured when profiling
+)
+
+
+def parse_repeat(input_dict: dict, max_repeat: int, max_warmup: int) -> Tuple[int, int]:
+    """
+    Validate repeat and warmup of a request before it is queued, and bound them by the limits of the backend
+    :param input_dict: Request, the values it holds are replaced by the bounded ones
+    :param max_repeat: Most measured runs of a request
+    :param max_warmup: Most discarded runs of a request
+    :return: repeat and warmup
+    :raises ValueError: if either is not an integer, or repeat is below 1 or warmup below 0
+    """
+    values = list()
+    for field, default, low, high in (("repeat", 1, 1, max_repeat), ("warmup", 0, 0, max_warmup)):
+        value = input_dict.get(field)
+        if value is None:
+            values.append(default)
+            continue
+        # JSON has no integer type of its own, 3.0 is fine, true and "3" are not.
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not float(value).is_integer():
+            raise ValueError(f"{field} must be an integer")
+        if value < low:
+            raise ValueError(f"{field} must be at least {low}")
+        input_dict[field] = min(int(value), high)
+        values.append(input_dict[field])
+    return values[0], values[1]
+
+
+def sample_metrics(result: dict, run_profiling: bool) -> Dict[str, Optional[float]]:
+    """
+    :param result: Response of session.run()
+    :param run_profiling: Whether the run was profiled
+    :return: Value of each of REPEAT_METRICS, None if the run did not measure it
+    """
+    time_v = result.get("time_v") or {}
+    cpu_time = time_v.get("user_time", 0.0) + time_v.get("system_time", 0.0) if time_v else None
+    return {
+        "wall_time": result["run_time"],
+        "cpu_time": None if run_profiling else cpu_time,
+        "peak_memory": result["peak_memory"] if run_profiling else time_v.get("max_resident_set_kb"),
+        "integral": result["integral"] if run_profiling else None,
+    }
+
+
+def median_interval(values: np.ndarray, confidence: float) -> tuple:
+    # Distribution-free interval of the median between two order statistics, from the Binomial(n, 1/2) distribution.
+    n = len(values)
+    probabilities = [math.comb(n, i) / 2 ** n for i in range(n + 1)]
+    best = (0, n - 1, 1 - 2 * probabilities[0] if n > 1 else 0.0)
+    for low in range(1, n // 2 + 1):
+        high = n - 1 - low
+        coverage = sum(probabilities[low + 1:high + 1])
+        if high <= low or coverage < confidence:
+            break
+        best = (low, high, coverage)
+    low, high, coverage = best
+    return float(values[low]), float(values[high]), coverage
+
+
+def summarize_samples(samples: List[float], confidence: float = 0.95) -> dict:
+    """
+    Robust statistics of repeated measurements
+    :param samples: One value per run
+    :param confidence: Target confidence of the intervals
+    :return: n, median, mad (median absolute deviation), min, max, mean, stdev, the interval of the median
+             (ci_median with its actual coverage, which differs from the target for few runs) and of the mean (ci_mean, normal approximation)
+    """
+    values = np.sort(np.asarray(samples, dtype=np.float64))
+    n = len(values)
+    if n == 0:
+        return {"n": 0}
+    median = float(np.median(values))
+    stdev = float(values.std(ddof=1)) if n > 1 else 0.0
+    mean = float(values.mean())
+    low, high, coverage = median_interval(values, confidence)
+    margin = statistics.NormalDist().inv_cdf((1 + confidence) / 2) * stdev / math.sqrt(n)
+    return {
+        "n": n,
+        "median": median,
+        "mad": float(np.median(np.abs(values - median))),
+        "min": float(values[0]),
+        "max": float(values[-1]),
+        "mean": mean,
+        "stdev": stdev,
+        "ci_median": [low, high],
+        "ci_median_coverage": coverage,
+        "ci_mean": [mean - margin, mean + margin],
+    }
+
+
+def run_repeated(
+    session: Session,
+    code: str,
+    stdin: Optional[str],
+    repeat: int,
+    warmup: int = 0,
+    include_samples: bool = False,
+    confidence: float = 0.95,
+    run_profiling: bool = False,
+    time_budget: Optional[float] = None,
+    **kwargs,
+) -> dict:
+    """
+    Run the code warmup + repeat times in the same session and summarize the measured runs.
+    Warmup runs are discarded, they fill the page cache, the artifact cache and the JIT of the interpreter.
+    Repetition stops at the first run that fails, times out or does not compile, whose response is returned.
+    :param session: Open session
+    :param code: Source code
+    :param stdin: Standard input of the program
+    :param repeat: Number of measured runs
+    :param warmup: Number of discarded runs before them
+    :param include_samples: if True, return the value of every measured run as well
+    :param confidence: Target confidence of the intervals
+    :param run_profiling: if True, profile the memory of every run
+    :param time_budget: Seconds after which no further run is started (runs tells how many were done)
+    :param kwargs: Other arguments of session.run(), i.e. artifact_cache and the timeouts
+    :return: Response of the last run, with repeat holding the statistics of REPEAT_METRICS, and phase_times adding up all runs
+    """
+    samples = {metric: list() for metric in REPEAT_METRICS}
+    phase_times: Dict[str, float] = dict()
+    result, runs = None, 0
+    start_time = time.perf_counter()
+    for index in range(warmup + repeat):
+        if result is not None and time_budget and time.perf_counter() - start_time >= time_budget:
+            break
+        result = session.run(code=code, stdin=stdin, run_profiling=run_profiling, **kwargs)
+        runs += 1
+        for phase, seconds in result.pop("phase_times").items():
+            phase_times[phase] = phase_times.get(phase, 0.0) + seconds
+        if result["timeout_phase"] or not result["compiled"] or result["exit_code"] != 0:
+            break
+        if index >= warmup:
+            for metric, value in sample_metrics(result, run_profiling).items():
+                if value is not None:
+                    samples[metric].append(value)
+
+    result["phase_times"] = phase_times
+    result["repeat"] = {
+        "warmup": warmup,
+        "repeat": repeat,
+        "runs": runs,
+        "confidence": confidence,
+        "stats": {metric: summarize_samples(values, confidence) for metric, values in samples.items() if values},
+    }
+    if include_samples:
+        result["repeat"]["samples"] = {metric: values for metric, values in samples.items() if values}
+    return result
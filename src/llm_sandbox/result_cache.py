@@ -0,0 +1,156 @@
+import json
+import time
+import hashlib
+import threading
+import collections
+from typing import Dict, List, Optional
+
+from llm_sandbox.library_cache import normalize_libraries
+
+# Request fields that do not change the result, left out of the fingerprint
+FINGERPRINT_IGNORED_FIELDS = ("cache", "priority", "endpoint")
+# Request fields that ask for a measurement, with the value that does not: identical requests in flight share a
+# measurement, but it is not served again later. run_memory_profile is the flag of the async backend, run_profiling the one of the sync backend.
+MEASUREMENT_FIELDS = {"run_memory_profile": False, "run_profiling": False, "repeat": 1, "warmup": 0}
+# Fields of a result that describe the run rather than the output of the program, left out of cached results
+RUN_FIELDS = ("worker_id", "process_time", "phase_times")
+RUN_OUTPUT_FIELDS = ("compile_time", "run_time", "duration", "peak_memory", "integral", "log", "time_v", "artifact_cache_hit")
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 10000, memory_budget: int = 64 * 1024 ** 2, ttl: float = 3600, verbose: bool = False):
+        """
+        Results of finished tasks keyed by the fingerprint of their request, and the tasks in flight per fingerprint.
+        Identical submissions attach to the task in flight instead of taking a worker, later ones are served from the cache.
+        Requests with "cache": false bypass both, measurements (see MEASUREMENT_FIELDS) are coalesced but not cached.
+        Cached results keep the output of the program only, the timings and memory stats of the run are left out.
+        :param max_entries: Results kept at most, the least recently used ones are evicted first
+        :param memory_budget: Bytes (serialized size) of cached results
+        :param ttl: Seconds a cached result is served
+        :param verbose: if True, print messages
+        """
+        self.max_entries = max_entries
+        self.memory_budget = memory_budget
+        self.ttl = ttl
+        self.verbose = verbose
+
+        self.lock = threading.Lock()
+        # fingerprint -> (stored_at, size, result), least recently used first
+        self.entries: "collections.OrderedDict[str, tuple]" = collections.OrderedDict()
+        self.memory_usage = 0
+        # fingerprint -> {"leader": task_id, "followers": [task_id, ...], "done": threading.Event, "result": dict or None, "store": bool}
+        self.in_flight: Dict[str, dict] = dict()
+        self.stats = collections.Counter()
+
+    def fingerprint(self, input_dict: dict) -> Optional[str]:
+        """
+        :param input_dict: Request of a task
+        :return: Hash of the language, code, stdin, libraries and every other option of the request, None if it opted out
+        """
+        if input_dict.get("cache", True) is False:
+            with self.lock:
+                self.stats["bypassed"] += 1
+            return None
+        fields = {key: value for key, value in input_dict.items() if key not in FINGERPRINT_IGNORED_FIELDS}
+        fields["libraries"] = normalize_libraries(fields.get("libraries"))
+        payload = json.dumps(fields, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def storable(self, input_dict: dict) -> bool:
+        """
+        :param input_dict: Request of a task
+        :return: False if the result is a measurement (memory profile, repeated or warmed-up runs), only valid when taken
+        """
+        return all(input_dict.get(field, default) in (None, default) for field, default in MEASUREMENT_FIELDS.items())
+
+    def lookup(self, fingerprint: str) -> Optional[dict]:
+        """
+        :param fingerprint: Fingerprint of the request
+        :return: Cached result, or None on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(fingerprint)
+            if entry is not None and time.time() - entry[0] >= self.ttl:
+                self.drop(fingerprint)
+                self.stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(fingerprint)
+            self.stats["hits"] += 1
+            return dict(entry[2])
+
+    def attach(self, fingerprint: str, task_id: str, store: bool = True) -> Optional[dict]:
+        """
+        Join the task in flight with the same fingerprint, or become that task
+        :param fingerprint: Fingerprint of the request
+        :param task_id: Task ID of the request
+        :param store: if False, the result of the task is handed to its followers but not cached (see storable())
+        :return: In-flight entry of the leading task if there is one (wait on entry["done"] for entry["result"]), None if this task leads
+        """
+        with self.lock:
+            entry = self.in_flight.get(fingerprint)
+            if entry is not None:
+                entry["followers"].append(task_id)
+                self.stats["coalesced"] += 1
+                return entry
+            self.in_flight[fingerprint] = {"leader": task_id, "followers": list(), "done": threading.Event(), "result": None, "store": store}
+            return None
+
+    def complete(self, fingerprint: str, result: Optional[dict]) -> List[str]:
+        """
+        Finish the task in flight, waking up its followers, and cache its result
+        :param fingerprint: Fingerprint of the request
+        :param result: Result to hand to the followers and to cache, None if it must not be reused (i.e. an error)
+        :return: Task IDs of the followers
+        """
+        with self.lock:
+            entry = self.in_flight.pop(fingerprint, None)
+            if result is not None and (entry is None or entry["store"]):
+                self.store(fingerprint, result)
+        if entry is None:
+            return list()
+        entry["result"] = result
+        entry["done"].set()
+        return entry["followers"]
+
+    def store(self, fingerprint: str, result: dict) -> None:
+        # Called with the lock held.
+        result = {key: value for key, value in result.items() if key not in RUN_FIELDS}
+        if isinstance(result.get("output_dict"), dict):
+            result["output_dict"] = {key: value for key, value in result["output_dict"].items() if key not in RUN_OUTPUT_FIELDS}
+        size = len(json.dumps(result, default=str))
+        if size > self.memory_budget:
+            return
+        self.drop(fingerprint)
+        self.entries[fingerprint] = (time.time(), size, result)
+        self.memory_usage += size
+        self.stats["stores"] += 1
+        while len(self.entries) > self.max_entries or self.memory_usage > self.memory_budget:
+            self.drop(next(iter(self.entries)))
+            self.stats["evictions"] += 1
+
+    def drop(self, fingerprint: str) -> None:
+        # Called with the lock held.
+        entry = self.entries.pop(fingerprint, None)
+        if entry is not None:
+            self.memory_usage -= entry[1]
+
+    def get_status(self) -> dict:
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "memory_usage": self.memory_usage,
+                "memory_budget": self.memory_budget,
+                "in_flight": len(self.in_flight),
+                "hits": self.stats["hits"],
+                "misses": self.stats["misses"],
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "coalesced": self.stats["coalesced"],
+                "bypassed": self.stats["bypassed"],
+                "evictions": self.stats["evictions"],
+                "expired": self.stats["expired"],
+            }
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import collections
+from typing import Dict, Optional
+
+
+class ResultStore:
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        memory_budget: int = 256 * 1024 ** 2,
+        ttl: float = 3600,
+        expire_interval: float = 60,
+        verbose: bool = False,
+    ):
+        """
+        Task results kept in memory while they are in flight, and bounded by a TTL and a memory budget once finished.
+        Finished results over the memory budget are spilled to SQLite instead of being dropped; in-flight results are never evicted.
+        :param path: SQLite file of the spilled results
+        :param memory_budget: Bytes (serialized size) of finished results kept in memory
+        :param ttl: Seconds a finished result is kept before it expires
+        :param expire_interval: Seconds between two sweeps of expired results
+        :param verbose: if True, print messages
+        """
+        self.path = path or os.path.join(os.path.expanduser("~"), ".cache", "monolith", "results.sqlite3")
+        self.memory_budget = memory_budget
+        self.ttl = ttl
+        self.expire_interval = expire_interval
+        self.verbose = verbose
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self.lock = threading.RLock()
+        self.records: Dict[str, dict] = dict()
+        # Finished results in memory, oldest first: task_id -> (finished_at, size)
+        self.finished: "collections.OrderedDict[str, tuple]" = collections.OrderedDict()
+        self.memory_usage = 0
+        self.spilled = 0
+        self.last_expire = time.time()
+        self.stats = collections.Counter()
+
+        self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (task_id TEXT PRIMARY KEY, finished_at REAL, payload TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_finished_at ON results (finished_at)")
+        self.spilled = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def put(self, task_id: str, record: dict) -> None:
+        """
+        Insert or update a result. Results whose status is not "processing" count as finished.
+        :param task_id: Task ID
+        :param record: Result record
+        """
+        with self.lock:
+            self.forget(task_id)
+            self.records[task_id] = record
+            if record.get("status") != "processing":
+                size = len(json.dumps(record, default=str))
+                self.finished[task_id] = (time.time(), size)
+                self.memory_usage += size
+            self.enforce()
+
+    def get(self, task_id: str) -> Optional[dict]:
+        """
+        :param task_id: Task ID
+        :return: Result record, from memory (dict lookup) or from the spill file (primary key lookup), or None
+        """
+        with self.lock:
+            record = self.records.get(task_id)
+            if record is not None:
+                entry = self.finished.get(task_id)
+                if entry is None or time.time() - entry[0] < self.ttl:
+                    self.stats["memory_hits"] += 1
+                    return record
+                return None
+            if not self.spilled:
+                return None
+            row = self.db.execute(
+                "SELECT payload FROM results WHERE task_id = ? AND finished_at >= ?", (task_id, time.time() - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            self.stats["disk_hits"] += 1
+            return json.loads(row[0])
+
+    def pop(self, task_id: str) -> Optional[dict]:
+        with self.lock:
+            record = self.get(task_id)
+            self.forget(task_id)
+            if self.spilled and self.db.execute("DELETE FROM results WHERE task_id = ?", (task_id,)).rowcount:
+                self.spilled -= 1
+            return record
+
+    def __contains__(self, task_id: str) -> bool:
+        return self.get(task_id) is not None
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.records) + self.spilled
+
+    def forget(self, task_id: str) -> None:
+        # Drop the in-memory copy of a result, the caller holds the lock.
+        self.records.pop(task_id, None)
+        entry = self.finished.pop(task_id, None)
+        if entry:
+            self.memory_usage -= entry[1]
+
+    def enforce(self) -> None:
+        # Expire old results now and then, and spill the oldest finished results while over the memory budget.
+        if time.time() - self.last_expire >= self.expire_interval:
+            self.expire()
+
+        spills = list()
+        while self.memory_usage > self.memory_budget and self.finished:
+            task_id, (finished_at, _) = next(iter(self.finished.items()))
+            spills.append((task_id, finished_at, json.dumps(self.records[task_id], default=str)))
+            self.forget(task_id)
+        if spills:
+            self.db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", spills)
+            self.spilled += len(spills)
+            self.stats["spills"] += len(spills)
+
+    def expire(self) -> None:
+        with self.lock:
+            now = time.time()
+            self.last_expire = now
+            while self.finished:
+                task_id, (finished_at, _) = next(iter(self.finished.items()))
+                if now - finished_at < self.ttl:
+                    break
+                self.forget(task_id)
+                self.stats["expired"] += 1
+            expired = self.db.execute("DELETE FROM results WHERE finished_at < ?", (now - self.ttl,)).rowcount
+            self.spilled = max(self.spilled - expired, 0)
+            self.stats["expired"] += expired
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return {
+                "path": self.path,
+                "ttl": self.ttl,
+                "memory_budget": self.memory_budget,
+                "memory_usage": self.memory_usage,
+                "in_flight": len(self.records) - len(self.finished),
+                "finished_in_memory": len(self.finished),
+                "spilled": self.spilled,
+                "memory_hits": self.stats["memory_hits"],
+                "disk_hits": self.stats["disk_hits"],
+                "spills": self.stats["spills"],
+                "expired": self.stats["expired"],
+            }
@@ -0,0 +1,231 @@
+import heapq
+import queue
+import random
+import argparse
+import collections
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# Priority classes, higher is served first
+PRIORITY_CLASSES = {"high": 2, "normal": 1, "low": 0}
+DEFAULT_CLIENT = "anonymous"
+
+
+class FairShareScheduler:
+    def __init__(
+        self,
+        max_queued: int = 128,
+        max_queued_per_client: Optional[int] = None,
+        max_running_per_client: Optional[int] = None,
+        client_weights: Optional[Dict[str, float]] = None,
+    ):
+        """
+        Per-client task queues with weighted fair-share dequeueing and strict priority classes.
+        Within a priority class, the client with the lowest virtual time goes next, and every dispatch advances the
+        virtual time of its client by 1 / weight. Clients that were idle start at the current virtual time, so they
+        neither bank credit nor wait behind the backlog of a heavy client.
+        :param max_queued: Tasks waiting over all clients
+        :param max_queued_per_client: Tasks one client may have waiting (defaults to max_queued)
+        :param max_running_per_client: Tasks one client may have running at once (None for no cap)
+        :param client_weights: Share of each client, 1 for clients not listed
+        """
+        self.max_queued = max_queued
+        self.max_queued_per_client = max_queued_per_client or max_queued
+        self.max_running_per_client = max_running_per_client
+        self.client_weights = dict(client_weights or {})
+
+        self.queues: Dict[int, Dict[str, Deque[Any]]] = {priority: collections.OrderedDict() for priority in sorted(PRIORITY_CLASSES.values(), reverse=True)}
+        self.queued: Dict[str, int] = collections.Counter()
+        self.running: Dict[str, int] = collections.Counter()
+        self.virtual_time: Dict[str, float] = dict()
+        self.global_virtual_time = 0.0
+        self.stats = collections.Counter()
+
+    def __len__(self) -> int:
+        return sum(self.queued.values())
+
+    @staticmethod
+    def get_priority(name: Optional[str]) -> int:
+        if name is None:
+            return PRIORITY_CLASSES["normal"]
+        if name not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority {name}, must be one of {list(PRIORITY_CLASSES)}")
+        return PRIORITY_CLASSES[name]
+
+    def can_accept(self, client: str, count: int = 1) -> bool:
+        return len(self) + count <= self.max_queued and self.queued[client] + count <= self.max_queued_per_client
+
+    def push(self, client: str, item: Any, priority: Optional[str] = None) -> None:
+        """
+        Queue a task
+        :param client: Client the task belongs to (API key or client header)
+        :param item: Task
+        :param priority: Priority class, one of PRIORITY_CLASSES (default normal)
+        :raises queue.Full: if the global or the per-client queue limit is reached
+        """
+        level = self.get_priority(priority)
+        if not self.can_accept(client):
+            self.stats["rejected"] += 1
+            raise queue.Full
+        if self.queued[client] == 0 and self.running[client] == 0:
+            self.virtual_time[client] = max(self.virtual_time.get(client, 0.0), self.global_virtual_time)
+        self.queues[level].setdefault(client, collections.deque()).append(item)
+        self.queued[client] += 1
+        self.stats["queued"] += 1
+
+    def pop(self) -> Optional[Tuple[str, Any]]:
+        """
+        Take the next task to run, skipping clients at their concurrency cap
+        :return: (client, task), or None if nothing can run
+        """
+        for clients in self.queues.values():
+            eligible = [
+                client for client in clients
+                if self.max_running_per_client is None or self.running[client] < self.max_running_per_client
+            ]
+            if not eligible:
+                continue
+            client = min(eligible, key=lambda client: self.virtual_time[client])
+            item = clients[client].popleft()
+            if not clients[client]:
+                del clients[client]
+            self.queued[client] -= 1
+            self.running[client] += 1
+            self.global_virtual_time = self.virtual_time[client]
+            self.virtual_time[client] += 1.0 / self.client_weights.get(client, 1.0)
+            self.stats["dispatched"] += 1
+            return client, item
+        return None
+
+    def finish(self, client: str) -> None:
+        """
+        Mark a task returned by pop() as done
+        :param client: Client of the task
+        """
+        self.running[client] -= 1
+        if self.running[client] <= 0:
+            del self.running[client]
+        if self.queued[client] <= 0:
+            del self.queued[client]
+            if client not in self.running:
+                # Idle clients restart at the global virtual time anyway.
+                self.virtual_time.pop(client, None)
+
+    def get_status(self) -> dict:
+        return {
+            "max_queued": self.max_queued,
+            "max_queued_per_client": self.max_queued_per_client,
+            "max_running_per_client": self.max_running_per_client,
+            "queued": {client: count for client, count in self.queued.items() if count},
+            "running": {client: count for client, count in self.running.items() if count},
+            "dispatched": self.stats["dispatched"],
+            "rejected": self.stats["rejected"],
+        }
+
+
+class FifoScheduler(FairShareScheduler):
+    """
+    Single FIFO queue (the former queue.Queue), the baseline of the benchmark below.
+    """
+
+    def __init__(self, max_queued: int = 128):
+        super().__init__(max_queued=max_queued)
+        self.fifo: Deque[Tuple[str, Any]] = collections.deque()
+
+    def push(self, client: str, item: Any, priority: Optional[str] = None) -> None:
+        if len(self) >= self.max_queued:
+            raise queue.Full
+        self.fifo.append((client, item))
+        self.queued[client] += 1
+
+    def pop(self) -> Optional[Tuple[str, Any]]:
+        if not self.fifo:
+            return None
+        client, item = self.fifo.popleft()
+        self.queued[client] -= 1
+        self.running[client] += 1
+        return client, item
+
+
+def simulate(scheduler: FairShareScheduler, cores: int, arrivals: List[Tuple[float, str, float]]) -> Dict[str, List[float]]:
+    """
+    Discrete-event simulation of the workers: tasks arrive, wait in the scheduler and run on the first free core
+    :param scheduler: Scheduler under test
+    :param cores: Number of cores
+    :param arrivals: (arrival time, client, service time) of every task, sorted by arrival time
+    :return: Latencies (queueing + service) per client, rejected tasks are left out
+    """
+    latencies: Dict[str, List[float]] = collections.defaultdict(list)
+    completions: List[Tuple[float, int, str]] = list()
+    free_cores, now, sequence = cores, 0.0, 0
+    pending = collections.deque(arrivals)
+
+    def dispatch():
+        nonlocal free_cores, sequence
+        while free_cores:
+            task = scheduler.pop()
+            if task is None:
+                return
+            client, (arrived, service) = task
+            free_cores -= 1
+            sequence += 1
+            heapq.heappush(completions, (now + service, sequence, client))
+            latencies[client].append(now + service - arrived)
+
+    while pending or completions:
+        if pending and (not completions or pending[0][0] <= completions[0][0]):
+            now, client, service = pending.popleft()
+            try:
+                scheduler.push(client, (now, service))
+            except queue.Full:
+                pass
+        else:
+            now, _, client = heapq.heappop(completions)
+            scheduler.finish(client)
+            free_cores += 1
+        dispatch()
+    return latencies
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q / 100 * len(values)), len(values) - 1)] if values else float("nan")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tail latency of small clients next to a heavy tenant, FIFO vs fair share.")
+    parser.add_argument("--cores", type=int, default=8, help="number of worker cores")
+    parser.add_argument("--heavy-tasks", type=int, default=2000, help="tasks the heavy tenant submits in a sweep")
+    parser.add_argument("--small-clients", type=int, default=20, help="number of interactive clients")
+    parser.add_argument("--small-rate", type=float, default=0.05, help="tasks per second of each interactive client")
+    parser.add_argument("--duration", type=float, default=600, help="seconds of simulated time")
+    parser.add_argument("--service", type=float, default=2.0, help="mean task run time in seconds")
+    parser.add_argument("--queue-size", type=int, default=4096, help="scheduler queue limit")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    arrivals = list()
+    # The heavy tenant keeps a sweep flowing at twice the capacity of the cores.
+    for index in range(args.heavy_tasks):
+        arrivals.append((index * args.service / args.cores / 2, "heavy", rng.expovariate(1 / args.service)))
+    for client in range(args.small_clients):
+        now = rng.expovariate(args.small_rate)
+        while now < args.duration:
+            arrivals.append((now, f"small-{client}", rng.expovariate(1 / args.service)))
+            now += rng.expovariate(args.small_rate)
+    arrivals.sort()
+
+    schedulers = {
+        "fifo": FifoScheduler(max_queued=args.queue_size),
+        "fair-share": FairShareScheduler(max_queued=args.queue_size),
+        "fair-share (cap 50%)": FairShareScheduler(max_queued=args.queue_size, max_running_per_client=max(args.cores // 2, 1)),
+    }
+    print(f"{'scheduler':<22}{'small p50':>12}{'small p99':>12}{'heavy p50':>12}{'heavy p99':>12}{'done':>8}")
+    for name, scheduler in schedulers.items():
+        latencies = simulate(scheduler, args.cores, arrivals)
+        small = [latency for client, values in latencies.items() if client != "heavy" for latency in values]
+        heavy = latencies["heavy"]
+        print(
+            f"{name:<22}{percentile(small, 50):>11.1f}s{percentile(small, 99):>11.1f}s"
+            f"{percentile(heavy, 50):>11.1f}s{percentile(heavy, 99):>11.1f}s{len(small) + len(heavy):>8}"
+        )
@@ -3,6 +3,8 @@ from typing import Optional, Union
 from kubernetes import client as k8s_client
 from llm_sandbox.const import SupportedLanguage
 from llm_sandbox.docker import SandboxDockerSession
+from llm_sandbox.process import SandboxProcessSession
+from llm_sandbox.input_store import InputStore
 
 
 class SandboxSession:
@@ -18,10 +20,12 @@ class SandboxSession:
         use_kubernetes: bool = False,
         kube_namespace: Optional[str] = "default",
         container_configs: Optional[dict] = None,
+        use_process: bool = False,
+        input_store: Optional[InputStore] = None,
     ):
         """
         Create a new sandbox session
-        :param client: Either Docker or Kubernetes client, if not provided, a new client will be created based on local context
+        :param client: Either Docker or Kubernetes client, if not provided, the shared Docker client of the process is used
         :param image: Docker image to use
         :param dockerfile: Path to the Dockerfile, if image is not provided
         :param lang: Language of the code
@@ -31,8 +35,15 @@ class SandboxSession:
         :param use_kubernetes: if True, use Kubernetes instead of Docker (default is False)
         :param kube_namespace: Kubernetes namespace to use (only if 'use_kubernetes' is True), default is 'default'
         :param container_configs: Additional configurations for the Docker container, i.e. resources limits (cpu_count, mem_limit), etc.
+        :param use_process: if True, run the code in a confined host process instead of a container (interpreted languages
+                            only, mem_limit and cpuset_cpus of container_configs apply), see SandboxProcessSession
+        :param input_store: Store of uploaded inputs that runs can reference by digest (stdin_digest, input_files)
         """
 
+        if use_process:
+            limits = {key: value for key, value in (container_configs or {}).items() if key in ("mem_limit", "cpuset_cpus")}
+            return SandboxProcessSession(lang=lang, verbose=verbose, input_store=input_store, **limits)
+
         return SandboxDockerSession(
             client=client,
             image=image,
@@ -42,4 +53,5 @@ class SandboxSession:
             commit_container=commit_container,
             verbose=verbose,
             container_configs=container_configs,
+            input_store=input_store,
         )
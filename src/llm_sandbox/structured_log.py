@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import queue
+import atexit
+import random
+import hashlib
+import logging
+import threading
+import contextlib
+import contextvars
+import logging.handlers
+from typing import Dict, Optional
+
+# Correlation id of the task being handled, attached to every record logged while it is set
+correlation_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("correlation_id", default=None)
+
+# Attributes every LogRecord has, anything else was passed with extra= and is logged as a field
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "correlation_id"}
+
+DEFAULT_QUEUE_SIZE = 10000       # records waiting for the writer thread, later ones are dropped (and counted)
+DEFAULT_MAX_PAYLOAD_CHARS = 256  # longer strings are logged as their head, length and SHA-256
+
+
+@contextlib.contextmanager
+def correlation(task_id: Optional[str]):
+    """
+    Attach the given id to every record logged in this context (thread, or asyncio task)
+    :param task_id: Correlation id, i.e. the task ID
+    """
+    token = correlation_id.set(task_id)
+    try:
+        yield
+    finally:
+        correlation_id.reset(token)
+
+
+def summarize_payload(value, max_chars: int = DEFAULT_MAX_PAYLOAD_CHARS):
+    """
+    Make a payload fit in a log line: long strings (code, stdin, outputs) become their head, size and hash,
+    so that identical payloads can still be matched across records without logging them whole.
+    :param value: Payload, i.e. the request of a task
+    :param max_chars: Strings up to this length are kept as they are
+    :return: JSON-serializable summary
+    """
+    if isinstance(value, str):
+        if len(value) <= max_chars:
+            return value
+        data = value.encode("utf-8", errors="replace")
+        return {"head": value[:max_chars], "bytes": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+    if isinstance(value, bytes):
+        return {"bytes": len(value), "sha256": hashlib.sha256(value).hexdigest()}
+    if isinstance(value, dict):
+        return {str(key): summarize_payload(item, max_chars) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [summarize_payload(item, max_chars) for item in value[:max_chars]]
+        return items + [f"... {len(value) - max_chars} more"] if len(value) > max_chars else items
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return summarize_payload(str(value), max_chars)
+
+
+def snapshot(value):
+    # Copy of the containers only: strings are immutable, so the writer thread hashes them without racing the caller.
+    if isinstance(value, dict):
+        return {key: snapshot(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [snapshot(item) for item in value]
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, max_payload_chars: int = DEFAULT_MAX_PAYLOAD_CHARS):
+        """
+        One JSON object per line: time, level, logger, message, correlation id, process, and the extra= fields
+        :param max_payload_chars: Strings of the fields longer than this are summarized, see summarize_payload()
+        """
+        super().__init__()
+        self.max_payload_chars = max_payload_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "correlation_id": getattr(record, "correlation_id", None),
+            "pid": record.process,
+            "worker_id": os.environ.get("GUNICORN_WORKER_ID"),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = summarize_payload(value, self.max_payload_chars)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Records cross the queue with the traceback already rendered.
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, sample_rates: Optional[Dict[str, float]] = None):
+        """
+        Keep a fraction of the records of the given loggers (and their children). Warnings and errors are always kept,
+        and records with a correlation id are sampled per id, so that a task is logged completely or not at all.
+        :param sample_rates: Fraction of records kept per logger name, i.e. {"monolith.request": 0.1}
+        """
+        super().__init__()
+        self.sample_rates = dict(sample_rates or {})
+
+    def rate(self, name: str) -> float:
+        while name:
+            if name in self.sample_rates:
+                return self.sample_rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rate(record.name)
+        if rate >= 1.0 or record.levelno >= logging.WARNING:
+            return True
+        key = getattr(record, "correlation_id", None) or correlation_id.get()
+        if key is None:
+            return random.random() < rate
+        return int(hashlib.sha256(key.encode("utf-8")).hexdigest()[:8], 16) < rate * 0x100000000
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        """
+        Hands records to the writer thread without formatting or waiting: a full queue drops the record instead of
+        blocking the request path, the number of dropped records is kept in `dropped`.
+        :param log_queue: Queue the writer thread reads from
+        """
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting (and hashing payloads) happens on the writer thread, only the message and the fields are pinned here.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg, record.args = record.getMessage(), None
+        record.correlation_id = correlation_id.get()
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES and isinstance(value, (dict, list, tuple)):
+                record.__dict__[key] = snapshot(value)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    def __init__(
+        self,
+        filename: str = "monolith.log",
+        max_bytes: int = 100 * 1024 ** 2,
+        backup_count: int = 5,
+        level: int = logging.INFO,
+        sample_rates: Optional[Dict[str, float]] = None,
+        max_payload_chars: int = DEFAULT_MAX_PAYLOAD_CHARS,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ):
+        """
+        Structured logging off the request path: loggers put records on a bounded queue, one writer thread per process
+        formats them as JSON lines and writes them to a rotating file. A forked child (i.e. a Gunicorn worker) gets a
+        queue and a writer thread of its own, the one of the parent does not survive the fork.
+        :param filename: Log file, shared by the processes of the server
+        :param max_bytes: Size at which the log file is rotated
+        :param backup_count: Rotated files kept
+        :param level: Minimum level of the records
+        :param sample_rates: Fraction of records kept per logger name, see SamplingFilter
+        :param max_payload_chars: Strings of the fields longer than this are summarized, see summarize_payload()
+        :param queue_size: Records waiting for the writer thread at most
+        """
+        self.queue_size = queue_size
+        self.file_handler = logging.handlers.RotatingFileHandler(filename=filename, maxBytes=max_bytes, backupCount=backup_count)
+        self.file_handler.setFormatter(JsonFormatter(max_payload_chars))
+        self.handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+        self.handler.setLevel(level)
+        self.sampling = SamplingFilter(sample_rates)
+        self.handler.addFilter(self.sampling)
+        self.level = level
+        self.listener: Optional[logging.handlers.QueueListener] = None
+        self.lock = threading.Lock()
+        self.start()
+        # No fork in the middle of a write: the child would inherit the stream locked, with a partial line buffered.
+        os.register_at_fork(before=self.file_handler.acquire, after_in_parent=self.file_handler.release, after_in_child=self.after_fork)
+        atexit.register(self.stop)
+
+    def start(self) -> None:
+        self.listener = logging.handlers.QueueListener(self.handler.queue, self.file_handler, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self) -> None:
+        # Flushes the records still queued.
+        with self.lock:
+            if self.listener is not None:
+                self.listener.stop()
+                self.listener = None
+
+    def after_fork(self) -> None:
+        # The writer thread of the parent is gone, and its queue may hold records the parent will write itself.
+        # The file is opened for appending, so the processes can keep sharing it.
+        self.lock = threading.Lock()
+        self.handler.queue = queue.Queue(maxsize=self.queue_size)
+        self.handler.dropped = 0
+        self.file_handler.createLock()
+        self.start()
+
+    def configure(self, level: Optional[int] = None, sample_rates: Optional[Dict[str, float]] = None, max_payload_chars: Optional[int] = None) -> None:
+        # Settings of the application loaded after the pipeline was created (i.e. by gunicorn_config), unset ones are kept.
+        if level is not None:
+            self.level = level
+            self.handler.setLevel(level)
+        if sample_rates is not None:
+            self.sampling.sample_rates = dict(sample_rates)
+        if max_payload_chars is not None:
+            self.file_handler.formatter.max_payload_chars = max_payload_chars
+
+    def attach(self, logger: logging.Logger) -> None:
+        # Route a logger through the pipeline, replacing its handlers (i.e. the root logger of a backend).
+        logger.handlers.clear()
+        logger.setLevel(self.level)
+        logger.addHandler(self.handler)
+
+    def get_status(self) -> dict:
+        return {
+            "queued": self.handler.queue.qsize(),
+            "queue_size": self.queue_size,
+            "dropped": self.handler.dropped,
+            "running": self.listener is not None,
+        }
+
+
+pipelines: Dict[str, LogPipeline] = dict()
+
+
+def setup_logging(filename: str = "monolith.log", logger: Optional[logging.Logger] = None, **kwargs) -> LogPipeline:
+    """
+    Route the given logger (the root logger by default) through the pipeline writing to filename, created on first use
+    and shared by every caller in the process (i.e. gunicorn_config and the backend it loads)
+    :param filename: Log file
+    :param logger: Logger to route, defaults to the root logger
+    :param kwargs: Settings of the pipeline, see LogPipeline (only level, sample_rates and max_payload_chars change an existing one)
+    :return: The pipeline
+    """
+    key = os.path.abspath(filename)
+    if key not in pipelines:
+        pipelines[key] = LogPipeline(filename=filename, **kwargs)
+    pipeline = pipelines[key]
+    pipeline.configure(**{name: kwargs[name] for name in ("level", "sample_rates", "max_payload_chars") if name in kwargs})
+    pipeline.attach(logger or logging.getLogger())
+    return pipeline
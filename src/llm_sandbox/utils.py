@@ -1,10 +1,21 @@
 import re
+import shlex
+import itertools
 import docker
 import docker.errors
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 
 from docker import DockerClient
-from llm_sandbox.const import SupportedLanguage
+from llm_sandbox.const import (
+    SupportedLanguage,
+    SupportedLanguageValues,
+    CARGO_TARGET_TEMPLATE_DIR,
+    GO_BUILD_CACHE_SEED_DIR,
+    GO_BUILD_CACHE_DIR,
+    MEMORY_SAMPLER_PATH,
+    MEMORY_SAMPLER_INTERVAL_US,
+    TIME_V_OUTPUT_PATH,
+)
 
 
 def image_exists(client: DockerClient, image: str) -> bool:
@@ -71,44 +82,179 @@ def get_code_file_extension(lang: str) -> str:
     else:
         raise ValueError(f"Language {lang} is not supported")
 
-def get_code_execution_command(lang: str, code_file: str, run_profiling: bool, stdin: str) -> list:
+def get_code_compile_command(lang: str, code_file: str, build_cache: bool = False) -> list:
     """
-    Return the execution command for the given language and code file.
+    Return the compile commands for the given language and code file (empty for interpreted languages).
     :param lang: Language of the code
     :param code_file: Path to the code file
-    :return: List of execution commands
+    :param build_cache: if True, the shared build cache volumes are mounted (see llm_sandbox/build_cache.py)
+    :return: List of compile commands
+    """
+    if lang == SupportedLanguage.CPP:
+        return [f"g++ -o /tmp/a.out {code_file}"]
+    elif lang == SupportedLanguage.GO and build_cache:
+        # GOCACHE is a private copy of the read-only warmed cache, so that no build can change what another one reads.
+        seeded_build = f"rm -rf {GO_BUILD_CACHE_DIR} && cp -a {GO_BUILD_CACHE_SEED_DIR} {GO_BUILD_CACHE_DIR} && go build -o /go_space/code.bin {code_file}"
+        return [f'bash -c "{seeded_build}"']
+    elif lang == SupportedLanguage.GO:
+        return [f"go build -o /go_space/code.bin {code_file}"]
+    elif lang == SupportedLanguage.RUST and build_cache:
+        # Start from the prebuilt target dir of this dependency set if the build cache has one (read-only, populated by warm()).
+        seeded_build = (
+            "template=" + CARGO_TARGET_TEMPLATE_DIR + "/$(sha256sum Cargo.toml | cut -c1-32); "
+            "if [ -d $template ]; then cp -a $template/. target/ && rm -f target/debug/rust_space && cargo build --offline; "
+            "else rm -f target/debug/rust_space && cargo build; fi"
+        )
+        return ["mv src/code.rs src/main.rs", f'bash -c "{seeded_build}"']
+    elif lang == SupportedLanguage.RUST:
+        # A binary left from an earlier build must not pass for the output of this one.
+        return ["mv src/code.rs src/main.rs", 'bash -c "rm -f target/debug/rust_space && cargo build"']
+    elif lang in SupportedLanguageValues:
+        return []
+    else:
+        raise ValueError(f"Language {lang} is not supported")
+
+
+def get_code_artifact_path(lang: str) -> Optional[str]:
+    """
+    Return the path of the binary produced by the compile commands, if any.
+    :param lang: Language of the code
+    :return: Path of the compiled artifact inside the container
+    """
+    if lang == SupportedLanguage.CPP:
+        return "/tmp/a.out"
+    elif lang == SupportedLanguage.GO:
+        return "/go_space/code.bin"
+    elif lang == SupportedLanguage.RUST:
+        return "/rust_space/target/debug/rust_space"
+    return None
+
+
+def get_code_run_command(
+    lang: str,
+    code_file: str,
+    run_profiling: bool,
+    stdin: str,
+    native_sampler: bool = False,
+    sample_interval_us: int = MEMORY_SAMPLER_INTERVAL_US,
+    timeout: Optional[float] = None,
+    stdout_path: Optional[str] = None,
+) -> str:
+    """
+    Return the (measured) run command for the given language and code file, assuming it has been compiled.
+    :param lang: Language of the code
+    :param code_file: Path to the code file
+    :param run_profiling: if True, wrap the command with the memory profiler, otherwise with GNU time
+    :param stdin: Standard input of the program, redirected from /tmp/stdin if provided
+    :param native_sampler: if True, profile with the native memory sampler of the ready images instead of memory_profiler.sh
+    :param sample_interval_us: Sampling interval of the native memory sampler in microseconds
+    :param timeout: Seconds the program may run, enforced inside the container (exit status 137 when exceeded)
+    :param stdout_path: if given, the standard output of the program goes to this file instead of the exec stream
+    :return: Run command
     """
-    commands = list()
-    
     if lang == SupportedLanguage.PYTHON:
-        commands.append(f"python {code_file}")
+        command = f"python {code_file}"
     elif lang == SupportedLanguage.JAVA:
-        commands.append(f"java {code_file}")
+        command = f"java {code_file}"
     elif lang == SupportedLanguage.JAVASCRIPT:
-        commands.append(f"node {code_file}")
-    elif lang == SupportedLanguage.CPP:
-        commands.append(f"g++ -o a.out {code_file}")
-        commands.append(f"./a.out")
-    elif lang == SupportedLanguage.GO:
-        commands.append(f"go run {code_file}")
+        command = f"node {code_file}"
     elif lang == SupportedLanguage.RUBY:
-        commands.append(f"ruby {code_file}")
-    elif lang == SupportedLanguage.RUST:
-        commands.append(f'mv src/code.rs src/main.rs')
-        commands.append(f"cargo run")
+        command = f"ruby {code_file}"
+    elif lang in (SupportedLanguage.CPP, SupportedLanguage.GO, SupportedLanguage.RUST):
+        command = get_code_artifact_path(lang)
     else:
         raise ValueError(f"Language {lang} is not supported")
-    
+
     # Add memory profiler if run_profiling is True. Otherwise, add GNU time verbose mode.
-    if run_profiling:
-        commands[-1] = f"/tmp/memory_profiler.sh {commands[-1]}"
+    # Deadlines are enforced so that the measurements up to the deadline are still reported: by the native sampler itself,
+    # around memory_profiler.sh (which only samples its direct child, and `timeout` kills the whole process group),
+    # and inside GNU time.
+    if run_profiling and native_sampler:
+        deadline = f"-t {max(int(timeout * 1000), 1)} " if timeout else ""
+        command = f"{MEMORY_SAMPLER_PATH} -i {int(sample_interval_us)} {deadline}-o mem_usage.log -- {command}"
+    elif run_profiling:
+        command = f"/tmp/memory_profiler.sh {command}"
+        command = with_timeout(command, timeout) if timeout else command
     else:
-        commands[-1] = f"/usr/bin/time -v {commands[-1]}"
-        
-    if stdin:
-        commands[-1] = f"bash -c '{commands[-1]} < /tmp/stdin'"
-    
-    return commands
+        command = with_timeout(command, timeout) if timeout else command
+        command = f"/usr/bin/time -v -o {TIME_V_OUTPUT_PATH} {command}"
+
+    redirections = (" < /tmp/stdin" if stdin else "") + (f" > {stdout_path}" if stdout_path else "")
+    if redirections:
+        command = f"bash -c '{command}{redirections}'"
+
+    return command
+
+
+def get_output_match_command(output_path: str, expected_path: str) -> str:
+    """
+    Return the command comparing two files of the container the way normalized_lines() does, without reading them out.
+    :param output_path: Path of the program output
+    :param expected_path: Path of the expected output
+    :return: Command printing the size of the output in bytes, with exit status 0 if both match
+    """
+    # Streamed: only the count of pending blank lines is held, trailing ones are never printed.
+    normalize = 'awk \'{ sub(/[ \\t\\r\\f\\v]+$/, ""); if ($0 == "") blank++; else { for (; blank > 0; blank--) print ""; print } }\''
+    script = f'norm() {{ {normalize} "$1"; }}; wc -c < {output_path}; cmp -s <(norm {output_path}) <(norm {expected_path})'
+    return f"bash -c {shlex.quote(script)}"
+
+
+def normalized_lines(lines: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Lines without trailing whitespace, and without the trailing blank lines, like most online judges compare outputs.
+    :param lines: Lines of an output
+    :return: Normalized lines
+    """
+    blank = 0
+    for line in lines:
+        line = line.rstrip()
+        if not line:
+            blank += 1
+            continue
+        yield from itertools.repeat(b"", blank)
+        blank = 0
+        yield line
+
+
+def outputs_match(output: Iterable[bytes], expected: Iterable[bytes]) -> bool:
+    """
+    Compare two outputs line by line after normalized_lines(), without holding either in memory.
+    :param output: Lines of the program output, i.e. an open binary file
+    :param expected: Lines of the expected output
+    :return: True if both match
+    """
+    return all(a == b for a, b in itertools.zip_longest(normalized_lines(output), normalized_lines(expected)))
+
+
+def with_timeout(command: str, timeout: float) -> str:
+    """
+    Wrap a command with coreutils `timeout`, which kills it with SIGKILL (exit status 137) after the given seconds.
+    :param command: Command
+    :param timeout: Seconds
+    :return: Wrapped command
+    """
+    return f"timeout -s KILL {max(timeout, 0.001):.3f} {command}"
+
+
+def get_code_execution_command(lang: str, code_file: str, run_profiling: bool, stdin: str) -> list:
+    """
+    Return the execution command for the given language and code file.
+    :param lang: Language of the code
+    :param code_file: Path to the code file
+    :return: List of execution commands
+    """
+    return get_code_compile_command(lang, code_file) + [get_code_run_command(lang, code_file, run_profiling, stdin)]
+
+def parse_oom_kills(text: str) -> Optional[int]:
+    """
+    :param text: memory.events (cgroup v2) or memory.oom_control (cgroup v1) of a memory cgroup
+    :return: Processes killed by the OOM killer in the cgroup so far, None if the kernel does not count them
+    """
+    for line in text.splitlines():
+        key, _, value = line.partition(" ")
+        if key == "oom_kill" and value.strip().isdigit():
+            return int(value)
+    return None
 
 def parse_time_v_output(time_v_text: str) -> dict:
     """
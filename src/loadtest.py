@@ -0,0 +1,272 @@
+# coding: utf-8
+
+# Author: Du Mingzhe (mingzhe@nus.edu.sg)
+# Date: 2025-05-10
+
+"""
+Load test of the HTTP and queueing layers of the backends, without Docker.
+
+The backend module is imported in this process with docker.from_env() returning an in-process FakeDockerClient,
+then a JSONL trace of /execute requests is replayed against it at increasing request rates (open loop).
+Each step reports throughput, p50/p99 latency, the queue depth, rejections and the memory growth of the worker.
+
+    cd src
+    python loadtest.py --backend async --rates 5,10,20,40 --duration 10
+    python loadtest.py --backend sync --trace trace.jsonl --latency run=0.2,container_start=0.5 --concurrency 4
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import psutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import importlib
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import docker
+
+from llm_sandbox.image import prepare_images
+from llm_sandbox.fake_docker import FakeDockerClient, DEFAULT_LATENCIES
+
+# A mix of interpreted and compiled tasks, used when no trace is given
+SYNTHETIC_TASKS = [
+    {"language": "python", "code": "print(input())", "timeout": 10},
+    {"language": "python", "code": "import sys\nprint(sys.stdin.read())", "timeout": 10, "run_memory_profile": True, "run_profiling": True},
+    {"language": "cpp", "code": "#include <iostream>\nint main() { std::string s; std::cin >> s; std::cout << s; }", "timeout": 10},
+    {"language": "javascript", "code": "console.log(require('fs').readFileSync(0, 'utf8'))", "timeout": 10},
+]
+
+
+def load_trace(path: Optional[str], size: int, seed: int = 0) -> List[dict]:
+    """
+    :param path: JSONL file, one /execute payload per line (an "endpoint" key may send it to /execute_batch)
+    :param size: Number of synthetic requests if no trace is given
+    :param seed: Seed of the synthetic trace
+    :return: Requests
+    """
+    if path:
+        with open(path) as f:
+            trace = [json.loads(line) for line in f if line.strip()]
+        trace = [entry for entry in trace if 'code' in entry]
+        if not trace:
+            raise ValueError(f"{path} has no /execute payloads (objects with a code key)")
+        return trace
+    rng = random.Random(seed)
+    return [dict(rng.choice(SYNTHETIC_TASKS), stdin=str(rng.randint(0, 10 ** 6))) for _ in range(size)]
+
+
+def parse_latencies(text: Optional[str]) -> Dict[str, float]:
+    latencies = dict()
+    for item in (text or "").split(","):
+        if item.strip():
+            kind, _, seconds = item.partition("=")
+            if kind.strip() not in DEFAULT_LATENCIES:
+                raise ValueError(f"Unknown latency {kind}, must be one of {list(DEFAULT_LATENCIES)}")
+            latencies[kind.strip()] = float(seconds)
+    return latencies
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q / 100 * len(values)), len(values) - 1)] if values else float("nan")
+
+
+class StepReport:
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.latencies: List[float] = list()
+        self.submitted = 0
+        self.rejected = 0
+        self.errors = 0
+        self.queue_depths: List[int] = list()
+        self.submit_time = 0.0
+        self.wall_time = 0.0
+        self.rss_before = 0
+        self.rss_after = 0
+
+    @property
+    def throughput(self) -> float:
+        return len(self.latencies) / self.wall_time if self.wall_time else 0.0
+
+    def saturated(self, baseline: Optional["StepReport"]) -> bool:
+        # Saturated: the queue rejects, the backend falls behind the offered rate, or the tail latency blows up.
+        # The offered rate is the one achieved over the submit window, the throughput includes draining the backlog
+        # (so a step should last much longer than a request takes).
+        offered = min(self.rate, self.submitted / max(self.submit_time, 1e-9))
+        if self.rejected or self.throughput < 0.9 * offered:
+            return True
+        return baseline is not None and percentile(self.latencies, 99) > 5 * percentile(baseline.latencies, 99)
+
+    def to_dict(self) -> dict:
+        return {
+            "offered_rps": self.rate,
+            "throughput_rps": self.throughput,
+            "completed": len(self.latencies),
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "p50": percentile(self.latencies, 50),
+            "p99": percentile(self.latencies, 99),
+            "max_queue_depth": max(self.queue_depths, default=0),
+            "mean_queue_depth": statistics.fmean(self.queue_depths) if self.queue_depths else 0.0,
+            "rss_growth_mb": (self.rss_after - self.rss_before) / 1024 ** 2,
+        }
+
+
+def run_sync(module, trace: List[dict], rate: float, duration: float, concurrency: int) -> StepReport:
+    # Every thread stands for one Gunicorn sync worker, requests wait for a free one like in the listen backlog.
+    report = StepReport(rate)
+    client = module.app.test_client()
+    backlog = [0]
+    lock = threading.Lock()
+
+    def execute(payload: dict, arrival: float) -> None:
+        with lock:
+            backlog[0] -= 1
+        response = client.post(payload.get("endpoint", "/execute"), json=payload)
+        with lock:
+            if response.status_code == 503:
+                report.rejected += 1
+            elif response.status_code != 200 or response.get_json().get("status") == "error":
+                report.errors += 1
+            else:
+                report.latencies.append(time.perf_counter() - arrival)
+
+    count = int(rate * duration)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index in range(count):
+            arrival = start + index / rate
+            while (now := time.perf_counter()) < arrival:
+                time.sleep(min(arrival - now, 0.01))
+            with lock:
+                backlog[0] += 1
+                report.queue_depths.append(backlog[0])
+            report.submitted += 1
+            executor.submit(execute, trace[index % len(trace)], arrival)
+        report.submit_time = time.perf_counter() - start
+    report.wall_time = time.perf_counter() - start
+    return report
+
+
+async def run_async(module, trace: List[dict], rate: float, duration: float, result_wait: float = 30) -> StepReport:
+    report = StepReport(rate)
+    manager = module.app.manager
+
+    async with module.app.test_app() as test_app:
+        client = test_app.test_client()
+
+        async def execute(payload: dict, arrival: float) -> None:
+            response = await client.post(payload.get("endpoint", "/execute"), json=payload)
+            body = await response.get_json()
+            if response.status_code == 503:
+                report.rejected += 1
+                return
+            while body.get("status") == "processing":
+                # Long-poll like a well-behaved client.
+                response = await client.get(f"/results/{body['task_id']}?wait={result_wait}")
+                body = await response.get_json()
+            if body.get("status") == "error":
+                report.errors += 1
+            else:
+                report.latencies.append(time.perf_counter() - arrival)
+
+        async def sample_queue(stop: asyncio.Event) -> None:
+            while not stop.is_set():
+                report.queue_depths.append(len(manager.scheduler))
+                await asyncio.sleep(0.05)
+
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_queue(stop))
+        tasks = list()
+        count = int(rate * duration)
+        start = time.perf_counter()
+        for index in range(count):
+            arrival = start + index / rate
+            await asyncio.sleep(max(arrival - time.perf_counter(), 0))
+            report.submitted += 1
+            tasks.append(asyncio.create_task(execute(trace[index % len(trace)], arrival)))
+        report.submit_time = time.perf_counter() - start
+        await asyncio.gather(*tasks)
+        report.wall_time = time.perf_counter() - start
+        stop.set()
+        await sampler
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a request trace against a backend with a fake Docker client.")
+    parser.add_argument("--backend", choices=["sync", "async"], default="async")
+    parser.add_argument("--trace", help="JSONL file of /execute payloads (default: a synthetic mix)")
+    parser.add_argument("--rates", default="2,5,10,20", help="comma separated request rates (requests per second) to step through")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per rate step")
+    parser.add_argument("--latency", help="fake Docker latencies, i.e. run=0.2,container_start=0.5 (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative jitter of the fake latencies")
+    parser.add_argument("--workers", type=int, default=None, help="async backend workers (default: one per leasable core)")
+    parser.add_argument("--concurrency", type=int, default=4, help="sync backend workers, emulated by threads")
+    parser.add_argument("--cache", action="store_true", help="let the result cache answer repeated payloads (off by default, every request runs)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args()
+
+    trace = load_trace(args.trace, size=1000, seed=args.seed)
+    if not args.cache:
+        trace = [{"cache": False, **payload} for payload in trace]
+    output = os.path.abspath(args.output) if args.output else None
+
+    # Caches, result spill files and logs of the backend go to a scratch directory, not to the home of the user.
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    scratch = tempfile.mkdtemp(prefix="monolith-loadtest-")
+    os.environ["HOME"] = scratch
+    os.chdir(scratch)
+    sys.path.insert(0, source_dir)
+
+    fake_client = FakeDockerClient(latencies=parse_latencies(args.latency), jitter=args.jitter, seed=args.seed)
+    docker.from_env = lambda *_, **__: fake_client
+
+    if args.backend == "sync":
+        # Gunicorn builds the ready images in the master (gunicorn_config.on_starting), the async backend does it on import.
+        prepare_images()
+    module = importlib.import_module(f"{args.backend}_backend")
+    if args.backend == "async" and args.workers:
+        module.number_of_worker = args.workers
+        module.app.manager = module.MonolithManager(
+            number_of_worker=args.workers, queue_size=module.task_queue_size, result_memory_budget=module.result_memory_budget,
+            result_ttl=module.result_ttl, mem_limit=module.mem_limit, smt_exclusive=False,
+        )
+
+    process = psutil.Process()
+    reports: List[StepReport] = list()
+    print(f"{args.backend} backend, {len(trace)} requests in the trace, latencies {fake_client.latencies}")
+    print(f"{'offered':>9}{'rps':>9}{'p50':>9}{'p99':>9}{'rejected':>10}{'errors':>8}{'max queue':>11}{'rss +MB':>9}")
+    for rate in [float(rate) for rate in args.rates.split(",")]:
+        rss_before = process.memory_info().rss
+        if args.backend == "async":
+            report = asyncio.run(run_async(module, trace, rate, args.duration))
+        else:
+            report = run_sync(module, trace, rate, args.duration, args.concurrency)
+        report.rss_before, report.rss_after = rss_before, process.memory_info().rss
+        reports.append(report)
+        row = report.to_dict()
+        print(
+            f"{rate:>9.1f}{row['throughput_rps']:>9.1f}{row['p50']:>8.2f}s{row['p99']:>8.2f}s"
+            f"{row['rejected']:>10}{row['errors']:>8}{row['max_queue_depth']:>11}{row['rss_growth_mb']:>9.1f}"
+        )
+
+    saturation = next((report.rate for report in reports if report.saturated(reports[0] if report is not reports[0] else None)), None)
+    print(f"Saturation point: {f'{saturation:.1f} rps' if saturation else 'not reached'}")
+    print(f"Memory growth over the run: {(reports[-1].rss_after - reports[0].rss_before) / 1024 ** 2:.1f} MB")
+    print(f"Fake Docker calls: {fake_client.calls}")
+    if output:
+        with open(output, "w") as f:
+            json.dump({"backend": args.backend, "steps": [report.to_dict() for report in reports], "saturation_rps": saturation}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
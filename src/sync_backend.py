@@ -4,39 +4,95 @@
 # Date: 2025-04-06
 
 import os
+import time
 import uuid
 import psutil
 import logging
 import traceback
-import timeout_decorator
 
-from llm_sandbox import SandboxSession
-from logging.handlers import RotatingFileHandler
-from flask import Flask, request, jsonify, redirect
+from llm_sandbox import SandboxSession, ContainerPool, LibraryImageCache, ArtifactCache, BuildCache, ResultCache, InputStore, Metrics
+from llm_sandbox.image import get_ready_languages
+from llm_sandbox.client import registry as docker_clients
+from llm_sandbox.image_registry import get_image_registry
+from llm_sandbox.repeat import run_repeated, parse_repeat
+from llm_sandbox.input_store import parse_digest
+from llm_sandbox.structured_log import setup_logging, correlation
+from flask import Flask, Response, request, jsonify, redirect
+from werkzeug.exceptions import RequestEntityTooLarge
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
 
-# Logging Configuration
-log_handler = RotatingFileHandler(
-    filename='monolith.log',
-    maxBytes=100 * 1024 * 1024,
-    backupCount=5
-)
-log_handler.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s', '%Y-%m-%d %H:%M:%S')
-log_handler.setFormatter(formatter)
-
+# Logging Configuration (JSON lines written off the request path, shared with gunicorn_config)
+log_file = 'monolith.log'
+log_sample_rates = {'monolith.request': 1.0}  # fraction of the tasks whose request payload is logged
+log_max_payload_chars = 256                   # longer strings of a payload are logged as their head, size and SHA-256
+log_pipeline = setup_logging(filename=log_file, sample_rates=log_sample_rates, max_payload_chars=log_max_payload_chars)
 logger = logging.getLogger()
-logger.handlers.clear()
-logger.setLevel(logging.INFO)
-logger.addHandler(log_handler)
+request_logger = logging.getLogger('monolith.request')
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
 
 worker_id = int(os.getenv("GUNICORN_WORKER_ID", "0"))
 cpu_core_id = int(os.getenv("GUNICORN_CPU_CORE_ID", "0"))
+cpu_idle_siblings = os.getenv("GUNICORN_CPU_IDLE_SIBLINGS", "")
+housekeeping_cpus = os.getenv("GUNICORN_HOUSEKEEPING_CPUS", "")
+number_of_worker = int(os.getenv("GUNICORN_NUMBER_OF_WORKERS", "1"))
 logger.info(f"[+] Worker-{worker_id} started on CPU-{cpu_core_id}.")
 
+# Build Cache Configuration (Cargo registry / target templates, GOCACHE / GOMODCACHE)
+build_cache_budget = 10 * 1024 ** 3  # bytes per language before the volumes are pruned
+build_cache_prune_interval = 3600    # seconds between two pruning runs on the host
+build_cache = BuildCache(max_bytes=build_cache_budget, prune_interval=build_cache_prune_interval)
+build_cache.start_pruner()
+
+# Input Store Configuration (large stdin and test data, shared by the workers and mounted read-only into the containers)
+input_store_budget = 20 * 1024 ** 3  # bytes of uploaded inputs kept on disk
+max_input_bytes = 1024 ** 3          # bytes of a single upload to /inputs
+input_store = InputStore(max_bytes=input_store_budget, max_input_bytes=max_input_bytes)
+
+# Container Pool Configuration
+pool_size = 1           # idle containers kept per (language, container profile)
+pool_max_reuse = 64     # tasks served by one container before it is recycled
+pool_idle_timeout = 600 # seconds before an idle container is evicted
+container_pool = ContainerPool(pool_size=pool_size, max_reuse=pool_max_reuse, idle_timeout=pool_idle_timeout, build_cache=build_cache, input_store=input_store)
+
+# Library Image Cache Configuration
+library_cache_budget = 20 * 1024 ** 3  # bytes of derived library images kept on disk
+library_cache = LibraryImageCache(disk_budget=library_cache_budget)
+
+# Compiled Artifact Cache Configuration
+artifact_cache_budget = 5 * 1024 ** 3  # bytes of compiled binaries kept on disk
+artifact_cache = ArtifactCache(max_bytes=artifact_cache_budget)
+
+# Result Cache Configuration (per worker)
+result_cache_entries = 10000  # finished results served again to identical requests
+result_cache_budget = 64 * 1024 ** 2  # bytes of those results kept in memory
+result_cache_ttl = 3600  # seconds a cached result is served
+result_cache = ResultCache(max_entries=result_cache_entries, memory_budget=result_cache_budget, ttl=result_cache_ttl)
+
+# Ready images are built by the master (gunicorn_config.on_starting) before the workers fork.
+ready_languages = get_ready_languages()
+
+# Image Registry Configuration: the master pulled and validated the default images, each worker resolves them once.
+image_registry = get_image_registry()
+for lang, image in image_registry.prepare(pull=False).items():
+    if image.startswith('error'):
+        logger.warning(f"[-] Worker-{worker_id} image for {lang} is not usable: {image}")
+
+# Metrics Configuration (the workers share MONOLITH_METRICS_DIR, set up by gunicorn_config.on_starting)
+metrics = Metrics(directory=os.getenv("MONOLITH_METRICS_DIR"))
+
+# Deadline Configuration (enforced by the session: in-container timeout plus a host watchdog)
+setup_timeout = 120          # seconds to prepare the container
+default_compile_timeout = 60 # seconds to compile, unless the request sets compile_timeout
+max_compile_timeout = 300
+max_repeat = 50              # measured runs of a request with "repeat"
+max_warmup = 10              # discarded runs of a request with "warmup"
+max_repeat_time = 300        # seconds after which a repeated request starts no further run
+max_output_bytes = 8 * 1024 ** 2  # bytes of stdout and of stderr returned per run, the rest is only counted in total_bytes
+sandboxes = ('docker',)  # "sandbox" of a request: a pooled container, add 'process' for a confined host process
+process_sandbox_clients = set()  # API keys (X-API-Key) allowed to use the process sandbox, it shares the kernel and interpreters of the host
+
 @app.route('/')
 def index():
     logger.info(f"[+] Worker-{worker_id} received a request to index.")
@@ -51,6 +107,42 @@ def handle_global_exception(e):
         "trace": traceback.format_exc()
     }), 500
 
+
+@app.route('/status', methods=['GET'])
+def get_status():
+    mem = psutil.virtual_memory()
+    return jsonify({
+        'worker_id': worker_id,
+        'cpu_core_id': cpu_core_id,
+        'number_of_worker': number_of_worker,
+        'languages': ready_languages,
+        'core_lease': {
+            'cpu': cpu_core_id,
+            'idle_siblings': [int(cpu) for cpu in cpu_idle_siblings.split(",") if cpu],
+            'housekeeping_cpus': [int(cpu) for cpu in housekeeping_cpus.split(",") if cpu],
+        },
+        'container_pool': container_pool.get_status(),
+        'library_cache': library_cache.get_status(),
+        'artifact_cache': artifact_cache.get_status(),
+        'result_cache': result_cache.get_status(),
+        'build_cache': build_cache.get_status(),
+        'input_store': input_store.get_status(),
+        'docker_client': docker_clients.get_status(),
+        'image_registry': image_registry.get_status(),
+        'logging': log_pipeline.get_status(),
+        'memory_usage': {
+            'total': mem.total / (1024 ** 3),
+            'used_gb': mem.used / (1024 ** 3),
+            'available': mem.available / (1024 ** 3),
+            'percent': mem.percent
+        },
+    }), 200
+
+    
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
     
 @app.route('/execute', methods=['POST'])
 def handle_execute():
@@ -62,29 +154,106 @@ def handle_execute():
         # Input Validation
         if not code: return jsonify({"status": "error", "error": "No code provided"}), 400
         if not language: return jsonify({"status": "error", "error": "No language provided"}), 400
+        if input_dict.get("sandbox", "docker") not in sandboxes: return jsonify({"status": "error", "error": f"Unknown sandbox, must be one of {sandboxes}"}), 400
+        # The process sandbox is for trusted code only, whatever the client asks for.
+        if input_dict.get("sandbox") == "process" and request.headers.get("X-API-Key") not in process_sandbox_clients: return jsonify({"status": "error", "error": "The process sandbox is reserved for trusted API keys"}), 403
+        try:
+            parse_repeat(input_dict, max_repeat, max_warmup)
+            missing_inputs = input_store.find_missing(input_dict)
+        except ValueError as e:
+            return jsonify({"status": "error", "error": str(e)}), 400
+        if missing_inputs: return jsonify({"status": "error", "error": f"Unknown inputs, upload them to /inputs first: {missing_inputs}"}), 400
         
         # Metadata
         task_id = str(uuid.uuid4())
-        logger.info(f"[+] Worker-{worker_id} is processing the request ({task_id}) on CPU-{cpu_core_id}: {input_dict}")
-        
-        # Task Execution
-        response = task_process(input_dict, cpu_core_id, task_id)
-        logger.info(f"[+] Worker-{worker_id} finished processing the request ({task_id})")
-        
+        with correlation(task_id):
+            request_logger.info(f"[+] Worker-{worker_id} is processing the request ({task_id}) on CPU-{cpu_core_id}", extra={'request': input_dict})
+
+            # Task Execution
+            response = cached_task_process(input_dict, cpu_core_id, task_id)
+            logger.info(f"[+] Worker-{worker_id} finished processing the request ({task_id})")
+
         return jsonify(response), 200
     except Exception as e:
         logger.exception("handle_execute failed")
         return jsonify({"status": "error", "error": str(e)}), 500
 
 
+@app.route('/inputs', methods=['POST'])
+def handle_upload_input():
+    # Large stdin and test data are uploaded once and referenced by digest in /execute (stdin_digest, input_files).
+    try:
+        request.max_content_length = max_input_bytes
+        digest = input_store.put(request.stream)
+        size = input_store.get_size(digest)
+        logger.info(f"[+] Worker-{worker_id} stored input {digest} ({size} bytes)")
+        return jsonify({"status": "success", "digest": digest, "size": size}), 200
+    except (ValueError, RequestEntityTooLarge) as e:
+        return jsonify({"status": "error", "error": str(e)}), 413
+
+
+@app.route('/inputs/<digest>', methods=['GET'])
+def get_input(digest):
+    try:
+        size = input_store.get_size(digest)
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+    if size is None:
+        return jsonify({"status": "error", "error": "Input not found"}), 404
+    return jsonify({"status": "success", "digest": f"sha256:{parse_digest(digest)}", "size": size}), 200
+
+
+def cached_task_process(input_dict: dict, cpu_core_id: int, task_id: str) -> dict:
+    # Identical requests are answered from the cache of this worker, or wait for the identical request in flight.
+    fingerprint = result_cache.fingerprint(input_dict)
+    if fingerprint is None:
+        metrics.inc('result_cache_total', outcome='bypass')
+        return task_process(input_dict, cpu_core_id, task_id)
+
+    cached = result_cache.lookup(fingerprint)
+    if cached is not None:
+        metrics.inc('result_cache_total', outcome='hit')
+        if metrics.directory:
+            metrics.flush()
+        return {**cached, 'task_id': task_id, 'cached': True}
+
+    # Gunicorn sync workers serve one request at a time, so an identical request in flight in the same worker only
+    # happens under a threaded server (i.e. app.run() below). The cache itself is not shared between workers.
+    in_flight = result_cache.attach(fingerprint, task_id, store=result_cache.storable(input_dict))
+    if in_flight is not None:
+        metrics.inc('result_cache_total', outcome='coalesced')
+        in_flight['done'].wait()
+        if in_flight['result'] is not None:
+            if metrics.directory:
+                metrics.flush()
+            return {**in_flight['result'], 'task_id': task_id, 'coalesced_with': in_flight['leader']}
+        # The identical request failed, so this one runs on its own.
+        return task_process(input_dict, cpu_core_id, task_id)
+
+    metrics.inc('result_cache_total', outcome='miss')
+    response = None
+    try:
+        response = task_process(input_dict, cpu_core_id, task_id)
+    finally:
+        result_cache.complete(fingerprint, response if response and response['status'] == 'success' else None)
+    return response
+
+
 def task_process(input_dict: dict, cpu_core_id: int, task_id: str) -> dict:
     # Task Attributes
     code = input_dict['code']
     libraries = input_dict.get('libraries', [])
     language = input_dict['language']
     timeout = min(input_dict.get('timeout', 30), 120)
+    compile_timeout = min(input_dict.get('compile_timeout', default_compile_timeout), max_compile_timeout)
     run_profiling = input_dict.get('run_profiling', False)
     stdin = input_dict.get('stdin', None)
+    stdin_digest = input_dict.get('stdin_digest', None)
+    input_files = input_dict.get('input_files', None)
+    use_process = input_dict.get('sandbox', 'docker') == 'process'
+    # Validated and bounded by handle_execute(), see parse_repeat()
+    repeat = input_dict.get('repeat') or 1
+    warmup = input_dict.get('warmup') or 0
     
     # Docker Container Configuration
     container_configs = {
@@ -104,34 +273,113 @@ def task_process(input_dict: dict, cpu_core_id: int, task_id: str) -> dict:
     }
     
     # Sandbox Execution
-    session = SandboxSession(lang=language, verbose=False, container_configs=container_configs)
-    try:
-        session.open()
-        logger.info(f"[+] Worker-{worker_id} created a new session container {session.container.name}")
+    session = None
+    image = None
+    reusable = False
+    phase_times = dict()
+    phase_start = time.perf_counter()
 
-        @timeout_decorator.timeout(timeout, use_signals=False)
-        def setup_and_run(libraries, code, stdin, run_profiling):
-            session.setup(libraries=libraries, run_profiling=run_profiling)
-            return session.run(code=code, stdin=stdin, run_profiling=run_profiling)
+    def end_phase(phase):
+        nonlocal phase_start
+        now = time.perf_counter()
+        phase_times[phase] = phase_times.get(phase, 0.0) + now - phase_start
+        phase_start = now
+
+    try:
+        if use_process:
+            if libraries:
+                raise ValueError("Libraries are only installed by the Docker sandbox")
+            # A confined host process per task, it starts in milliseconds so it is not pooled.
+            session = SandboxSession(lang=language, container_configs=container_configs, use_process=True, input_store=input_store)
+            session.open()
+            end_phase('container_start')
+            logger.info(f"[+] Worker-{worker_id} opened process sandbox {session.root}")
+        else:
+            # Libraries are baked into a cached derived image, so the container only has to run the code.
+            if libraries:
+                image = library_cache.acquire(language, libraries, timeout=setup_timeout)
+                end_phase('image_lookup')
+            session = container_pool.acquire(language, container_configs, image=image)
+            end_phase('container_start')
+            logger.info(f"[+] Worker-{worker_id} acquired session container {session.container.name}")
 
         try:
-            result = setup_and_run(libraries, code, stdin, run_profiling)
+            session.setup(libraries=[], run_profiling=run_profiling, timeout=setup_timeout)
+            end_phase('setup')
+            if repeat > 1 or warmup:
+                # Warm runs in the same container, summarized in output_dict['repeat'].
+                result = run_repeated(
+                    session,
+                    code,
+                    stdin,
+                    repeat,
+                    warmup,
+                    include_samples=input_dict.get('include_samples', False),
+                    run_profiling=run_profiling,
+                    time_budget=max_repeat_time,
+                    artifact_cache=artifact_cache,
+                    compile_timeout=compile_timeout,
+                    run_timeout=timeout,
+                    max_output_bytes=max_output_bytes,
+                    stdin_digest=stdin_digest,
+                    input_files=input_files,
+                )
+            else:
+                result = session.run(
+                    code=code,
+                    stdin=stdin,
+                    run_profiling=run_profiling,
+                    artifact_cache=artifact_cache,
+                    compile_timeout=compile_timeout,
+                    run_timeout=timeout,
+                    max_output_bytes=max_output_bytes,
+                    stdin_digest=stdin_digest,
+                    input_files=input_files,
+                )
+            phase_times.update(result.pop('phase_times'))
             response['output_dict'] = result
-            response['status'] = 'success'
+            if result['timeout_phase']:
+                # The measurements up to the deadline are kept in output_dict.
+                response['status'] = 'timeout'
+                response['error'] = f"Task timed out ({result['timeout_phase']})."
+            else:
+                response['status'] = 'success'
+                reusable = True
         except TimeoutError:
             response['status'] = 'timeout'
             response['error'] = 'Task timed out.'
         except Exception as e:
             response['error'] = str(e)
 
+    except TimeoutError:
+        # Installing the libraries took longer than the setup may.
+        response['status'] = 'timeout'
+        response['error'] = 'Task timed out.'
     except Exception as e:
         logger.error(f"[!!] Sandbox setup failed ({task_id})")
         response['error'] = str(e)
     finally:
+        phase_start = time.perf_counter()
         try:
-            session.close()
+            if session and use_process:
+                session.close()
+            elif session:
+                container_pool.release(session, reusable=reusable)
+            if image:
+                library_cache.release(image)
         except Exception as cleanup_error:
             logger.error(f"Failed to clean up container: {cleanup_error}")
+        end_phase('teardown')
+
+    output_dict = response['output_dict'] or {}
+    response['phase_times'] = phase_times
+    metrics.record_task(
+        language,
+        response['status'],
+        phase_times=phase_times,
+        timeout_phase=output_dict.get('timeout_phase') or ('setup' if response['status'] == 'timeout' else None),
+        oom_killed=bool(output_dict.get('oom_killed')),
+    )
     return response
 
 if __name__ == '__main__':